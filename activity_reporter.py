@@ -1,7 +1,6 @@
 """
 קובץ פשוט לדיווח פעילות - העתק את הקובץ הזה לכל בוט
 """
-from pymongo import MongoClient
 from datetime import datetime, timezone
 
 class SimpleActivityReporter:
@@ -10,19 +9,30 @@ class SimpleActivityReporter:
         mongodb_uri: חיבור למונגו (אותו מהבוט המרכזי)
         service_id: מזהה השירות ב-Render
         service_name: שם הבוט (אופציונלי)
+        החיבור נפתח רק בדיווח הראשון - לא מעכב את עליית הבוט
         """
+        self.mongodb_uri = mongodb_uri
+        self.service_id = service_id
+        self.service_name = service_name or service_id
+        self.client = None
+        self.db = None
+        self.connected = True
+    
+    def _connect(self):
+        """פתיחת החיבור למונגו (פעם אחת)"""
         try:
-            self.client = MongoClient(mongodb_uri)
+            from pymongo import MongoClient
+            
+            self.client = MongoClient(self.mongodb_uri)
             self.db = self.client["render_bot_monitor"]
-            self.service_id = service_id
-            self.service_name = service_name or service_id
-            self.connected = True
         except:
             self.connected = False
             print("⚠️ לא ניתן להתחבר למונגו - פעילות לא תירשם")
     
     def report_activity(self, user_id):
         """דיווח פעילות פשוט"""
+        if self.db is None and self.connected:
+            self._connect()
         if not self.connected:
             return
         
@@ -0,0 +1,144 @@
+"""
+מפסק זרם (circuit breaker) ותקציב זמן לקריאות חיצוניות.
+אחרי כמה כשלונות רצופים המפסק נפתח וקריאות נכשלות מיד, בלי לחכות ל-timeout;
+אחרי זמן ההתאוששות עוברת קריאת בדיקה אחת - הצלחה סוגרת אותו, כשלון פותח מחדש.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """המפסק פתוח - השירות נחשב לא זמין כרגע"""
+
+
+class DeadlineExceeded(Exception):
+    """נגמר תקציב הזמן של הבדיקה"""
+
+
+class CircuitBreaker:
+    """מפסק זרם לשירות אחד - בטוח לשימוש מכמה threads"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 60):
+        """
+        failure_threshold: כמה כשלונות רצופים פותחים את המפסק
+        recovery_timeout: כמה שניות המפסק נשאר פתוח לפני קריאת בדיקה
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """האם קריאה עשויה לעבור עכשיו (בלי לתפוס את קריאת הבדיקה)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self._opened_at >= self.recovery_timeout
+            return not self._probe_in_flight
+
+    def allow(self) -> bool:
+        """האם לבצע את הקריאה - במצב חצי פתוח עוברת רק קריאת בדיקה אחת"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        """קריאה הצליחה - סגירת המפסק"""
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit '{self.name}' closed - service recovered")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """קריאה נכשלה (או חרגה מהזמן) - פתיחת המפסק אחרי מספיק כשלונות רצופים"""
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(f"Circuit '{self.name}' opened after {self.failures} consecutive failures")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    @contextmanager
+    def guard(self):
+        """עטיפת קריאה: זורק CircuitOpenError אם המפסק פתוח, ורושם הצלחה או כשלון"""
+        if not self.allow():
+            raise CircuitOpenError(f"circuit '{self.name}' is open")
+        try:
+            yield
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+
+
+class BreakerRegistry:
+    """מפסק נפרד לכל מפתח (למשל לכל אתר) - נוצר בעצלות"""
+
+    def __init__(self, failure_threshold: int = 3, recovery_timeout: float = 300, max_keys: int = 10000):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._breakers = TTLCache(maxsize=max_keys, ttl=max(recovery_timeout * 10, 3600))
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CircuitBreaker:
+        """המפסק של המפתח"""
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = CircuitBreaker(key, self.failure_threshold, self.recovery_timeout)
+                    self._breakers.set(key, breaker)
+        return breaker
+
+
+class Deadline:
+    """תקציב זמן לבדיקה אחת - כל קריאה בדרך מקבלת timeout שלא חורג ממנו"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """כמה שניות נשארו (לא פחות מ-0)"""
+        return max(self._expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, default: float) -> float:
+        """ה-timeout לקריאה הבאה - הקטן מבין ברירת המחדל והזמן שנשאר"""
+        return min(default, self.remaining())
+
+    def check(self):
+        """זריקת DeadlineExceeded אם הזמן נגמר"""
+        if self.expired():
+            raise DeadlineExceeded(f"check exceeded its {self.seconds}s budget")
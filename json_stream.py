@@ -0,0 +1,83 @@
+"""
+פרסור מצטבר של מערך JSON שמגיע בחלקים (streaming) -
+כל אובייקט ברמה העליונה של המערך מוחזר ברגע שהוא נסגר, בלי לחכות לסוף התשובה.
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class JSONArrayStreamParser:
+    """מפרסר מצטבר למערך JSON של אובייקטים - מתעלם מטקסט לפני המערך (כמו ```json)"""
+
+    def __init__(self):
+        self.text = ""
+        self.objects_found = 0
+        self._pos = 0
+        self._in_array = False
+        self._closed = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = None
+
+    def feed(self, chunk: str) -> list:
+        """הוספת חלק מהתשובה - מחזיר את האובייקטים שהושלמו בחלק הזה"""
+        self.text += chunk
+        completed = []
+        text = self.text
+
+        for i in range(self._pos, len(text)):
+            if self._closed:
+                break
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if not self._in_array:
+                if ch == "[":
+                    self._in_array = True
+                    self._depth = 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if ch == "{" and self._depth == 1:
+                    self._object_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if ch == "}" and self._depth == 1 and self._object_start is not None:
+                    try:
+                        completed.append(json.loads(text[self._object_start:i + 1]))
+                    except ValueError as e:
+                        logger.debug(f"Skipping malformed streamed object: {e}")
+                    self._object_start = None
+                elif self._depth == 0:
+                    if self.objects_found or completed:
+                        self._closed = True
+                    else:
+                        # סוגריים בטקסט חופשי (למשל קישור markdown) - ממשיכים לחפש את המערך
+                        self._in_array = False
+
+        self._pos = len(text)
+        self.objects_found += len(completed)
+        return completed
+
+    def is_json(self) -> bool:
+        """האם התשובה הייתה מערך JSON (גם ריק)"""
+        if self.objects_found:
+            return True
+        try:
+            return isinstance(json.loads(self.text), list)
+        except ValueError:
+            return False
@@ -0,0 +1,146 @@
+"""
+בחירת מנהיג מבוססת חכירה (lease) - רק המופע שמחזיק בחכירה מריץ את הבדיקות המתוזמנות.
+החכירה נשמרת בבסיס הנתונים הפעיל: מסמך ב-MongoDB או שורה ב-SQLite.
+"""
+import logging
+import os
+from abc import ABC, abstractmethod
+import socket
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def make_holder_id() -> str:
+    """מזהה ייחודי למופע הנוכחי - שם מארח, תהליך וסיומת אקראית"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class BaseLeaderLease(ABC):
+    """לוגיקה משותפת - מעקב מקומי אחרי תוקף החכירה"""
+
+    def __init__(self, name: str, ttl_seconds: int, holder_id: str = None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.holder_id = holder_id or make_holder_id()
+        self._held_until = 0.0
+
+    def is_leader(self) -> bool:
+        """האם המופע הנוכחי מחזיק בחכירה בתוקף"""
+        return time.monotonic() < self._held_until
+
+    def try_acquire(self) -> bool:
+        """ניסיון לקחת או לחדש את החכירה - מחזיר True אם המופע הוא המנהיג"""
+        was_leader = self.is_leader()
+        started = time.monotonic()
+        try:
+            acquired = self._try_acquire()
+        except Exception as e:
+            logger.error(f"Leader lease '{self.name}' renewal failed: {e}")
+            acquired = False
+
+        if acquired:
+            # מודדים מתחילת הניסיון כדי לא להאריך מעבר לחכירה בפועל
+            self._held_until = started + self.ttl_seconds
+            if not was_leader:
+                logger.info(f"Acquired leader lease '{self.name}' as {self.holder_id}")
+        else:
+            self._held_until = 0.0
+            if was_leader:
+                logger.warning(f"Lost leader lease '{self.name}' ({self.holder_id})")
+        return acquired
+
+    def release(self):
+        """שחרור החכירה (בכיבוי) כדי שמופע אחר ייקח אותה מיד"""
+        if not self.is_leader():
+            return
+        self._held_until = 0.0
+        try:
+            self._release()
+            logger.info(f"Released leader lease '{self.name}'")
+        except Exception as e:
+            logger.error(f"Error releasing leader lease '{self.name}': {e}")
+
+    @abstractmethod
+    def _try_acquire(self) -> bool:
+        """לקיחה/חידוש של החכירה באחסון - True אם המופע מחזיק בה"""
+
+    @abstractmethod
+    def _release(self):
+        """מחיקת החכירה מהאחסון אם המופע מחזיק בה"""
+
+
+class SQLiteLeaderLease(BaseLeaderLease):
+    """חכירה בטבלת SQLite - לכמה תהליכים על אותו שרת"""
+
+    def __init__(self, db_path: str, name: str, ttl_seconds: int, holder_id: str = None):
+        super().__init__(name, ttl_seconds, holder_id)
+        self.db_path = db_path
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS leader_leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def _try_acquire(self) -> bool:
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        # לוקחים את החכירה רק אם היא שלנו או שפג תוקפה
+        cursor.execute('''
+            INSERT INTO leader_leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leader_leases.holder = excluded.holder OR leader_leases.expires_at < ?
+        ''', (self.name, self.holder_id, now + self.ttl_seconds, now))
+        acquired = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return acquired
+
+    def _release(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('DELETE FROM leader_leases WHERE name = ? AND holder = ?', (self.name, self.holder_id))
+        conn.commit()
+        conn.close()
+
+
+class MongoLeaderLease(BaseLeaderLease):
+    """חכירה במסמך MongoDB - לכמה מופעים על שרתים שונים"""
+
+    def __init__(self, database, name: str, ttl_seconds: int, holder_id: str = None):
+        super().__init__(name, ttl_seconds, holder_id)
+        self.collection = database.leader_leases
+
+    def _try_acquire(self) -> bool:
+        from pymongo.errors import DuplicateKeyError
+
+        now = datetime.utcnow()
+        try:
+            # upsert נכשל ב-DuplicateKeyError אם מופע אחר מחזיק בחכירה בתוקף
+            self.collection.update_one(
+                {"_id": self.name, "$or": [{"holder": self.holder_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"holder": self.holder_id, "expires_at": now + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def _release(self):
+        self.collection.delete_one({"_id": self.name, "holder": self.holder_id})
+
+
+def create_leader_lease(name: str, ttl_seconds: int, db_path: str = None, mongo_db=None):
+    """יצירת חכירת מנהיג על בסיס הנתונים הפעיל"""
+    if mongo_db is not None:
+        return MongoLeaderLease(mongo_db, name, ttl_seconds)
+    return SQLiteLeaderLease(db_path, name, ttl_seconds)
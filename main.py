@@ -1,4 +1,5 @@
-from openai import OpenAI
+from __future__ import annotations
+
 import os, subprocess
 VERSION = "2025-01-27-15:00"  # עדכן בכל דיפלוי - תיקון MongoDB persistence
 print(f"[BOOT] VERSION={VERSION}")
@@ -14,21 +15,38 @@ import threading
 import sqlite3
 import json
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from typing import List, Dict, Any, TYPE_CHECKING
 import asyncio
 import re
+from concurrent.futures import ThreadPoolExecutor
+import signal
+import hashlib
+import shutil
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 import requests
-from pymongo import MongoClient
-from motor.motor_asyncio import AsyncIOMotorClient
-from bson import ObjectId
 import time
 
+# ספריות כבדות נטענות רק כשהחלק שמשתמש בהן מופעל: openai בחיפוש הראשון, pymongo/bson ב-WatchBotMongoDB,
+# flask ו-telegram.ext רק בהפעלת הבוט (ה-worker לא צריך אותם)
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters
 from telegram.constants import ParseMode
-from flask import Flask, jsonify
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from activity_reporter import create_reporter
+from state_store import create_state_store
+from leader_lease import create_leader_lease, make_holder_id
+from work_queue import create_work_queue
+from pending_checks import create_pending_checks
+from seen_filter import SeenResultsFilter
+from ttl_cache import TTLCache
+from records import Topic, SearchResult, UsageInfo
+from json_stream import JSONArrayStreamParser
+from refine_history import RefinementHistory
+from circuit_breaker import CircuitBreaker, BreakerRegistry, Deadline, CircuitOpenError
+from search_providers import SearchRouter, PerplexityProvider, TavilyProvider
+from tracing import create_tracer, CorrelationIdFilter, propagate, set_attribute, span as trace_span, traced
+
+if TYPE_CHECKING:
+    from telegram.ext import Application, ContextTypes
 
 # Future-proof LinkPreviewOptions handling for PTB compatibility
 try:
@@ -42,9 +60,12 @@ except Exception:
 # הגדרת לוגינג
 logging.basicConfig(
     level=os.getenv("LOG_LEVEL", "DEBUG"),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    format="%(asctime)s - %(name)s - %(levelname)s - %(check_tag)s%(message)s"
 )
 logger = logging.getLogger(__name__)
+# מזהה הבדיקה (correlation id) בכל שורת לוג שנכתבת בזמן בדיקת נושא
+for handler in logging.getLogger().handlers:
+    handler.addFilter(CorrelationIdFilter())
 
 # הפחתת רעש מספריות רועשות - quieter logs
 for noisy in ("httpcore", "httpx", "urllib3", "apscheduler", "werkzeug", "telegram"):
@@ -52,7 +73,22 @@ for noisy in ("httpcore", "httpx", "urllib3", "apscheduler", "werkzeug", "telegr
 
 # --- הגדרות ה-API של Perplexity ---
 API_KEY = os.getenv("PERPLEXITY_API_KEY")
-client = OpenAI(api_key=API_KEY, base_url="https://api.perplexity.ai")
+# כתובת ה-API - ניתן להפנות לשרת תואם OpenAI מקומי (למשל בבנצ'מרק)
+PERPLEXITY_BASE_URL = os.getenv("PERPLEXITY_BASE_URL", "https://api.perplexity.ai")
+
+# הלקוח נוצר בחיפוש הראשון - טעינת ספריית openai היא החלק הכבד ביותר בהפעלה
+_search_client = None
+_search_client_lock = threading.Lock()
+
+def get_search_client():
+    """לקוח ה-API של Perplexity (נוצר בעצלות, פעם אחת)"""
+    global _search_client
+    if _search_client is None:
+        with _search_client_lock:
+            if _search_client is None:
+                from openai import OpenAI
+                _search_client = OpenAI(api_key=API_KEY, base_url=PERPLEXITY_BASE_URL)
+    return _search_client
 
 # משתני סביבה
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -65,11 +101,83 @@ MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
 MONGODB_DB_NAME = os.getenv('MONGODB_DB_NAME', 'watchbot')
 USE_MONGODB = os.getenv('USE_MONGODB', 'false').lower() == 'true'
 
+# מאגר מצבי שיחה: memory / sqlite / mongo
+STATE_STORE_BACKEND = os.getenv('STATE_STORE_BACKEND', 'memory')
+STATE_TTL_SECONDS = int(os.getenv('STATE_TTL_SECONDS', 30 * 60))
+STATE_MAX_ENTRIES = int(os.getenv('STATE_MAX_ENTRIES', 10000))
+
+# חכירת מנהיג - רק מופע אחד מריץ את הבדיקות המתוזמנות
+LEADER_LEASE_TTL_SECONDS = int(os.getenv('LEADER_LEASE_TTL_SECONDS', 30))
+LEADER_LEASE_RENEW_SECONDS = int(os.getenv('LEADER_LEASE_RENEW_SECONDS', 10))
+
+# המתנה בין נושאים בבדיקה האוטומטית (בלי תור עבודה) - למניעת עומס על ה-API
+CHECK_TOPICS_DELAY_SECONDS = float(os.getenv('CHECK_TOPICS_DELAY_SECONDS', 2))
+
+# תור עבודה לבדיקות - כשמופעל, הבדיקות רצות בתהליכי worker נפרדים (python main.py --worker)
+WORK_QUEUE_ENABLED = os.getenv('WORK_QUEUE_ENABLED', 'false').lower() == 'true'
+WORK_QUEUE_VISIBILITY_SECONDS = int(os.getenv('WORK_QUEUE_VISIBILITY_SECONDS', 300))
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv('WORK_QUEUE_MAX_ATTEMPTS', 5))
+WORKER_POLL_SECONDS = int(os.getenv('WORKER_POLL_SECONDS', 5))
+
+# שמירת תוצאות - אחרי כמה ימים תוצאה מלאה נדחסת לטביעת אצבע בלבד
+RESULT_RETENTION_DAYS = int(os.getenv('RESULT_RETENTION_DAYS', 90))
+
+# מסנני Bloom לתוצאות שכבר נראו - דחיית כפילויות בזיכרון לפני פנייה לבסיס הנתונים
+SEEN_FILTER_DIR = os.getenv('SEEN_FILTER_DIR', os.path.join(os.path.dirname(DB_PATH), 'seen_filters'))
+SEEN_FILTER_CAPACITY = int(os.getenv('SEEN_FILTER_CAPACITY', 1000))
+SEEN_FILTER_ERROR_RATE = float(os.getenv('SEEN_FILTER_ERROR_RATE', 0.001))
+SEEN_FILTER_SNAPSHOT_MINUTES = int(os.getenv('SEEN_FILTER_SNAPSHOT_MINUTES', 15))
+
+# חיפוש ב-streaming - כל תוצאה נבדקת ברגע שהמודל סיים לכתוב אותה
+SEARCH_STREAMING = os.getenv('SEARCH_STREAMING', 'true').lower() == 'true'
+SEARCH_VALIDATION_WORKERS = int(os.getenv('SEARCH_VALIDATION_WORKERS', 4))
+# הרצת החיפוש המעודן במקביל לראשי, לנושאים/סוגי שאילתות שבדרך כלל צריכים אותו
+SEARCH_SPECULATIVE_REFINE = os.getenv('SEARCH_SPECULATIVE_REFINE', 'true').lower() == 'true'
+SEARCH_SPECULATIVE_THRESHOLD = float(os.getenv('SEARCH_SPECULATIVE_THRESHOLD', 0.5))
+# חיפוש רק של מה שחדש מאז הבדיקה האחרונה (search_recency_filter + קישורים שכבר נמצאו)
+SEARCH_WATERMARKS = os.getenv('SEARCH_WATERMARKS', 'true').lower() == 'true'
+SEARCH_WATERMARK_URLS = int(os.getenv('SEARCH_WATERMARK_URLS', 20))
+# כמה נושאים של אותו משתמש מחפשים בקריאה אחת בבדיקה האוטומטית (1 = בלי איחוד)
+SEARCH_BATCH_SIZE = int(os.getenv('SEARCH_BATCH_SIZE', 1))
+# מפסקי זרם ותקציב זמן - כשהחיפוש או אתר מסוים לא זמינים נכשלים מיד במקום לחכות ל-timeout
+SEARCH_REQUEST_TIMEOUT = float(os.getenv('SEARCH_REQUEST_TIMEOUT', 30))
+SEARCH_BREAKER_FAILURES = int(os.getenv('SEARCH_BREAKER_FAILURES', 3))
+SEARCH_BREAKER_RECOVERY_SECONDS = float(os.getenv('SEARCH_BREAKER_RECOVERY_SECONDS', 120))
+URL_BREAKER_FAILURES = int(os.getenv('URL_BREAKER_FAILURES', 3))
+URL_BREAKER_RECOVERY_SECONDS = float(os.getenv('URL_BREAKER_RECOVERY_SECONDS', 600))
+TOPIC_CHECK_DEADLINE_SECONDS = float(os.getenv('TOPIC_CHECK_DEADLINE_SECONDS', 60))
+# ספקי החיפוש (מופרדים בפסיק) ואופן השימוש בהם: route / fastest / merge
+SEARCH_PROVIDERS = [name.strip().lower() for name in os.getenv('SEARCH_PROVIDERS', 'perplexity').split(',') if name.strip()]
+SEARCH_PROVIDER_MODE = os.getenv('SEARCH_PROVIDER_MODE', 'route').lower()
+TAVILY_API_KEY = os.getenv('TAVILY_API_KEY')
+# עלות חיפוש אחד אצל כל ספק, בקרדיטים מהמכסה החודשית של המשתמש
+PERPLEXITY_SEARCH_COST = int(os.getenv('PERPLEXITY_SEARCH_COST', 1))
+TAVILY_SEARCH_COST = int(os.getenv('TAVILY_SEARCH_COST', 1))
+
+# מעקב אחרי שלבי הבדיקה: ייצוא עץ המקטעים של כל בדיקה (jsonl / otlp, מופרדים בפסיק; ריק = רק מזהים בלוג)
+TRACING_EXPORTERS = os.getenv('TRACING_EXPORTERS', '')
+TRACING_JSONL_PATH = os.getenv('TRACING_JSONL_PATH', os.path.join(os.path.dirname(DB_PATH), 'traces.jsonl'))
+TRACING_OTLP_ENDPOINT = os.getenv('TRACING_OTLP_ENDPOINT', 'http://localhost:4318')
+TRACING_SLOW_CHECK_SECONDS = float(os.getenv('TRACING_SLOW_CHECK_SECONDS', 0))
+
+# כמה שניות נשמרים דוחות האדמין (משתמשים אחרונים) במטמון
+ADMIN_CACHE_TTL_SECONDS = int(os.getenv('ADMIN_CACHE_TTL_SECONDS', 60))
+
+# מטמון רשימת הנושאים המוצגת לכל משתמש (נמחק בכל שינוי בנושאים של המשתמש)
+RENDER_CACHE_TTL_SECONDS = int(os.getenv('RENDER_CACHE_TTL_SECONDS', 300))
+RENDER_CACHE_MAX_USERS = int(os.getenv('RENDER_CACHE_MAX_USERS', 1000))
+
+# משתמשים מוכרים (עם שם המשתמש האחרון) - add_user כותב רק למשתמש חדש או כשהשם השתנה
+KNOWN_USERS_CACHE_TTL_SECONDS = int(os.getenv('KNOWN_USERS_CACHE_TTL_SECONDS', 3600))
+KNOWN_USERS_CACHE_MAX = int(os.getenv('KNOWN_USERS_CACHE_MAX', 10000))
+
 # לוג משתני סביבה חשובים
 logger.info(f"Environment variables loaded - ADMIN_ID: {ADMIN_ID}, BOT_TOKEN: {'SET' if BOT_TOKEN else 'NOT SET'}")
 
 # קבועים
 MONTHLY_LIMIT = 200  # מגבלת שאילתות חודשית
+CHECK_IDS_RETENTION_DAYS = 7  # כמה זמן נשמרים מזהי בדיקות שהושלמו (למניעת כתיבה כפולה בניסיון חוזר)
+ONE_TIME_CHECK_DELAY_SECONDS = 60  # בדיקה חד-פעמית דקה אחרי הוספת נושא (שינוי נוסף בנושא דוחה אותה שוב)
 DEFAULT_PROVIDER = "perplexity"
 
 # יצירת ספריית נתונים אם לא קיימת
@@ -81,11 +189,114 @@ reporter = create_reporter(
     service_name="SearchMe"
 )
 
+tracer = create_tracer(
+    TRACING_EXPORTERS,
+    jsonl_path=TRACING_JSONL_PATH,
+    otlp_endpoint=TRACING_OTLP_ENDPOINT,
+    slow_threshold=TRACING_SLOW_CHECK_SECONDS
+)
+
+# פרמטרי מעקב שלא משנים את תוכן הדף
+_TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'ref_src')
+
+def canonicalize_url(url: str) -> str:
+    """נרמול קישור להשוואת כפילויות - בלי fragment, פרמטרי מעקב ו-/ בסוף"""
+    if not url:
+        return ''
+    parts = urlsplit(url.strip())
+    query = urlencode([
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(_TRACKING_PARAMS)
+    ])
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ''))
+
+def url_fingerprint(url: str) -> str:
+    """טביעת אצבע קצרה ויציבה לקישור מנורמל"""
+    return hashlib.sha1(canonicalize_url(url).encode('utf-8')).hexdigest()[:16]
+
+def content_fingerprint(title: str, url: str, content_summary: str) -> str:
+    """טביעת אצבע יציבה לתוכן (hash() של פייתון משתנה בין הפעלות)"""
+    return hashlib.sha1(f"{title}{url}{content_summary}".encode('utf-8')).hexdigest()[:16]
+
+def result_fingerprints(title: str, url: str, content_summary: str) -> tuple:
+    """טביעות האצבע של תוצאה (קישור ותוכן) - עם אותן ברירות מחדל של save_result"""
+    title = title or 'ללא כותרת'
+    url = url or ''
+    content_summary = content_summary or 'ללא סיכום'
+    return url_fingerprint(url), content_fingerprint(title, url, content_summary)
+
+def is_topic_due(last_checked, check_interval, checks_remaining, current_time: datetime) -> bool:
+    """בדיקה אם הגיע הזמן לבדוק נושא לפי התדירות שלו"""
+    # אם יש מגבלת בדיקות ונגמרו, לא לבדוק
+    if checks_remaining is not None and checks_remaining <= 0:
+        return False
+    if not last_checked:
+        return True
+    
+    last_check_time = datetime.fromisoformat(last_checked) if isinstance(last_checked, str) else last_checked
+    time_diff = current_time - last_check_time
+    
+    # אם זה בדיקות של 5 דקות, בדוק כל 5 דקות
+    if check_interval == 0.0833:  # 5 דקות בשעות (5/60)
+        return time_diff >= timedelta(minutes=5)
+    return time_diff >= timedelta(hours=check_interval)
+
+# שמות התדירויות להצגה
+FREQUENCY_LABELS = {
+    6: "כל 6 שעות",
+    12: "כל 12 שעות",
+    24: "כל 24 שעות",
+    48: "כל 48 שעות",
+    168: "אחת לשבוע"
+}
+
+def frequency_label(check_interval) -> str:
+    """שם התדירות להצגה"""
+    return FREQUENCY_LABELS.get(check_interval, f"כל {check_interval} שעות")
+
+# תצוגות רשימת הנושאים המוכנות (הודעה + מקלדת) לפי משתמש.
+# כל שינוי בנושאים של משתמש מוחק את התצוגה שלו; שינויים מתהליך worker אחר נראים אחרי ה-TTL
+topic_views_cache = TTLCache(maxsize=RENDER_CACHE_MAX_USERS, ttl=RENDER_CACHE_TTL_SECONDS)
+
+def invalidate_topic_views(user_id):
+    """מחיקת תצוגת רשימת הנושאים של משתמש מהמטמון"""
+    if user_id is not None:
+        topic_views_cache.pop(user_id)
+
+def discard_seen_filters(topic_ids):
+    """מחיקת מסנני התוצאות שנראו (וה-snapshot שלהם) של נושאים שהוסרו או הסתיימו"""
+    if topic_ids:
+        seen_results.discard(*topic_ids)
+
+def stats_hour_key(moment: datetime = None) -> str:
+    """מפתח לדלי השעתי של מוני התוצאות (UTC, כמו CURRENT_TIMESTAMP של SQLite)"""
+    return (moment or datetime.utcnow()).strftime("%Y-%m-%d %H")
+
+def usage_stats_deltas(month: str, before: int, after: int) -> Dict[str, int]:
+    """שינויי המונים החודשיים כשהשימוש של משתמש עובר מ-before ל-after"""
+    deltas = {f"usage_total:{month}": after - before}
+    if before <= 0 < after:
+        deltas[f"users_with_usage:{month}"] = 1
+    if before < MONTHLY_LIMIT <= after:
+        deltas[f"users_at_limit:{month}"] = 1
+    return deltas
+
+class CheckWriteError(Exception):
+    """כתיבת בדיקה שנכשלה באמצע (מונגו בלי טרנזקציות) - debited: החיוב שכבר נכתב ונשאר"""
+    
+    def __init__(self, message: str, debited: int):
+        super().__init__(message)
+        self.debited = debited
+
+_UNKNOWN_USER = object()
+
 class WatchBotDB:
     """מחלקה לניהול בסיס הנתונים"""
     
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # משתמשים שכבר נשמרו -> שם המשתמש האחרון שנשמר
+        self._known_users = TTLCache(maxsize=KNOWN_USERS_CACHE_MAX, ttl=KNOWN_USERS_CACHE_TTL_SECONDS)
         self.init_db()
     
     def init_db(self):
@@ -93,6 +304,18 @@ class WatchBotDB:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # auto_vacuum מצטבר - מאפשר להחזיר לדיסק מקום שהתפנה בניקוי תוצאות ישנות
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != 2:
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'")
+            if cursor.fetchone()[0] > 0:
+                # בסיס נתונים קיים - ההגדרה נכנסת לתוקף רק אחרי VACUUM מלא (פעם אחת)
+                cursor.execute('VACUUM')
+        
+        # WAL מאפשר לבוט ולתהליכי ה-worker לקרוא ולכתוב במקביל
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # טבלת משתמשים
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -137,10 +360,32 @@ class WatchBotDB:
                 content_hash TEXT,
                 found_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 is_sent BOOLEAN DEFAULT 0,
+                url_hash TEXT,
                 FOREIGN KEY (topic_id) REFERENCES watch_topics (id)
             )
         ''')
         
+        # הוספת עמודת url_hash לטבלאות קיימות - ומילוי שלה לתוצאות שכבר נשמרו
+        try:
+            cursor.execute('ALTER TABLE found_results ADD COLUMN url_hash TEXT')
+            conn.create_function("url_fingerprint", 1, url_fingerprint, deterministic=True)
+            cursor.execute('UPDATE found_results SET url_hash = url_fingerprint(url)')
+            cursor.execute('DROP INDEX IF EXISTS idx_found_results_topic_url')
+            conn.commit()
+        except sqlite3.OperationalError:
+            # העמודה כבר קיימת
+            pass
+        
+        # טביעות אצבע של תוצאות ישנות - נשמרות במקום השורה המלאה לצורך מניעת כפילויות
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS result_fingerprints (
+                topic_id INTEGER,
+                url_hash TEXT,
+                content_hash TEXT,
+                found_at TIMESTAMP
+            )
+        ''')
+        
         # טבלת סטטיסטיקת שימוש
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS usage_stats (
@@ -152,19 +397,134 @@ class WatchBotDB:
             )
         ''')
         
+        # מונים שמתעדכנים בכל כתיבה - /stats קורא אותם במקום לספור את הטבלאות
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_hourly_results (
+                hour TEXT PRIMARY KEY,
+                results INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # בדיקות נושאים שכבר נכתבו - בדיקה שחוזרת על עצמה (למשל אחרי קריסה) לא נכתבת פעמיים
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS completed_checks (
+                check_id TEXT PRIMARY KEY,
+                topic_id INTEGER NOT NULL,
+                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # יצירת אינדקסים
+        self._create_indexes(cursor)
+        
+        cursor.execute("SELECT 1 FROM stats_counters WHERE name = 'seeded'")
+        if not cursor.fetchone():
+            self._seed_stats(cursor)
+        
         conn.commit()
         conn.close()
     
+    # אינדקס לכל שאילתה של המחלקה (נבדק ע"י scripts/check_query_plans.py)
+    _INDEXES = {
+        # get_user_topics, remove_topic: user_id + is_active, ממוין לפי created_at
+        'idx_watch_topics_user_active': 'watch_topics (user_id, is_active, created_at)',
+        # get_active_topics_for_check, apply_retention
+        'idx_watch_topics_active': 'watch_topics (is_active)',
+        # get_recent_users_activity
+        'idx_watch_topics_created_at': 'watch_topics (created_at)',
+        'idx_users_created_at': 'users (created_at)',
+        'idx_usage_stats_month': 'usage_stats (month)',
+        # save_result (מניעת כפילויות), get_result_fingerprints, apply_retention
+        'idx_found_results_topic_url_hash': 'found_results (topic_id, url_hash)',
+        'idx_found_results_topic_content': 'found_results (topic_id, content_hash)',
+        'idx_found_results_found_at': 'found_results (found_at)',
+        'idx_result_fingerprints_url': 'result_fingerprints (topic_id, url_hash)',
+        'idx_result_fingerprints_content': 'result_fingerprints (topic_id, content_hash)',
+        # apply_retention (מחיקת מזהי בדיקות ישנים)
+        'idx_completed_checks_completed_at': 'completed_checks (completed_at)',
+    }
+    
+    def _create_indexes(self, cursor):
+        """יצירת אינדקסים לביצועים טובים יותר"""
+        for name, definition in self._INDEXES.items():
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+    
+    def _seed_stats(self, cursor):
+        """אתחול המונים מספירה מלאה - פעם אחת, בבסיס נתונים שנוצר לפני שהיו מונים"""
+        current_month = datetime.now().strftime("%Y-%m")
+        
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(is_active = 1), 0) FROM users")
+        total_users, active_users = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*) FROM watch_topics WHERE is_active = 1")
+        active_topics = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM found_results")
+        total_results = cursor.fetchone()[0]
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(usage_count), 0), COALESCE(SUM(usage_count >= ?), 0)
+            FROM usage_stats WHERE month = ?
+        ''', (MONTHLY_LIMIT, current_month))
+        users_with_usage, total_usage, users_at_limit = cursor.fetchone()
+        
+        counters = {
+            'total_users': total_users,
+            'active_users': active_users,
+            'active_topics': active_topics,
+            'total_results': total_results,
+            f'usage_total:{current_month}': total_usage,
+            f'users_with_usage:{current_month}': users_with_usage,
+            f'users_at_limit:{current_month}': users_at_limit,
+            'seeded': 1
+        }
+        cursor.executemany(
+            'INSERT OR REPLACE INTO stats_counters (name, value) VALUES (?, ?)',
+            list(counters.items())
+        )
+        
+        cursor.execute('DELETE FROM stats_hourly_results')
+        cursor.execute('''
+            INSERT INTO stats_hourly_results (hour, results)
+            SELECT strftime('%Y-%m-%d %H', found_at), COUNT(*)
+            FROM found_results
+            WHERE found_at > datetime('now', '-24 hours')
+            GROUP BY 1
+        ''')
+        logger.info("Stats counters initialized from full table counts")
+    
+    def _bump_stats(self, cursor, deltas: Dict[str, int]):
+        """עדכון המונים באותה טרנזקציה של הכתיבה עצמה"""
+        cursor.executemany('''
+            INSERT INTO stats_counters (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', [(name, delta) for name, delta in deltas.items() if delta])
+    
     def add_user(self, user_id: int, username: str = None):
-        """הוספת משתמש חדש"""
+        """הוספת משתמש חדש או עדכון שם המשתמש (בלי לגעת ב-is_active וב-created_at)"""
+        if self._known_users.get(user_id, _UNKNOWN_USER) == username:
+            return
+        
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, username)
+            INSERT OR IGNORE INTO users (user_id, username)
             VALUES (?, ?)
         ''', (user_id, username))
+        
+        if cursor.rowcount > 0:
+            self._bump_stats(cursor, {'total_users': 1, 'active_users': 1})
+        else:
+            cursor.execute('''
+                UPDATE users SET username = ?
+                WHERE user_id = ? AND username IS NOT ?
+            ''', (username, user_id, username))
         conn.commit()
         conn.close()
+        self._known_users.set(user_id, username)
     
     def add_watch_topic(self, user_id: int, topic: str, check_interval: int = 24, checks_remaining: int = None) -> int:
         """הוספת נושא למעקב"""
@@ -175,11 +535,13 @@ class WatchBotDB:
             VALUES (?, ?, ?, ?)
         ''', (user_id, topic, check_interval, checks_remaining))
         topic_id = cursor.lastrowid
+        self._bump_stats(cursor, {'active_topics': 1})
         conn.commit()
         conn.close()
+        invalidate_topic_views(user_id)
         return topic_id
     
-    def get_user_topics(self, user_id: int) -> List[Dict]:
+    def get_user_topics(self, user_id: int) -> List[Topic]:
         """קבלת רשימת נושאים של משתמש"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
@@ -190,17 +552,19 @@ class WatchBotDB:
             ORDER BY created_at DESC
         ''', (user_id,))
         
-        topics = []
-        for row in cursor.fetchall():
-            topics.append({
-                'id': row[0],
-                'topic': row[1],
-                'check_interval': row[2],
-                'is_active': row[3],
-                'created_at': row[4],
-                'last_checked': row[5],
-                'checks_remaining': row[6]
-            })
+        topics = [
+            Topic(
+                id=row[0],
+                user_id=user_id,
+                topic=row[1],
+                check_interval=row[2],
+                is_active=bool(row[3]),
+                created_at=row[4],
+                last_checked=row[5],
+                checks_remaining=row[6]
+            )
+            for row in cursor.fetchall()
+        ]
         
         conn.close()
         return topics
@@ -215,18 +579,24 @@ class WatchBotDB:
             cursor.execute('''
                 UPDATE watch_topics SET is_active = 0
                 WHERE user_id = ? AND id = ? AND is_active = 1
+                RETURNING id
             ''', (user_id, int(topic_identifier)))
         else:
             # ניסיון שני - לפי שם הנושא
             cursor.execute('''
                 UPDATE watch_topics SET is_active = 0
                 WHERE user_id = ? AND topic LIKE ? AND is_active = 1
+                RETURNING id
             ''', (user_id, f'%{topic_identifier}%'))
         
-        success = cursor.rowcount > 0
+        removed_ids = [row[0] for row in cursor.fetchall()]
+        self._bump_stats(cursor, {'active_topics': -len(removed_ids)})
         conn.commit()
         conn.close()
-        return success
+        if removed_ids:
+            invalidate_topic_views(user_id)
+            discard_seen_filters(removed_ids)
+        return bool(removed_ids)
     
     def update_topic_text(self, user_id: int, topic_id: str, new_text: str) -> bool:
         """עדכון טקסט הנושא"""
@@ -242,6 +612,8 @@ class WatchBotDB:
         success = cursor.rowcount > 0
         conn.commit()
         conn.close()
+        if success:
+            invalidate_topic_views(user_id)
         return success
     
     def update_topic_frequency(self, user_id: int, topic_id: str, new_frequency: int) -> bool:
@@ -258,20 +630,26 @@ class WatchBotDB:
         success = cursor.rowcount > 0
         conn.commit()
         conn.close()
+        if success:
+            invalidate_topic_views(user_id)
         return success
     
     def toggle_user_status(self, user_id: int, is_active: bool):
         """הפעלה/השבתה של משתמש"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
+        cursor.execute('SELECT is_active FROM users WHERE user_id = ?', (user_id,))
+        existing = cursor.fetchone()
         cursor.execute('''
             UPDATE users SET is_active = ?
             WHERE user_id = ?
         ''', (is_active, user_id))
+        if existing is not None and bool(existing[0]) != bool(is_active):
+            self._bump_stats(cursor, {'active_users': 1 if is_active else -1})
         conn.commit()
         conn.close()
     
-    def get_active_topics_for_check(self) -> List[Dict]:
+    def get_active_topics_for_check(self) -> List[Topic]:
         """קבלת נושאים פעילים לבדיקה לפי תדירות"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
@@ -290,38 +668,20 @@ class WatchBotDB:
             topic_id, user_id, topic, last_checked, check_interval, checks_remaining = row
             
             # בדיקה אם הגיע הזמן לבדוק את הנושא
-            should_check = False
-            
-            # אם יש מגבלת בדיקות ונגמרו, לא לבדוק
-            if checks_remaining is not None and checks_remaining <= 0:
-                should_check = False
-            elif not last_checked:
-                should_check = True
-            else:
-                last_check_time = datetime.fromisoformat(last_checked)
-                time_diff = current_time - last_check_time
-                
-                # אם זה בדיקות של 5 דקות, בדוק כל 5 דקות
-                if check_interval == 0.0833:  # 5 דקות בשעות (5/60)
-                    if time_diff >= timedelta(minutes=5):
-                        should_check = True
-                elif time_diff >= timedelta(hours=check_interval):
-                    should_check = True
-            
-            if should_check:
-                topics.append({
-                    'id': topic_id,
-                    'user_id': user_id,
-                    'topic': topic,
-                    'last_checked': last_checked,
-                    'check_interval': check_interval,
-                    'checks_remaining': checks_remaining
-                })
+            if is_topic_due(last_checked, check_interval, checks_remaining, current_time):
+                topics.append(Topic(
+                    id=topic_id,
+                    user_id=user_id,
+                    topic=topic,
+                    check_interval=check_interval,
+                    last_checked=last_checked,
+                    checks_remaining=checks_remaining
+                ))
         
         conn.close()
         return topics
     
-    def get_topic_by_id(self, topic_id: int) -> Dict:
+    def get_topic_by_id(self, topic_id: int) -> Topic:
         """קבלת פרטי נושא לפי מזהה"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
@@ -335,51 +695,64 @@ class WatchBotDB:
         conn.close()
         
         if row:
-            return {
-                'id': row[0],
-                'user_id': row[1],
-                'topic': row[2],
-                'check_interval': row[3],
-                'is_active': row[4],
-                'created_at': row[5],
-                'last_checked': row[6],
-                'checks_remaining': row[7]
-            }
+            return Topic(
+                id=row[0],
+                user_id=row[1],
+                topic=row[2],
+                check_interval=row[3],
+                is_active=bool(row[4]),
+                created_at=row[5],
+                last_checked=row[6],
+                checks_remaining=row[7]
+            )
         return None
     
+    def _insert_result(self, cursor, topic_id: int, title: str, url: str, content_summary: str) -> int:
+        """הוספת תוצאה אם היא חדשה לנושא (בתוך הטרנזקציה של הקורא) - מחזיר את המזהה או None לכפילות"""
+        # וידוא שהפרמטרים תקינים
+        if not title:
+            title = 'ללא כותרת'
+        if not url:
+            url = ''
+        if not content_summary:
+            content_summary = 'ללא סיכום'
+        
+        # יצירת hash ייחודי לתוכן למניעת כפילויות
+        content_hash = content_fingerprint(title, url, content_summary)
+        url_hash = url_fingerprint(url)
+        
+        # בדיקה אם התוצאה כבר קיימת - גם בין טביעות האצבע של תוצאות שנדחסו
+        cursor.execute('''
+            SELECT 1 FROM found_results
+            WHERE topic_id = ? AND (url_hash = ? OR content_hash = ?)
+            UNION ALL
+            SELECT 1 FROM result_fingerprints
+            WHERE topic_id = ? AND (url_hash = ? OR content_hash = ?)
+            LIMIT 1
+        ''', (topic_id, url_hash, content_hash, topic_id, url_hash, content_hash))
+        
+        if cursor.fetchone():
+            return None
+        
+        cursor.execute('''
+            INSERT INTO found_results (topic_id, title, url, content_summary, content_hash, url_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (topic_id, title, url, content_summary, content_hash, url_hash))
+        result_id = cursor.lastrowid
+        self._bump_stats(cursor, {'total_results': 1})
+        cursor.execute('''
+            INSERT INTO stats_hourly_results (hour, results) VALUES (?, 1)
+            ON CONFLICT(hour) DO UPDATE SET results = results + 1
+        ''', (stats_hour_key(),))
+        return result_id
+    
     def save_result(self, topic_id: int, title: str, url: str, content_summary: str) -> int:
         """שמירת תוצאה שנמצאה"""
         try:
-            # וידוא שהפרמטרים תקינים
-            if not title:
-                title = 'ללא כותרת'
-            if not url:
-                url = ''
-            if not content_summary:
-                content_summary = 'ללא סיכום'
-            
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
-            
-            # יצירת hash ייחודי לתוכן למניעת כפילויות
-            content_hash = str(hash(f"{title}{url}{content_summary}"))
-            
-            # בדיקה אם התוצאה כבר קיימת
-            cursor.execute('''
-                SELECT id FROM found_results
-                WHERE topic_id = ? AND (url = ? OR content_hash = ?)
-            ''', (topic_id, url, content_hash))
-            
-            if not cursor.fetchone():
-                cursor.execute('''
-                    INSERT INTO found_results (topic_id, title, url, content_summary, content_hash)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (topic_id, title, url, content_summary, content_hash))
-                conn.commit()
-                result_id = cursor.lastrowid
-            else:
-                result_id = None
-            
+            result_id = self._insert_result(cursor, topic_id, title, url, content_summary)
+            conn.commit()
             conn.close()
             return result_id
             
@@ -387,17 +760,53 @@ class WatchBotDB:
             logger.error(f"Error saving result for topic {topic_id}: {e}")
             return None
     
-    def update_topic_checked(self, topic_id: int):
-        """עדכון זמן הבדיקה האחרון וספירת בדיקות נותרות"""
+    def get_result_fingerprints(self, topic_id: int) -> List[str]:
+        """כל טביעות האצבע (קישור ותוכן) של תוצאות שנשמרו לנושא - לבניית מסנן התוצאות שנראו"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        fingerprints = []
+        cursor.execute('SELECT url_hash, content_hash FROM found_results WHERE topic_id = ?', (topic_id,))
+        for url_hash, content_hash in cursor.fetchall():
+            fingerprints.extend(fp for fp in (url_hash, content_hash) if fp)
+        
+        cursor.execute('SELECT url_hash, content_hash FROM result_fingerprints WHERE topic_id = ?', (topic_id,))
+        for url_hash, content_hash in cursor.fetchall():
+            fingerprints.extend(fp for fp in (url_hash, content_hash) if fp)
+        
+        conn.close()
+        return fingerprints
+
+    def get_topic_watermark(self, topic_id: int, max_urls: int = 20) -> Dict:
+        """סימן המים של נושא - זמן הבדיקה האחרונה (UTC) והקישורים האחרונים שנמצאו"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        cursor.execute('SELECT last_checked FROM watch_topics WHERE id = ?', (topic_id,))
+        row = cursor.fetchone()
+        cursor.execute('''
+            SELECT url FROM found_results
+            WHERE topic_id = ?
+            ORDER BY found_at DESC, id DESC LIMIT ?
+        ''', (topic_id, max_urls))
+        urls = [canonicalize_url(url) for (url,) in cursor.fetchall() if url]
+        conn.close()
+        
+        # last_checked נשמר עם CURRENT_TIMESTAMP - כלומר כבר ב-UTC
+        since = datetime.fromisoformat(row[0]) if row and row[0] else None
+        return {'since': since, 'recent_urls': urls}
+
+    def _mark_topic_checked(self, cursor, topic_id: int):
+        """עדכון זמן הבדיקה וספירת הבדיקות הנותרות (בתוך הטרנזקציה של הקורא) - מחזיר את המשתמש של הנושא"""
         # קבלת מספר הבדיקות הנותרות הנוכחי
-        cursor.execute('SELECT checks_remaining FROM watch_topics WHERE id = ?', (topic_id,))
+        cursor.execute('SELECT checks_remaining, is_active, user_id FROM watch_topics WHERE id = ?', (topic_id,))
         result = cursor.fetchone()
         
         if result and result[0] is not None:
             checks_remaining = result[0]
+            if checks_remaining <= 1 and result[1]:
+                # הנושא הופך ללא פעיל בבדיקה הזו
+                self._bump_stats(cursor, {'active_topics': -1})
             if checks_remaining > 1:
                 # הפחתת מספר הבדיקות הנותרות
                 cursor.execute('''
@@ -426,10 +835,218 @@ class WatchBotDB:
                 WHERE id = ?
             ''', (topic_id,))
         
+        return result[2] if result else None
+    
+    @traced("update_topic_checked")
+    def update_topic_checked(self, topic_id: int):
+        """עדכון זמן הבדיקה האחרון וספירת בדיקות נותרות"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        user_id = self._mark_topic_checked(cursor, topic_id)
+        conn.commit()
+        conn.close()
+        invalidate_topic_views(user_id)
+    
+    def _debit_usage(self, cursor, user_id: int, used: int) -> int:
+        """חיוב המכסה החודשית (בתוך הטרנזקציה של הקורא) - מחזיר כמה נשאר"""
+        current_month = datetime.now().strftime("%Y-%m")
+        cursor.execute('''
+            SELECT usage_count FROM usage_stats
+            WHERE user_id = ? AND month = ?
+        ''', (user_id, current_month))
+        
+        result = cursor.fetchone()
+        current_usage = result[0] if result else 0
+        
+        # Set new usage count
+        new_usage_count = min(current_usage + used, MONTHLY_LIMIT)
+        cursor.execute('''
+            INSERT OR REPLACE INTO usage_stats (user_id, month, usage_count)
+            VALUES (?, ?, ?)
+        ''', (user_id, current_month, new_usage_count))
+        self._bump_stats(cursor, usage_stats_deltas(current_month, current_usage, new_usage_count))
+        return max(MONTHLY_LIMIT - new_usage_count, 0)
+    
+    def debit_usage(self, user_id: int, used: int = 1) -> int:
+        """חיוב המכסה החודשית של משתמש - מחזיר כמה נשאר"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        remaining = self._debit_usage(cursor, user_id, used)
         conn.commit()
         conn.close()
+        return remaining
+    
+    def is_check_applied(self, check_id: str) -> bool:
+        """האם בדיקת הנושא עם המזהה הזה כבר נכתבה"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM completed_checks WHERE check_id = ?', (check_id,))
+        applied = cursor.fetchone() is not None
+        conn.close()
+        return applied
+    
+    @traced("commit_check")
+    def commit_check(self, check_id: str, topic_id: int, user_id: int, debit: int,
+                     results: List[tuple], mark_checked: bool = True) -> List[int]:
+        """
+        כל הכתיבות של בדיקת נושא אחת בטרנזקציה אחת - חיוב המכסה, התוצאות ועדכון זמן הבדיקה.
+        results: רשימת (title, url, content_summary)
+        מחזיר את מזהי התוצאות לפי הסדר (None לכפילות), או None אם הבדיקה הזו כבר נכתבה
+        """
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(
+                'INSERT OR IGNORE INTO completed_checks (check_id, topic_id) VALUES (?, ?)',
+                (check_id, topic_id)
+            )
+            if cursor.rowcount == 0:
+                cursor.execute('ROLLBACK')
+                return None
+            
+            if debit:
+                self._debit_usage(cursor, user_id, debit)
+            result_ids = [self._insert_result(cursor, topic_id, *result) for result in results]
+            if mark_checked:
+                self._mark_topic_checked(cursor, topic_id)
+            cursor.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        
+        if mark_checked:
+            invalidate_topic_views(user_id)
+        return result_ids
+    
+    def apply_retention(self, retention_days: int) -> Dict[str, int]:
+        """דחיסת תוצאות ישנות לטביעות אצבע, מחיקת תוצאות של נושאים לא פעילים והחזרת מקום לדיסק"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cutoff = f"-{int(retention_days)} days"
+        
+        try:
+            # תוצאות ישנות - נשארת רק טביעת אצבע למניעת כפילויות
+            cursor.execute('''
+                INSERT INTO result_fingerprints (topic_id, url_hash, content_hash, found_at)
+                SELECT topic_id, url_hash, content_hash, found_at
+                FROM found_results
+                WHERE found_at < datetime('now', ?)
+                  AND topic_id IN (SELECT id FROM watch_topics WHERE is_active = 1)
+            ''', (cutoff,))
+            compacted = cursor.rowcount
+            cursor.execute("DELETE FROM found_results WHERE found_at < datetime('now', ?)", (cutoff,))
+            expired = cursor.rowcount
+            
+            # נושאים שהוסרו או הסתיימו - אין צורך בהיסטוריה שלהם (וגם לא במסננים שלהם)
+            cursor.execute('''
+                SELECT topic_id FROM found_results
+                WHERE topic_id IN (SELECT id FROM watch_topics WHERE is_active = 0)
+                UNION
+                SELECT topic_id FROM result_fingerprints
+                WHERE topic_id IN (SELECT id FROM watch_topics WHERE is_active = 0)
+            ''')
+            pruned_topic_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute('''
+                DELETE FROM found_results
+                WHERE topic_id IN (SELECT id FROM watch_topics WHERE is_active = 0)
+            ''')
+            pruned = cursor.rowcount
+            cursor.execute('''
+                DELETE FROM result_fingerprints
+                WHERE topic_id IN (SELECT id FROM watch_topics WHERE is_active = 0)
+            ''')
+            pruned_fingerprints = cursor.rowcount
+            
+            self._bump_stats(cursor, {'total_results': -(expired + pruned)})
+            cursor.execute(
+                'DELETE FROM stats_hourly_results WHERE hour < ?',
+                (stats_hour_key(datetime.utcnow() - timedelta(hours=48)),)
+            )
+            cursor.execute(
+                "DELETE FROM completed_checks WHERE completed_at < datetime('now', ?)",
+                (f"-{CHECK_IDS_RETENTION_DAYS} days",)
+            )
+            conn.commit()
+            discard_seen_filters(pruned_topic_ids)
+            
+            # החזרת דפים פנויים למערכת הקבצים
+            cursor.execute('PRAGMA freelist_count')
+            free_pages = cursor.fetchone()[0]
+            # executescript מריץ את ה-PRAGMA עד הסוף (execute משחרר דף אחד בלבד)
+            conn.executescript('PRAGMA incremental_vacuum;')
+            
+            return {
+                'compacted': compacted,
+                'pruned': pruned,
+                'pruned_fingerprints': pruned_fingerprints,
+                'vacuumed_pages': free_pages
+            }
+        finally:
+            conn.close()
+    
+    def get_storage_usage(self) -> Dict[str, int]:
+        """נתוני שימוש בדיסק - לאדמין"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('PRAGMA page_size')
+            page_size = cursor.fetchone()[0]
+            cursor.execute('PRAGMA freelist_count')
+            free_pages = cursor.fetchone()[0]
+            cursor.execute('SELECT COUNT(*) FROM found_results')
+            results_count = cursor.fetchone()[0]
+            cursor.execute('SELECT COUNT(*) FROM result_fingerprints')
+            fingerprints_count = cursor.fetchone()[0]
+        finally:
+            conn.close()
+        
+        wal_path = f"{self.db_path}-wal"
+        disk = shutil.disk_usage(os.path.dirname(os.path.abspath(self.db_path)))
+        return {
+            'database_bytes': os.path.getsize(self.db_path),
+            'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+            'reclaimable_bytes': free_pages * page_size,
+            'results_count': results_count,
+            'fingerprints_count': fingerprints_count,
+            'disk_free_bytes': disk.free,
+            'disk_total_bytes': disk.total
+        }
+    
+    def get_stats(self) -> Dict[str, int]:
+        """קבלת סטטיסטיקות כלליות - גרסת SQLite (קריאה אחת של המונים המתוחזקים)"""
+        current_month = datetime.now().strftime("%Y-%m")
+        names = ['total_users', 'active_users', 'active_topics', 'total_results',
+                 f'usage_total:{current_month}', f'users_with_usage:{current_month}',
+                 f'users_at_limit:{current_month}']
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f'''
+                SELECT name, value FROM stats_counters WHERE name IN ({', '.join('?' * len(names))})
+                UNION ALL
+                SELECT 'results_today', COALESCE(SUM(results), 0) FROM stats_hourly_results WHERE hour > ?
+            ''', (*names, stats_hour_key(datetime.utcnow() - timedelta(hours=24))))
+            counters = dict(cursor.fetchall())
+        finally:
+            conn.close()
+        
+        return {
+            "total_users": counters.get('total_users', 0),
+            "active_users": counters.get('active_users', 0),
+            "users_with_usage": counters.get(f'users_with_usage:{current_month}', 0),
+            "users_at_limit": counters.get(f'users_at_limit:{current_month}', 0),
+            "active_topics": counters.get('active_topics', 0),
+            "total_results": counters.get('total_results', 0),
+            "results_today": counters.get('results_today', 0),
+            "total_usage_this_month": counters.get(f'usage_total:{current_month}', 0)
+        }
     
-    def get_user_usage(self, user_id: int) -> Dict[str, int]:
+    def get_user_usage(self, user_id: int) -> UsageInfo:
         """קבלת נתוני שימוש של משתמש"""
         current_month = datetime.now().strftime("%Y-%m")
         
@@ -444,73 +1061,50 @@ class WatchBotDB:
         current_usage = result[0] if result else 0
         
         conn.close()
-        return {
-            'current_usage': current_usage,
-            'monthly_limit': MONTHLY_LIMIT,
-            'remaining': MONTHLY_LIMIT - current_usage
-        }
+        return UsageInfo(current_usage, MONTHLY_LIMIT, MONTHLY_LIMIT - current_usage)
     
     def get_recent_users_activity(self) -> List[Dict[str, Any]]:
         """קבלת רשימת משתמשים שהשתמשו השבוע"""
-        # תאריך לפני שבוע
-        week_ago = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+        today = datetime.now()
+        # תאריך לפני שבוע - השוואת טווח על created_at כדי שהאינדקסים ישמשו
+        week_ago = (today - timedelta(days=7)).strftime("%Y-%m-%d")
+        current_month = today.strftime("%Y-%m")
+        
+        # תאריכי השבוע מחושבים מראש: YYYY-MM-DD -> DD/MM/YYYY
+        date_labels = {}
+        for days_back in range(-1, 9):
+            day = today - timedelta(days=days_back)
+            date_labels[day.strftime("%Y-%m-%d")] = day.strftime("%d/%m/%Y")
         
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        # שאילתה לקבלת משתמשים שהיו פעילים השבוע
-        cursor.execute("""
-            SELECT DISTINCT u.user_id, u.username, 
-                   DATE(wt.created_at) as activity_date,
-                   COUNT(wt.id) as topics_added
-            FROM users u
-            LEFT JOIN watch_topics wt ON u.user_id = wt.user_id 
-            WHERE DATE(wt.created_at) >= ?
-            GROUP BY u.user_id, DATE(wt.created_at)
-            ORDER BY wt.created_at DESC
-        """, (week_ago,))
-        
-        activity_results = cursor.fetchall()
-        
-        # שאילתה נוספת לקבלת פעילות שימוש
+        # שאילתה אחת: נושאים שנוספו השבוע, משתמשים שהצטרפו השבוע ושימוש החודש
         cursor.execute("""
-            SELECT u.user_id, u.username, us.usage_count,
-                   DATE(u.created_at) as join_date
-            FROM users u
-            LEFT JOIN usage_stats us ON u.user_id = us.user_id 
-            WHERE DATE(u.created_at) >= ? OR us.month = ?
-            ORDER BY u.created_at DESC
-        """, (week_ago, datetime.now().strftime("%Y-%m")))
-        
-        usage_results = cursor.fetchall()
+            WITH activity (user_id, activity_date, topics_added, usage_count) AS (
+                SELECT user_id, substr(created_at, 1, 10), 1, 0
+                FROM watch_topics WHERE created_at >= ?
+                UNION ALL
+                SELECT user_id, substr(created_at, 1, 10), 0, 0
+                FROM users WHERE created_at >= ?
+                UNION ALL
+                SELECT user_id, NULL, 0, usage_count
+                FROM usage_stats WHERE month = ?
+            )
+            SELECT u.user_id, u.username, a.activity_date,
+                   SUM(a.topics_added), MAX(a.usage_count)
+            FROM activity a
+            JOIN users u ON u.user_id = a.user_id
+            GROUP BY u.user_id, a.activity_date
+            ORDER BY u.created_at DESC, a.activity_date DESC
+        """, (week_ago, week_ago, current_month))
         
+        rows = cursor.fetchall()
         conn.close()
         
-        # עיבוד התוצאות
+        # איחוד השורות לפי משתמש
         users_activity = {}
-        
-        # עיבוד פעילות נושאים
-        for user_id, username, activity_date, topics_count in activity_results:
-            if user_id not in users_activity:
-                users_activity[user_id] = {
-                    'user_id': user_id,
-                    'username': username or f"User_{user_id}",
-                    'activity_dates': [],
-                    'usage_count': 0,
-                    'topics_added': 0
-                }
-            # המרת תאריך מ-YYYY-MM-DD ל-DD/MM/YYYY
-            if activity_date:
-                try:
-                    date_obj = datetime.strptime(activity_date, "%Y-%m-%d")
-                    formatted_date = date_obj.strftime("%d/%m/%Y")
-                    users_activity[user_id]['activity_dates'].append(formatted_date)
-                except:
-                    users_activity[user_id]['activity_dates'].append(activity_date)
-            users_activity[user_id]['topics_added'] += topics_count
-        
-        # עיבוד נתוני שימוש
-        for user_id, username, usage_count, join_date in usage_results:
+        for user_id, username, activity_date, topics_added, usage_count in rows:
             if user_id not in users_activity:
                 users_activity[user_id] = {
                     'user_id': user_id,
@@ -519,17 +1113,12 @@ class WatchBotDB:
                     'usage_count': 0,
                     'topics_added': 0
                 }
+            user = users_activity[user_id]
+            user['topics_added'] += topics_added
             if usage_count:
-                users_activity[user_id]['usage_count'] = usage_count
-            
-            # הוספת תאריך הצטרפות אם השבוע
-            if join_date >= week_ago:
-                try:
-                    date_obj = datetime.strptime(join_date, "%Y-%m-%d")
-                    formatted_date = date_obj.strftime("%d/%m/%Y")
-                    users_activity[user_id]['activity_dates'].append(formatted_date)
-                except:
-                    users_activity[user_id]['activity_dates'].append(join_date)
+                user['usage_count'] = max(user['usage_count'], usage_count)
+            if activity_date:
+                user['activity_dates'].append(date_labels.get(activity_date, activity_date))
         
         return list(users_activity.values())
     
@@ -558,6 +1147,7 @@ class WatchBotDB:
             INSERT OR REPLACE INTO usage_stats (user_id, month, usage_count)
             VALUES (?, ?, ?)
         ''', (user_id, current_month, current_usage + 1))
+        self._bump_stats(cursor, usage_stats_deltas(current_month, current_usage, current_usage + 1))
         
         conn.commit()
         conn.close()
@@ -572,141 +1162,73 @@ def log_search(provider: str, topic_id: int, query: str):
     logger.info("[SEARCH] provider=%s | topic_id=%s | query='%s'", provider, topic_id, query[:200])
 
 def decrement_credits(user_id: int, used: int = 1) -> int:
-    """Atomic-like function to decrement credits and return new value"""
-    prev_usage = db.get_user_usage(user_id)
-    prev = prev_usage['remaining']
-    new_val = max(prev - used, 0)
+    """חיוב המכסה החודשית של משתמש והחזרת היתרה"""
+    return db.debit_usage(user_id, used)
+
+@traced("search")
+def run_topic_search(topic: Topic, skip_seen: bool = True, check: "CheckUnitOfWork" = None) -> List[SearchResult]:
+    """
+    Main search function - routes to the configured search providers, Hebrew only output.
+    check: the topic check this search belongs to - its cost is written with the check instead of right away
+    """
+    used = 0
+    providers = []
+    
+    # אין ספק חיפוש זמין כרגע - נכשלים מיד ובלי לחייב
+    if not search_router.available():
+        raise CircuitOpenError("Search is temporarily unavailable")
+    
+    logger.info("🔍 Searching for topic: %s", topic.topic)
+    
+    # קישורים שכבר נשמרו לנושא נדחים בזיכרון, עוד לפני בדיקת הנגישות
+    skip_url = None
+    watermark = None
+    if skip_seen and topic.id is not None:
+        skip_url = lambda url: seen_results.might_contain(topic.id, url_fingerprint(url))
+        # מבקשים רק מה שחדש מאז הבדיקה האחרונה
+        if SEARCH_WATERMARKS:
+            try:
+                with trace_span("get_topic_watermark"):
+                    watermark = db.get_topic_watermark(topic.id, SEARCH_WATERMARK_URLS)
+            except Exception as e:
+                logger.error(f"Error loading watermark for topic {topic.id}: {e}")
     
-    if USE_MONGODB:
-        # MongoDB version
-        try:
-            current_month = datetime.now().strftime("%Y-%m")
-            
-            # Update usage count atomically
-            result = db.usage_stats_collection.find_one_and_update(
-                {"user_id": user_id, "month": current_month},
-                {
-                    "$inc": {"usage_count": used},
-                    "$setOnInsert": {"created_at": datetime.now()}
-                },
-                upsert=True,
-                return_document=True  # Return updated document
-            )
-            
-            new_usage_count = result.get('usage_count', used)
-            return max(MONTHLY_LIMIT - new_usage_count, 0)
-            
-        except Exception as e:
-            logger.error(f"Error updating credits in MongoDB: {e}")
-            return new_val
-    else:
-        # SQLite version (original code)
-        current_month = datetime.now().strftime("%Y-%m")
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
+    try:
+        outcome = search_router.search(
+            topic.topic, skip_url=skip_url, history_key=topic.id, watermark=watermark,
+            deadline=Deadline(TOPIC_CHECK_DEADLINE_SECONDS)
+        )
+        used = outcome['cost']
+        providers = outcome['providers']
+        for provider in providers:
+            log_search(provider, topic.id, topic.topic)
         
-        # Get current usage
-        cursor.execute('''
-            SELECT usage_count FROM usage_stats
-            WHERE user_id = ? AND month = ?
-        ''', (user_id, current_month))
-        
-        result = cursor.fetchone()
-        current_usage = result[0] if result else 0
-        
-        # Set new usage count
-        new_usage_count = min(current_usage + used, MONTHLY_LIMIT)
-        cursor.execute('''
-            INSERT OR REPLACE INTO usage_stats (user_id, month, usage_count)
-            VALUES (?, ?, ?)
-        ''', (user_id, current_month, new_usage_count))
-        
-        conn.commit()
-        conn.close()
-        
-        return max(MONTHLY_LIMIT - new_usage_count, 0)
-    
-    def get_stats(self) -> Dict[str, int]:
-        """קבלת סטטיסטיקות כלליות - גרסת SQLite"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            current_month = datetime.now().strftime("%Y-%m")
-            
-            # ספירת משתמשים
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_active = 1")
-            active_users = cursor.fetchone()[0]
-            
-            # ספירת נושאים
-            cursor.execute("SELECT COUNT(*) FROM watch_topics WHERE is_active = 1")
-            active_topics = cursor.fetchone()[0]
-            
-            # ספירת תוצאות
-            cursor.execute("SELECT COUNT(*) FROM found_results")
-            total_results = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM found_results WHERE found_at > datetime('now', '-24 hours')")
-            results_today = cursor.fetchone()[0]
-            
-            # סטטיסטיקות שימוש חודשיות
-            cursor.execute("SELECT COUNT(*), SUM(usage_count) FROM usage_stats WHERE month = ?", (current_month,))
-            usage_stats = cursor.fetchone()
-            users_with_usage = usage_stats[0] if usage_stats[0] else 0
-            total_usage_this_month = usage_stats[1] if usage_stats[1] else 0
-            
-            # משתמשים שהגיעו למגבלה
-            cursor.execute("SELECT COUNT(*) FROM usage_stats WHERE month = ? AND usage_count >= ?", (current_month, MONTHLY_LIMIT))
-            users_at_limit = cursor.fetchone()[0]
-            
-            return {
-                "total_users": total_users,
-                "active_users": active_users,
-                "users_with_usage": users_with_usage,
-                "users_at_limit": users_at_limit,
-                "active_topics": active_topics,
-                "total_results": total_results,
-                "results_today": results_today,
-                "total_usage_this_month": total_usage_this_month
-            }
-            
-        finally:
-            conn.close()
-
-def run_topic_search(topic) -> List[Dict[str, str]]:
-    """Main search function that uses Perplexity - Hebrew only output"""
-    provider = "perplexity"
-    used = 1
-    
-    log_search(provider, topic.id, topic.query)
-    logger.info("🔍 Calling Perplexity for topic: %s", topic.query)
-    
-    try:
-        perplexity_results = perform_search(topic.query)
+        # כל הספקים כבר מחזירים את הפורמט הנכון עם סיכומים
+        results = outcome['results']
+        set_attribute("providers", ",".join(providers))
+        set_attribute("cost", used)
+        set_attribute("results", len(results))
         if logger.isEnabledFor(logging.DEBUG):
-            logger.debug("[Perplexity] raw response: %s", perplexity_results)
-        
-        # הפונקציה perform_search כבר מחזירה את הפורמט הנכון עם סיכומים
-        results = perplexity_results
+            logger.debug("[Search] results: %s", results)
         
-        logger.info("✅ Perplexity success: %d results", len(results))
+        logger.info("✅ Search success: %d results | providers=%s", len(results), ",".join(providers))
         return results
     except Exception as e:
-        logger.error("Perplexity search failed for topic %s: %s", topic.id, e)
+        logger.error("Search failed for topic %s: %s", topic.id, e)
         raise
     finally:
-        # Credits - decrement once per search
-        try:
-            prev = db.get_user_usage(topic.user_id)['remaining']
-            new_val = decrement_credits(topic.user_id, used)
-            logger.info("Credits decremented: -%d | provider=%s | %d->%d", used, provider, prev, new_val)
-        except Exception as cred_err:
-            logger.error("[CREDITS] failed to decrement: %s", cred_err)
+        # Credits - decrement by the cost of every provider that was called
+        if used and check is not None:
+            check.charge(used)
+        elif used:
+            try:
+                prev = db.get_user_usage(topic.user_id).remaining
+                new_val = decrement_credits(topic.user_id, used)
+                logger.info("Credits decremented: -%d | providers=%s | %d->%d", used, ",".join(providers), prev, new_val)
+            except Exception as cred_err:
+                logger.error("[CREDITS] failed to decrement: %s", cred_err)
 
-def normalize_perplexity(perplexity_results: list) -> List[Dict]:
+def normalize_perplexity(perplexity_results: list) -> List[SearchResult]:
     """Convert Perplexity results to expected format - Hebrew only"""
     formatted_results = []
     
@@ -721,20 +1243,18 @@ def normalize_perplexity(perplexity_results: list) -> List[Dict]:
         # Create Hebrew summary
         summary = f"מקור מידע זמין בקישור - {hebrew_title[:100]}{'...' if len(hebrew_title) > 100 else ''}"
         
-        formatted_results.append({
-            'title': hebrew_title,
-            'url': url,
-            'summary': summary,
-            'relevance_score': 8,
-            'date_found': datetime.now().strftime("%Y-%m-%d")
-        })
+        formatted_results.append(SearchResult(hebrew_title, url, summary, relevance_score=8))
     
     return formatted_results
 
-def is_valid_result(r: dict) -> bool:
+def is_valid_result(r: SearchResult) -> bool:
     """Check if result has required title and url fields"""
-    return bool(r.get("title") and r.get("url"))
+    return bool(r.title and r.url)
 
+# מפסק לכל אתר - אתר שלא עונה לא יעכב את שאר הבדיקות
+url_breakers = BreakerRegistry(failure_threshold=URL_BREAKER_FAILURES, recovery_timeout=URL_BREAKER_RECOVERY_SECONDS)
+
+@traced("validate_url")
 def validate_url(url: str, timeout: int = 5) -> bool:
     """
     בדיקת תקינות URL - בודק אם הקישור נגיש ולא מחזיר 404
@@ -742,11 +1262,19 @@ def validate_url(url: str, timeout: int = 5) -> bool:
     if not url or not url.startswith(('http://', 'https://')):
         return False
     
+    # בדיקת תווים לא חוקיים
+    if any(char in url for char in [' ', '\n', '\r', '\t']):
+        return False
+    
+    # אתר שנכשל שוב ושוב לאחרונה - לא מחכים לו שוב
+    host = urlsplit(url).netloc.lower()
+    set_attribute("host", host)
+    breaker = url_breakers.get(host)
+    if not breaker.allow():
+        logger.debug(f"Skipping URL on unavailable host: {url}")
+        return False
+    
     try:
-        # בדיקת תווים לא חוקיים
-        if any(char in url for char in [' ', '\n', '\r', '\t']):
-            return False
-            
         # בדיקה מהירה עם HEAD request
         response = requests.head(url, timeout=timeout, allow_redirects=True, 
                                headers={'User-Agent': 'Mozilla/5.0 (compatible; WatchBot/1.0)'})
@@ -757,21 +1285,26 @@ def validate_url(url: str, timeout: int = 5) -> bool:
                                   headers={'User-Agent': 'Mozilla/5.0 (compatible; WatchBot/1.0)',
                                           'Range': 'bytes=0-1023'})  # רק 1KB ראשון
         
+        # האתר ענה (גם אם הדף לא קיים) - המפסק שלו נסגר
+        breaker.record_success()
+        
         # קבל קישורים עם status codes תקינים
         return response.status_code in [200, 206, 301, 302, 303, 307, 308]
         
     except (requests.RequestException, requests.Timeout, Exception) as e:
+        breaker.record_failure()
         logger.debug(f"URL validation failed for {url}: {e}")
         return False
 
-def is_relevant_result(result: dict, query: str) -> bool:
+@traced("is_relevant_result")
+def is_relevant_result(result: SearchResult, query: str) -> bool:
     """בדיקת רלוונטיות של תוצאת חיפוש לשאילתה המקורית - משופרת"""
     if not result or not query:
         return False
     
-    title = result.get('title', '').lower()
-    summary = result.get('summary', '').lower()
-    url = result.get('url', '').lower()
+    title = result.title.lower()
+    summary = result.summary.lower()
+    url = result.url.lower()
     query_lower = query.lower()
     
     # בדיקת סוג התוכן לפי URL - סינון תוכן לא רלוונטי
@@ -868,7 +1401,8 @@ def is_relevant_result(result: dict, query: str) -> bool:
     
     return is_relevant
 
-def rank_results_by_relevance(results: List[Dict], query: str) -> List[Dict]:
+@traced("rank_results_by_relevance")
+def rank_results_by_relevance(results: List[SearchResult], query: str) -> List[SearchResult]:
     """דירוג תוצאות החיפוש לפי רלוונטיות"""
     if not results or not query:
         return results
@@ -876,9 +1410,9 @@ def rank_results_by_relevance(results: List[Dict], query: str) -> List[Dict]:
     query_lower = query.lower()
     query_keywords = [word for word in query_lower.split() if len(word) > 2]
     
-    def calculate_relevance_score(result: Dict) -> float:
-        title = result.get('title', '').lower()
-        summary = result.get('summary', '').lower()
+    def calculate_relevance_score(result: SearchResult) -> float:
+        title = result.title.lower()
+        summary = result.summary.lower()
         content = f"{title} {summary}"
         
         score = 0.0
@@ -897,7 +1431,7 @@ def rank_results_by_relevance(results: List[Dict], query: str) -> List[Dict]:
                 score += 2.0
         
         # ניקוד לאורך הסיכום (סיכומים ארוכים יותר בדרך כלל יותר מידעיים)
-        summary_length = len(result.get('summary', ''))
+        summary_length = len(result.summary)
         if summary_length > 100:
             score += 1.0
         elif summary_length > 50:
@@ -907,13 +1441,14 @@ def rank_results_by_relevance(results: List[Dict], query: str) -> List[Dict]:
     
     # חישוב ניקוד לכל תוצאה
     for result in results:
-        result['relevance_score'] = calculate_relevance_score(result)
+        result.relevance_score = calculate_relevance_score(result)
     
     # מיון לפי ניקוד רלוונטיות (גבוה לנמוך)
-    sorted_results = sorted(results, key=lambda x: x.get('relevance_score', 0), reverse=True)
+    sorted_results = sorted(results, key=lambda x: x.relevance_score, reverse=True)
     
     return sorted_results
 
+@traced("translate_title_to_hebrew")
 def translate_title_to_hebrew(title: str) -> str:
     """תרגום כותרת מאנגלית לעברית - תרגום פשוט של מילות מפתח נפוצות"""
     if not title:
@@ -1008,13 +1543,13 @@ def translate_title_to_hebrew(title: str) -> str:
     
     return hebrew_title
 
-def make_hebrew_list(results: List[Dict[str, str]]) -> str:
+def make_hebrew_list(results: List[SearchResult]) -> str:
     """Create Hebrew-only consolidated message from results with summaries"""
     lines = []
     for r in results:
-        title = (r.get("title") or "").strip()
-        url = (r.get("url") or "").strip()
-        summary = (r.get("summary") or "").strip()
+        title = (r.title or "").strip()
+        url = (r.url or "").strip()
+        summary = (r.summary or "").strip()
         
         if not url:
             continue
@@ -1027,7 +1562,8 @@ def make_hebrew_list(results: List[Dict[str, str]]) -> str:
         lines.append(line)
     return "\n\n".join(lines)
 
-async def send_results_hebrew_only(bot, chat_id: int, topic_text: str, results: List[Dict[str, str]]):
+@traced("send_results_hebrew_only")
+async def send_results_hebrew_only(bot, chat_id: int, topic_text: str, results: List[SearchResult]):
     """
     Send ONE compact Hebrew message with all results,
     without English snippets and without Telegram link previews.
@@ -1044,6 +1580,7 @@ async def send_results_hebrew_only(bot, chat_id: int, topic_text: str, results:
     except Exception as e:
         logger.error("Failed to send Hebrew message to user %s: %s", chat_id, e)
 
+@traced("analyze_query_intent")
 def analyze_query_intent(query: str) -> dict:
     """ניתוח כוונת השאילתה לשיפור החיפוש - משופר"""
     query_lower = query.lower()
@@ -1105,19 +1642,37 @@ def analyze_query_intent(query: str) -> dict:
     
     return intent_info
 
-def perform_search(query: str) -> list[dict]:
-    """
-    Performs a search using the Perplexity API with the 'sonar-pro' model.
-    Enhanced with query intent analysis for better results.
-    """
-    if not API_KEY:
-        logger.error("PERPLEXITY_API_KEY environment variable is not set or empty.")
-        return []
-    
-    # ניתוח כוונת השאילתה
-    intent_info = analyze_query_intent(query)
-    logger.info(f"Query intent analysis: type='{intent_info['type']}', modifiers={intent_info['search_modifiers']}")
+# חלונות הזמן של search_recency_filter, מהקטן לגדול
+_RECENCY_WINDOWS = (
+    ('hour', timedelta(hours=1)),
+    ('day', timedelta(days=1)),
+    ('week', timedelta(weeks=1)),
+    ('month', timedelta(days=30)),
+)
+
+def watermark_recency_filter(watermark: dict):
+    """החלון הקטן ביותר שמכסה פעמיים את הזמן מאז הבדיקה האחרונה (מרווח לבדיקות שנכשלו)"""
+    if not watermark or not watermark.get('since'):
+        return None
+    span = (datetime.utcnow() - watermark['since']) * 2
+    for name, window in _RECENCY_WINDOWS:
+        if span <= window:
+            return name
+    return None
+
+def watermark_prompt(watermark: dict) -> str:
+    """הנחיה למודל לחפש רק מה שחדש מאז הבדיקה האחרונה ולא להחזיר קישורים שכבר נמצאו"""
+    if not watermark:
+        return ""
+    parts = []
+    if watermark.get('since'):
+        parts.append(f"חפש רק תוכן שפורסם או עודכן אחרי {watermark['since']:%d/%m/%Y %H:%M} (UTC).")
+    if watermark.get('recent_urls'):
+        parts.append("אל תחזיר את הקישורים הבאים, הם כבר נמצאו: " + ", ".join(watermark['recent_urls']))
+    return " " + " ".join(parts) if parts else ""
 
+def build_search_messages(query: str, intent_info: dict, watermark: dict = None) -> list:
+    """בניית ההודעות לחיפוש הראשי לפי סוג השאילתה (ולפי סימן המים של הנושא, אם יש)"""
     # התאמת ההנחיות לפי סוג השאילתה
     system_content = (
         "אתה עוזר חיפוש מומחה מתמחה במציאת תוכן רלוונטי ומדויק. "
@@ -1154,188 +1709,470 @@ def perform_search(query: str) -> list[dict]:
     if intent_info['search_modifiers']:
         enhanced_query += " " + " ".join(intent_info['search_modifiers'])
     
-    messages = [
+    return [
         {
             "role": "system",
             "content": system_content,
         },
         {
             "role": "user",
-            "content": f"חפש מידע רלוונטי ומדויק על הנושא הספציפי הזה: {enhanced_query}. חשוב מאוד: התמקד רק במקורות שעוסקים ישירות ובאופן ספציפי בנושא המבוקש. אל תכלול מקורות כלליים, מקורות שעוסקים בנושאים דומים או קשורים, או מקורות שרק מזכירים את הנושא בהקשר אחר. כל מקור חייב להיות ממוקד ורלוונטי במישרין לשאילתה.",
+            "content": f"חפש מידע רלוונטי ומדויק על הנושא הספציפי הזה: {enhanced_query}. חשוב מאוד: התמקד רק במקורות שעוסקים ישירות ובאופן ספציפי בנושא המבוקש. אל תכלול מקורות כלליים, מקורות שעוסקים בנושאים דומים או קשורים, או מקורות שרק מזכירים את הנושא בהקשר אחר. כל מקור חייב להיות ממוקד ורלוונטי במישרין לשאילתה." + watermark_prompt(watermark),
         },
     ]
 
-    try:
-        response = client.chat.completions.create(
-            model="sonar-pro",
-            messages=messages,
-        )
-        content = response.choices[0].message.content
+def build_refined_search_messages(query: str, watermark: dict = None) -> list:
+    """בניית ההודעות לחיפוש המעודן - כשהחיפוש הראשי החזיר מעט תוצאות"""
+    refined_query = f'"{query}" עדכונים חדשים מידע אחרון'
+    return [
+        {
+            "role": "system",
+            "content": (
+                "אתה עוזר חיפוש מומחה. עליך למצוא מידע ספציפי ועדכני על הנושא המבוקש. "
+                "החזר רק מערך JSON של 3-5 תוצאות נוספות עם השדות: 'title', 'url', 'summary'. "
+                "התמקד במקורות אמינים ועדכניים הקשורים ישירות לנושא."
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"מצא מידע נוסף על: {refined_query}" + watermark_prompt(watermark),
+        },
+    ]
+
+def search_item_to_result(item, query: str, skip_url=None, summary_prefix: str = "מקור מידע זמין",
+                          deadline: Deadline = None):
+    """בדיקת תוצאה בודדת מהמודל (קישור, נגישות, רלוונטיות) - מחזיר תוצאה מוכנה או None"""
+    if not (isinstance(item, dict) and 'title' in item and 'url' in item):
+        return None
+    
+    # בדיקת תקינות הקישור - בסיסית ומתקדמת
+    url = str(item.get('url') or '').strip()
+    if not url.startswith(('http://', 'https://')):
+        return None
+    
+    # בדיקה שהקישור לא מכיל תווים לא תקינים
+    if any(char in url for char in [' ', '\n', '\r', '\t']):
+        return None
+    
+    # תוצאה שכבר נראתה - אין טעם לבדוק נגישות
+    if skip_url and skip_url(url):
+        logger.debug(f"Skipping already seen URL: {url}")
+        return None
+    
+    # בדיקת נגישות הקישור (עם timeout קצר, ובתוך תקציב הזמן של הבדיקה)
+    if deadline is not None and deadline.expired():
+        logger.debug(f"Check deadline passed, skipping URL: {url}")
+        return None
+    if not validate_url(url, timeout=deadline.timeout(3) if deadline is not None else 3):
+        logger.debug(f"Skipping inaccessible URL: {url}")
+        return None
+    
+    title = str(item.get('title') or 'ללא כותרת').strip()
+    summary = str(item.get('summary') or '').strip()
+    
+    # וידוא שהכותרת בעברית - אם לא, נתרגם אותה
+    hebrew_title = translate_title_to_hebrew(title)
+    
+    result = SearchResult(
+        title=hebrew_title,
+        url=url,
+        summary=summary if summary else f"{summary_prefix} - {hebrew_title[:50]}{'...' if len(hebrew_title) > 50 else ''}"
+    )
+    
+    # בדיקת רלוונטיות לפני הוספה
+    if is_relevant_result(result, query):
+        return result
+    logger.info(f"Filtered out irrelevant result: {hebrew_title[:50]}")
+    return None
+
+@traced("llm_request")
+def request_search_results(messages: list, query: str, skip_url=None,
+                           summary_prefix: str = "מקור מידע זמין", cancel_event: threading.Event = None,
+                           recency_filter: str = None, deadline: Deadline = None, on_result=None):
+    """
+    שליחת שאילתה ל-sonar-pro ועיבוד התוצאות.
+    במצב streaming כל אובייקט במערך נבדק (נגישות ורלוונטיות) ברגע שהוא נסגר,
+    בזמן שהמודל עדיין כותב את הבאים.
+    cancel_event: כשהוא מסומן, ה-stream נסגר, הבדיקות שטרם התחילו מבוטלות ומוחזרת רשימה ריקה
+    on_result: נקרא (מתהליך הבדיקה) עם כל תוצאה שעברה את הבדיקות, ברגע שהיא מוכנה
+    recency_filter: search_recency_filter של Perplexity (hour/day/week/month)
+    deadline: תקציב הזמן של הבדיקה - חריגה ממנו זורקת DeadlineExceeded
+    הקריאה עוברת דרך מפסק הזרם של החיפוש - כשהוא פתוח נזרק CircuitOpenError מיד
+    מחזיר (תוצאות לפי הסדר, הטקסט המלא, האם התשובה הייתה JSON)
+    """
+    set_attribute("refined", summary_prefix != "מקור מידע זמין")
+    set_attribute("streaming", SEARCH_STREAMING)
+    parser = JSONArrayStreamParser()
+    futures = []
+    extra_body = {"search_recency_filter": recency_filter} if recency_filter else None
+    if deadline is not None:
+        deadline.check()
+    timeout = deadline.timeout(SEARCH_REQUEST_TIMEOUT) if deadline is not None else SEARCH_REQUEST_TIMEOUT
+    
+    def validate(item):
+        # בקשה שבוטלה לא ממשיכה לבדוק קישורים גם אחרי שה-stream הסתיים
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        result = search_item_to_result(item, query, skip_url, summary_prefix, deadline)
+        if result and on_result is not None:
+            on_result(result)
+        return result
+    
+    with search_breaker.guard(), ThreadPoolExecutor(max_workers=SEARCH_VALIDATION_WORKERS) as executor:
+        def submit(items):
+            for item in items:
+                futures.append(executor.submit(propagate(validate), item))
         
-        # ניסיון לפרסר JSON
+        if SEARCH_STREAMING:
+            stream = get_search_client().chat.completions.create(
+                model="sonar-pro",
+                messages=messages,
+                stream=True,
+                extra_body=extra_body,
+                timeout=timeout,
+            )
+            for chunk in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    stream.close()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return [], parser.text, parser.is_json()
+                if deadline is not None and deadline.expired():
+                    stream.close()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    deadline.check()
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    submit(parser.feed(delta))
+        else:
+            response = get_search_client().chat.completions.create(
+                model="sonar-pro",
+                messages=messages,
+                extra_body=extra_body,
+                timeout=timeout,
+            )
+            submit(parser.feed(response.choices[0].message.content or ''))
+        
+        results = []
+        for future in futures:
+            if cancel_event is not None and cancel_event.is_set():
+                executor.shutdown(wait=False, cancel_futures=True)
+                return [], parser.text, parser.is_json()
+            result = future.result()
+            if result:
+                results.append(result)
+    
+    set_attribute("items", len(futures))
+    set_attribute("results", len(results))
+    return results, parser.text, parser.is_json()
+
+def parse_markdown_results(content: str, query: str, skip_url=None) -> list:
+    """fallback - חילוץ קישורי markdown מתשובה שאינה JSON"""
+    matches = re.findall(r'\[(.*?)\]\((https?://[^\s\)]+)\)', content)
+    items = [{'title': title.strip(), 'url': link.strip()} for title, link in matches]
+    
+    with ThreadPoolExecutor(max_workers=SEARCH_VALIDATION_WORKERS) as executor:
+        checked = executor.map(propagate(lambda item: search_item_to_result(item, query, skip_url)), items)
+        return [result for result in checked if result]
+
+# מפסק הזרם של Perplexity - אחרי כמה כשלונות או חריגות זמן רצופים החיפושים נכשלים מיד
+search_breaker = CircuitBreaker("perplexity", SEARCH_BREAKER_FAILURES, SEARCH_BREAKER_RECOVERY_SECONDS)
+
+# היסטוריית הצורך בחיפוש מעודן, והתהליכים שמריצים אותו במקביל לחיפוש הראשי
+refinement_history = RefinementHistory(threshold=SEARCH_SPECULATIVE_THRESHOLD)
+refined_search_executor = ThreadPoolExecutor(max_workers=SEARCH_VALIDATION_WORKERS, thread_name_prefix="refined-search")
+
+def merge_search_results(results: list, extra: list, limit: int) -> list:
+    """הוספת תוצאות החיפוש המעודן לראשי - בלי כפילויות קישורים ועד limit תוצאות"""
+    seen_urls = {result.url for result in results}
+    for result in extra:
+        if len(results) >= limit:
+            break
+        if result.url not in seen_urls:
+            seen_urls.add(result.url)
+            results.append(result)
+    return results
+
+def perform_search(query: str, skip_url=None, history_key=None, watermark: dict = None,
+                   deadline: Deadline = None, raise_errors: bool = False) -> list[SearchResult]:
+    """
+    Performs a search using the Perplexity API with the 'sonar-pro' model.
+    Enhanced with query intent analysis for better results.
+    skip_url: optional predicate - URLs it accepts (e.g. already seen) are dropped before validation.
+    history_key: optional topic id - its refinement history decides whether the refined
+    search starts alongside the primary one.
+    watermark: optional topic watermark - only content newer than the last check is requested
+    and recently found URLs are excluded.
+    deadline: optional wall-clock budget for the whole search, URL validation included.
+    raise_errors: re-raise API errors instead of returning [] (so the provider router can fail over).
+    """
+    if not API_KEY:
+        logger.error("PERPLEXITY_API_KEY environment variable is not set or empty.")
+        return []
+    
+    # ניתוח כוונת השאילתה
+    intent_info = analyze_query_intent(query)
+    logger.info(f"Query intent analysis: type='{intent_info['type']}', modifiers={intent_info['search_modifiers']}")
+    
+    messages = build_search_messages(query, intent_info, watermark)
+    refined_messages = build_refined_search_messages(query, watermark)
+    recency_filter = watermark_recency_filter(watermark)
+    if watermark:
+        logger.info(f"Searching only new content: recency={recency_filter}, excluding {len(watermark.get('recent_urls') or [])} known URLs")
+    history_keys = [f"topic:{history_key}" if history_key is not None else None, f"intent:{intent_info['type']}"]
+    
+    # חיפוש מעודן ספקולטיבי - רק כשההיסטוריה מראה שבדרך כלל צריך אותו
+    refined_future = None
+    cancel_refined = threading.Event()
+    primary_found = []
+    refined_found = []
+    
+    def on_primary_result(result):
+        primary_found.append(result)
+        # החיפוש הראשי כבר מצא מספיק - אין טעם להמשיך את המעודן
+        if len(primary_found) >= 3:
+            cancel_refined.set()
+    
+    def on_refined_result(result):
+        refined_found.append(result)
+        # 7 תוצאות מעודנות מספיקות למיזוג בכל מקרה (גם אם חלקן כפולות לראשי)
+        if len(refined_found) >= 7:
+            cancel_refined.set()
+    
+    if SEARCH_SPECULATIVE_REFINE and refinement_history.should_prefetch(history_keys):
+        logger.info("Starting refined search alongside the primary search")
+        refined_future = refined_search_executor.submit(
+            propagate(request_search_results), refined_messages, query, skip_url,
+            "מקור מידע נוסף", cancel_refined, recency_filter, deadline, on_refined_result
+        )
+    
+    try:
         try:
-            results_json = json.loads(content)
-            results = []
-            
-            for item in results_json:
-                if isinstance(item, dict) and 'title' in item and 'url' in item:
-                    # בדיקת תקינות הקישור - בסיסית ומתקדמת
-                    url = item.get('url', '').strip()
-                    if not url.startswith(('http://', 'https://')):
-                        continue
-                        
-                    # בדיקה שהקישור לא מכיל תווים לא תקינים
-                    if any(char in url for char in [' ', '\n', '\r', '\t']):
-                        continue
-                    
-                    # בדיקת נגישות הקישור (עם timeout קצר)
-                    if not validate_url(url, timeout=3):
-                        logger.debug(f"Skipping inaccessible URL: {url}")
-                        continue
-                    
-                    title = item.get('title', 'ללא כותרת').strip()
-                    summary = item.get('summary', '').strip()
-                    
-                    # וידוא שהכותרת בעברית - אם לא, נתרגם אותה
-                    hebrew_title = translate_title_to_hebrew(title)
-                    
-                    # יצירת תוצאה זמנית לבדיקת רלוונטיות
-                    temp_result = {
-                        'title': hebrew_title,
-                        'url': url,
-                        'summary': summary if summary else f"מקור מידע זמין - {hebrew_title[:50]}{'...' if len(hebrew_title) > 50 else ''}"
-                    }
-                    
-                    # בדיקת רלוונטיות לפני הוספה
-                    if is_relevant_result(temp_result, query):
-                        results.append(temp_result)
-                    else:
-                        logger.info(f"Filtered out irrelevant result: {hebrew_title[:50]}")
-                        continue
-            
-            # אם אין מספיק תוצאות רלוונטיות, נסה חיפוש נוסף עם שאילתה מעודנת
-            if len(results) < 3:
-                logger.info(f"Only {len(results)} relevant results found, trying refined search...")
-                try:
-                    refined_query = f'"{query}" עדכונים חדשים מידע אחרון'
-                    refined_messages = [
-                        {
-                            "role": "system",
-                            "content": (
-                                "אתה עוזר חיפוש מומחה. עליך למצוא מידע ספציפי ועדכני על הנושא המבוקש. "
-                                "החזר רק מערך JSON של 3-5 תוצאות נוספות עם השדות: 'title', 'url', 'summary'. "
-                                "התמקד במקורות אמינים ועדכניים הקשורים ישירות לנושא."
-                            ),
-                        },
-                        {
-                            "role": "user",
-                            "content": f"מצא מידע נוסף על: {refined_query}",
-                        },
-                    ]
-                    
-                    refined_response = client.chat.completions.create(
-                        model="sonar-pro",
-                        messages=refined_messages,
-                    )
-                    refined_content = refined_response.choices[0].message.content
-                    refined_results_json = json.loads(refined_content)
-                    
-                    for item in refined_results_json:
-                        if isinstance(item, dict) and 'title' in item and 'url' in item and len(results) < 7:
-                            url = item.get('url', '').strip()
-                            if not url.startswith(('http://', 'https://')):
-                                continue
-                            if any(char in url for char in [' ', '\n', '\r', '\t']):
-                                continue
-                            
-                            # בדיקת נגישות הקישור גם בחיפוש המעודן
-                            if not validate_url(url, timeout=3):
-                                logger.debug(f"Skipping inaccessible refined URL: {url}")
-                                continue
-                            
-                            title = item.get('title', 'ללא כותרת').strip()
-                            summary = item.get('summary', '').strip()
-                            hebrew_title = translate_title_to_hebrew(title)
-                            
-                            temp_result = {
-                                'title': hebrew_title,
-                                'url': url,
-                                'summary': summary if summary else f"מקור מידע נוסף - {hebrew_title[:50]}{'...' if len(hebrew_title) > 50 else ''}"
-                            }
-                            
-                            if is_relevant_result(temp_result, query):
-                                results.append(temp_result)
-                                
-                except Exception as refined_e:
-                    logger.warning(f"Refined search failed: {refined_e}")
-             
-            # דירוג התוצאות לפי רלוונטיות
-            ranked_results = rank_results_by_relevance(results, query)
-            
-            logger.info(f"Search completed: {len(ranked_results)} relevant results found for query: '{query[:50]}{'...' if len(query) > 50 else ''}'")
-            return ranked_results
-            
-        except json.JSONDecodeError:
+            results, content, is_json = request_search_results(
+                messages, query, skip_url, recency_filter=recency_filter, deadline=deadline,
+                on_result=on_primary_result if refined_future is not None else None
+            )
+        except Exception:
+            cancel_refined.set()
+            raise
+        
+        needs_refinement = len(results) < 3
+        if is_json:
+            refinement_history.record(history_keys, needs_refinement)
+        if not (is_json and needs_refinement) and refined_future is not None:
+            cancel_refined.set()
+            logger.info("Cancelled speculative refined search - primary search was enough")
+        
+        if not is_json:
             # אם JSON לא תקין, ננסה לפרסר כמרקדאון (fallback)
             logger.warning("Failed to parse JSON response, trying markdown fallback")
-            results = []
-            matches = re.findall(r'\[(.*?)\]\((https?://[^\s\)]+)\)', content)
-            
-            for match in matches:
-                title, link = match
-                # בדיקת תקינות הקישור
-                link = link.strip()
-                if any(char in link for char in [' ', '\n', '\r', '\t']):
-                    continue
-                
-                # בדיקת נגישות הקישור גם בfallback
-                if not validate_url(link, timeout=3):
-                    logger.debug(f"Skipping inaccessible fallback URL: {link}")
-                    continue
-                    
-                title_clean = title.strip()
-                hebrew_title = translate_title_to_hebrew(title_clean)
-                
-                # יצירת תוצאה זמנית לבדיקת רלוונטיות
-                temp_result = {
-                    'title': hebrew_title,
-                    'url': link,
-                    'summary': f"מקור מידע זמין - {hebrew_title[:50]}{'...' if len(hebrew_title) > 50 else ''}"
-                }
-                
-                # בדיקת רלוונטיות לפני הוספה
-                if is_relevant_result(temp_result, query):
-                    results.append(temp_result)
-                else:
-                    logger.info(f"Filtered out irrelevant fallback result: {hebrew_title[:50]}")
+            results = parse_markdown_results(content, query, skip_url)
             
             # דירוג התוצאות לפי רלוונטיות גם בfallback
             ranked_results = rank_results_by_relevance(results, query)
             
             logger.info(f"Fallback search completed: {len(ranked_results)} relevant results found for query: '{query[:50]}{'...' if len(query) > 50 else ''}'")
             return ranked_results
-
+        
+        # אם אין מספיק תוצאות רלוונטיות, נסה חיפוש נוסף עם שאילתה מעודנת
+        if needs_refinement and deadline is not None and deadline.expired():
+            logger.warning(f"Check deadline passed, skipping refined search for query: '{query[:50]}'")
+        elif needs_refinement:
+            logger.info(f"Only {len(results)} relevant results found, trying refined search...")
+            try:
+                if refined_future is not None:
+                    # התוצאות שכבר נאספו תוך כדי החיפוש הראשי, ועוד עד שיש מספיק
+                    refined_future.result()
+                    refined_results = list(refined_found)
+                else:
+                    refined_results, _, _ = request_search_results(
+                        refined_messages, query, skip_url,
+                        summary_prefix="מקור מידע נוסף", recency_filter=recency_filter, deadline=deadline
+                    )
+                merge_search_results(results, refined_results, 7)
+            except Exception as refined_e:
+                logger.warning(f"Refined search failed: {refined_e}")
+        
+        # דירוג התוצאות לפי רלוונטיות
+        ranked_results = rank_results_by_relevance(results, query)
+        
+        logger.info(f"Search completed: {len(ranked_results)} relevant results found for query: '{query[:50]}{'...' if len(query) > 50 else ''}'")
+        return ranked_results
+        
     except Exception as e:
         logger.error(f"An error occurred while calling the Perplexity API: {e}")
+        if raise_errors:
+            raise
         return []
 
+def process_search_items(items: list, query: str, skip_url=None, deadline: Deadline = None) -> list:
+    """בדיקה מקבילית של תוצאות גולמיות (נגישות ורלוונטיות) ודירוג - לספקים ולחיפוש המרוכז"""
+    with ThreadPoolExecutor(max_workers=SEARCH_VALIDATION_WORKERS) as executor:
+        checked = executor.map(propagate(lambda item: search_item_to_result(item, query, skip_url, deadline=deadline)), items)
+        results = [result for result in checked if result]
+    return rank_results_by_relevance(results, query)
+
+def build_batch_search_messages(topics: List[Topic], watermarks: Dict) -> list:
+    """בניית הודעה אחת לכמה נושאים - התשובה היא אובייקט JSON לפי מזהה נושא"""
+    topic_lines = "\n".join(
+        f"{topic.id}: {topic.topic}{watermark_prompt(watermarks.get(topic.id))}"
+        for topic in topics
+    )
+    return [
+        {
+            "role": "system",
+            "content": (
+                "אתה עוזר חיפוש מומחה מתמחה במציאת תוכן רלוונטי ומדויק. "
+                "תקבל כמה נושאים, כל אחד בשורה נפרדת בפורמט 'מזהה: נושא'. "
+                "עליך להחזיר רק אובייקט JSON שהמפתחות שלו הם מזהי הנושאים (כמחרוזות) "
+                "והערך של כל מפתח הוא מערך של 3-5 תוצאות חיפוש לאותו נושא בלבד. "
+                "כל תוצאה חייבת להיות אובייקט JSON עם השדות הבאים בדיוק: 'title', 'url', 'summary'. "
+                "חשוב מאוד: "
+                "1. כל תוצאה חייבת לעסוק ישירות בנושא שתחתיו היא מופיעה - אל תערבב בין הנושאים "
+                "2. ה-'title' חייב להיות בעברית "
+                "3. ה-'summary' חייב להיות תיאור קצר של 1-2 משפטים בעברית "
+                "4. כל הקישורים חייבים להיות קישורים מלאים ותקינים שמתחילים ב-'https://' "
+                "החזר רק את אובייקט ה-JSON, ללא טקסט נוסף."
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"חפש מידע רלוונטי ומדויק על כל אחד מהנושאים הבאים:\n{topic_lines}",
+        },
+    ]
+
+def parse_batch_response(content: str):
+    """חילוץ אובייקט ה-JSON מהתשובה המרוכזת (גם בתוך ```json) - None אם לא תקין"""
+    start, end = content.find('{'), content.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    try:
+        parsed = json.loads(content[start:end + 1])
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+def run_batched_topic_search(topics: List[Topic]) -> Dict:
+    """
+    חיפוש אחד לכמה נושאים של אותו משתמש.
+    מחזיר תוצאות מסוננות ומדורגות לפי מזהה נושא; נושאים שלא הופיעו בתשובה
+    (או כל הנושאים, אם התשובה לא תקינה) חסרים במילון ונבדקים בנפרד.
+    """
+    if not API_KEY:
+        logger.error("PERPLEXITY_API_KEY environment variable is not set or empty.")
+        return {}
+    if not search_breaker.available():
+        return {}
+    deadline = Deadline(TOPIC_CHECK_DEADLINE_SECONDS)
+    
+    watermarks = {}
+    if SEARCH_WATERMARKS:
+        for topic in topics:
+            try:
+                watermarks[topic.id] = db.get_topic_watermark(topic.id, SEARCH_WATERMARK_URLS)
+            except Exception as e:
+                logger.error(f"Error loading watermark for topic {topic.id}: {e}")
+    
+    # חלון הזמן המשותף חייב לכסות את כל הנושאים - הרחב מביניהם
+    windows = [watermark_recency_filter(watermarks.get(topic.id)) for topic in topics]
+    window_order = [name for name, _ in _RECENCY_WINDOWS]
+    recency_filter = None if None in windows else max(windows, key=window_order.index)
+    
+    try:
+        with search_breaker.guard():
+            response = get_search_client().chat.completions.create(
+                model="sonar-pro",
+                messages=build_batch_search_messages(topics, watermarks),
+                extra_body={"search_recency_filter": recency_filter} if recency_filter else None,
+                timeout=deadline.timeout(SEARCH_REQUEST_TIMEOUT),
+            )
+        parsed = parse_batch_response(response.choices[0].message.content or '')
+    except Exception as e:
+        logger.error(f"Batched search failed for {len(topics)} topics: {e}")
+        return {}
+    
+    if parsed is None:
+        logger.warning(f"Failed to parse batched search response for {len(topics)} topics, falling back to per-topic searches")
+        return {}
+    
+    results_by_topic = {}
+    for topic in topics:
+        items = parsed.get(str(topic.id))
+        if not isinstance(items, list):
+            continue
+        
+        topic_id = topic.id
+        skip_url = lambda url, topic_id=topic_id: seen_results.might_contain(topic_id, url_fingerprint(url))
+        results_by_topic[topic_id] = process_search_items(items, topic.topic, skip_url, deadline)
+        
+        # חיפוש Perplexity אחד לכל נושא - החיוב נכתב עם בדיקת הנושא (process_topic_check)
+        log_search("perplexity-batch", topic_id, topic.topic)
+    
+    logger.info(f"Batched search completed: {len(results_by_topic)} of {len(topics)} topics answered in one call")
+    return results_by_topic
+
+def create_search_router() -> SearchRouter:
+    """בניית נתב החיפוש מהספקים שהוגדרו ב-SEARCH_PROVIDERS"""
+    providers = []
+    for name in SEARCH_PROVIDERS:
+        if name == "perplexity":
+            providers.append(PerplexityProvider(perform_search, search_breaker, PERPLEXITY_SEARCH_COST))
+        elif name == "tavily":
+            if not TAVILY_API_KEY:
+                logger.error("TAVILY_API_KEY is not set - skipping the Tavily search provider")
+                continue
+            try:
+                providers.append(TavilyProvider(
+                    TAVILY_API_KEY, process_search_items, watermark_recency_filter, TAVILY_SEARCH_COST,
+                    timeout=SEARCH_REQUEST_TIMEOUT,
+                    failure_threshold=SEARCH_BREAKER_FAILURES,
+                    recovery_timeout=SEARCH_BREAKER_RECOVERY_SECONDS
+                ))
+            except ImportError:
+                logger.error("tavily-python is not installed - skipping the Tavily search provider")
+        else:
+            logger.error(f"Unknown search provider '{name}' in SEARCH_PROVIDERS")
+    
+    if not providers:
+        logger.warning("No usable search provider configured, falling back to Perplexity")
+        providers.append(PerplexityProvider(perform_search, search_breaker, PERPLEXITY_SEARCH_COST))
+    
+    logger.info(f"Search providers: {', '.join(p.name for p in providers)} (mode={SEARCH_PROVIDER_MODE})")
+    return SearchRouter(providers, SEARCH_PROVIDER_MODE)
+
+search_router = create_search_router()
+
 
 class WatchBotMongoDB:
     """מחלקה לניהול בסיס נתונים MongoDB"""
     
     def __init__(self, uri: str, db_name: str):
+        from pymongo import MongoClient
+        
         self.client = MongoClient(uri)
         self.db = self.client[db_name]
         self.users_collection = self.db.users
         self.watch_topics_collection = self.db.watch_topics
         self.usage_stats_collection = self.db.usage_stats
         self.found_results_collection = self.db.found_results
+        self.result_fingerprints_collection = self.db.result_fingerprints
+        self.stats_counters_collection = self.db.stats_counters
+        self.stats_hourly_collection = self.db.stats_hourly_results
+        self.completed_checks_collection = self.db.completed_checks
+        # טרנזקציות זמינות רק ב-replica set / sharded cluster - נבדק בשימוש הראשון
+        self._transactions = None
+        
+        # מטמון קצר לדוחות האדמין - לא מריצים את אותה אגרגציה בכל לחיצה
+        self._admin_cache = TTLCache(maxsize=16, ttl=ADMIN_CACHE_TTL_SECONDS)
+        # משתמשים שכבר נשמרו -> שם המשתמש האחרון שנשמר
+        self._known_users = TTLCache(maxsize=KNOWN_USERS_CACHE_MAX, ttl=KNOWN_USERS_CACHE_TTL_SECONDS)
         
         # יצירת אינדקסים
         self._create_indexes()
         
-        # מיגרציה של נתוני שימוש מ-SQLite אם קיימים
-        self._migrate_usage_data_if_needed()
+        # אתחול מוני הסטטיסטיקה (פעם אחת)
+        self._seed_stats_if_needed()
+        self._backfill_result_url_hashes()
     
     def _create_indexes(self):
         """יצירת אינדקסים לביצועים טובים יותר"""
@@ -1343,188 +2180,243 @@ class WatchBotMongoDB:
             # אינדקס על user_id
             self.users_collection.create_index("user_id", unique=True)
             self.watch_topics_collection.create_index("user_id")
+            
+            # נושאים פעילים של משתמש (ממוינים), ונושאים פעילים לבדיקה
+            self.watch_topics_collection.create_index([("user_id", 1), ("is_active", 1), ("created_at", -1)])
+            self.watch_topics_collection.create_index("is_active")
+            self.users_collection.create_index("is_active")
             self.usage_stats_collection.create_index([("user_id", 1), ("month", 1)], unique=True)
             
             # אינדקס על תאריכים
             self.watch_topics_collection.create_index("created_at")
             self.users_collection.create_index("created_at")
+            self.usage_stats_collection.create_index("month")
+            
+            # מניעת כפילויות בתוצאות וקריאת טביעות האצבע של נושא
+            self.found_results_collection.create_index([("topic_id", 1), ("url_hash", 1)])
+            self.found_results_collection.create_index([("topic_id", 1), ("content_hash", 1)])
+            
+            # טביעות אצבע של תוצאות למניעת כפילויות
+            self.result_fingerprints_collection.create_index([("topic_id", 1), ("url_hash", 1)])
+            self.result_fingerprints_collection.create_index([("topic_id", 1), ("content_hash", 1)])
+            
+            # מזהי בדיקות שהושלמו נמחקים אוטומטית אחרי CHECK_IDS_RETENTION_DAYS
+            self.completed_checks_collection.create_index(
+                "completed_at", expireAfterSeconds=CHECK_IDS_RETENTION_DAYS * 24 * 3600
+            )
             
             logger.info("MongoDB indexes created successfully")
         except Exception as e:
             logger.error(f"Error creating MongoDB indexes: {e}")
+        
+        self._ensure_results_ttl_index()
     
-    def _migrate_usage_data_if_needed(self):
-        """מיגרציה של נתוני שימוש מ-SQLite ל-MongoDB אם נדרש"""
+    def _ensure_results_ttl_index(self):
+        """אינדקס TTL על found_results - מונגו מוחק תוצאות מלאות אחרי RESULT_RETENTION_DAYS"""
+        from pymongo.errors import OperationFailure
+        
+        expire_after = RESULT_RETENTION_DAYS * 24 * 3600
         try:
-            # בדיקה אם יש נתוני שימוש ב-MongoDB כבר
-            existing_count = self.usage_stats_collection.count_documents({})
-            if existing_count > 0:
-                logger.info(f"MongoDB already has {existing_count} usage records, skipping migration")
-                return
-            
-            # ניסיון לקרוא מ-SQLite
-            sqlite_db_path = DB_PATH
-            if not os.path.exists(sqlite_db_path):
-                logger.info("No SQLite database found, no migration needed")
+            self.found_results_collection.create_index("found_at", expireAfterSeconds=expire_after)
+        except OperationFailure:
+            # האינדקס קיים עם תקופה אחרת - עדכון במקום
+            try:
+                self.db.command(
+                    "collMod", "found_results",
+                    index={"keyPattern": {"found_at": 1}, "expireAfterSeconds": expire_after}
+                )
+            except Exception as e:
+                logger.error(f"Error updating found_results TTL index: {e}")
+        except Exception as e:
+            logger.error(f"Error creating found_results TTL index: {e}")
+    
+    def _backfill_result_url_hashes(self):
+        """url_hash לתוצאות שנשמרו לפני שהוא נשמר עליהן - פעם אחת, כדי שמניעת הכפילויות תמצא גם אותן"""
+        from pymongo import UpdateOne
+        from pymongo.errors import OperationFailure
+        
+        try:
+            if self.stats_counters_collection.find_one({"_id": "results_url_hash"}):
                 return
-            
-            conn = sqlite3.connect(sqlite_db_path)
-            cursor = conn.cursor()
-            
-            # בדיקה אם יש טבלת usage_stats
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='usage_stats'")
-            if not cursor.fetchone():
-                logger.info("No usage_stats table in SQLite, no migration needed")
-                conn.close()
+            updates = [
+                UpdateOne({"_id": doc["_id"]}, {"$set": {"url_hash": url_fingerprint(doc.get("url") or '')}})
+                for doc in self.found_results_collection.find({"url_hash": {"$exists": False}}, {"url": 1})
+            ]
+            if updates:
+                self.found_results_collection.bulk_write(updates, ordered=False)
+        except Exception as e:
+            logger.error(f"Error backfilling result URL hashes in MongoDB: {e}")
+            return
+        
+        try:
+            # האינדקס על הקישור הגולמי הוחלף באינדקס על url_hash
+            self.found_results_collection.drop_index("topic_id_1_url_1")
+        except OperationFailure:
+            pass
+        self.stats_counters_collection.update_one({"_id": "results_url_hash"}, {"$set": {"value": 1}}, upsert=True)
+    
+    def _seed_stats_if_needed(self):
+        """אתחול המונים מספירה מלאה - פעם אחת, בבסיס נתונים שנוצר לפני שהיו מונים"""
+        from pymongo import UpdateOne
+        
+        try:
+            if self.stats_counters_collection.find_one({"_id": "seeded"}):
                 return
             
-            # קריאת כל נתוני השימוש מ-SQLite
-            cursor.execute("SELECT user_id, month, usage_count FROM usage_stats WHERE usage_count > 0")
-            sqlite_data = cursor.fetchall()
-            conn.close()
-            
-            if not sqlite_data:
-                logger.info("No usage data in SQLite to migrate")
-                return
+            current_month = datetime.now().strftime("%Y-%m")
+            usage = list(self.usage_stats_collection.aggregate([
+                {"$match": {"month": current_month}},
+                {"$group": {
+                    "_id": None,
+                    "users_with_usage": {"$sum": 1},
+                    "total_usage": {"$sum": "$usage_count"},
+                    "users_at_limit": {"$sum": {"$cond": [{"$gte": ["$usage_count", MONTHLY_LIMIT]}, 1, 0]}}
+                }}
+            ]))
+            usage = usage[0] if usage else {}
             
-            # העברת הנתונים ל-MongoDB
-            documents_to_insert = []
-            for user_id, month, usage_count in sqlite_data:
-                documents_to_insert.append({
-                    "user_id": user_id,
-                    "month": month,
-                    "usage_count": usage_count,
-                    "created_at": datetime.now(),
-                    "migrated_from_sqlite": True
-                })
+            counters = {
+                'total_users': self.users_collection.count_documents({}),
+                'active_users': self.users_collection.count_documents({"is_active": True}),
+                'active_topics': self.watch_topics_collection.count_documents({"is_active": True}),
+                f'usage_total:{current_month}': usage.get('total_usage', 0),
+                f'users_with_usage:{current_month}': usage.get('users_with_usage', 0),
+                f'users_at_limit:{current_month}': usage.get('users_at_limit', 0),
+                'seeded': 1
+            }
+            self.stats_counters_collection.bulk_write([
+                UpdateOne({"_id": name}, {"$set": {"value": value}}, upsert=True)
+                for name, value in counters.items()
+            ])
             
-            if documents_to_insert:
-                self.usage_stats_collection.insert_many(documents_to_insert)
-                logger.info(f"Successfully migrated {len(documents_to_insert)} usage records from SQLite to MongoDB")
+            hourly = self.found_results_collection.aggregate([
+                {"$match": {"found_at": {"$gt": datetime.now() - timedelta(hours=24)}}},
+                {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d %H", "date": "$found_at"}}, "results": {"$sum": 1}}}
+            ])
+            for bucket in hourly:
+                self.stats_hourly_collection.update_one(
+                    {"_id": bucket["_id"]}, {"$set": {"results": bucket["results"]}}, upsert=True
+                )
+            logger.info("Stats counters initialized from full collection counts")
             
         except Exception as e:
-            logger.error(f"Error during usage data migration: {e}")
-            # לא נעצור את התהליך בגלל שגיאה במיגרציה
+            logger.error(f"Error initializing stats counters in MongoDB: {e}")
+    
+    def _bump_stats(self, deltas: Dict[str, int], session=None):
+        """עדכון המונים אחרי כתיבה"""
+        from pymongo import UpdateOne
+        
+        updates = [
+            UpdateOne({"_id": name}, {"$inc": {"value": delta}}, upsert=True)
+            for name, delta in deltas.items() if delta
+        ]
+        if not updates:
+            return
+        try:
+            self.stats_counters_collection.bulk_write(updates, ordered=False, session=session)
+        except Exception as e:
+            if session is not None:
+                # בתוך טרנזקציה - שגיאה מבטלת את כל הבדיקה
+                raise
+            logger.error(f"Error updating stats counters in MongoDB: {e}")
+    
+    def _supports_transactions(self) -> bool:
+        """האם השרת תומך בטרנזקציות (replica set או mongos)"""
+        if self._transactions is None:
+            try:
+                hello = self.client.admin.command("hello")
+                self._transactions = bool(hello.get("setName") or hello.get("msg") == "isdbgrid")
+            except Exception:
+                self._transactions = False
+        return self._transactions
+    
+    @contextmanager
+    def _transaction(self):
+        """session בתוך טרנזקציה כשהשרת תומך, אחרת None (כתיבות רגילות לפי הסדר)"""
+        if not self._supports_transactions():
+            yield None
+            return
+        with self.client.start_session() as session:
+            with session.start_transaction():
+                yield session
     
     def get_recent_users_activity(self) -> List[Dict[str, Any]]:
-        """קבלת רשימת משתמשים שהשתמשו השבוע - גרסת MongoDB"""
+        """קבלת רשימת משתמשים שהשתמשו השבוע - גרסת MongoDB (עם מטמון קצר לפקודות האדמין)"""
+        cached = self._admin_cache.get('recent_users_activity')
+        if cached is not None:
+            return cached
+        
         try:
             # תאריך לפני שבוע
             week_ago = datetime.now() - timedelta(days=7)
             current_month = datetime.now().strftime("%Y-%m")
             
-            # Pipeline לאיחוד נתונים מכמה קולקשנים
+            def date_key(field: str) -> Dict:
+                return {"$dateToString": {"format": "%d/%m/%Y", "date": field}}
+            
+            # מתחילים מהפעילות האחרונה בלבד (אינדקסים על created_at ו-month),
+            # ורק אחר כך מצרפים את פרטי המשתמשים שנמצאו
             pipeline = [
-                {
-                    "$lookup": {
-                        "from": "watch_topics",
-                        "localField": "user_id",
-                        "foreignField": "user_id",
-                        "as": "topics"
-                    }
-                },
-                {
-                    "$lookup": {
-                        "from": "usage_stats",
-                        "let": {"user_id": "$user_id"},
-                        "pipeline": [
-                            {
-                                "$match": {
-                                    "$expr": {
-                                        "$and": [
-                                            {"$eq": ["$user_id", "$$user_id"]},
-                                            {"$eq": ["$month", current_month]}
-                                        ]
-                                    }
-                                }
-                            }
-                        ],
-                        "as": "usage"
-                    }
-                },
-                {
-                    "$addFields": {
-                        "recent_topics": {
-                            "$filter": {
-                                "input": "$topics",
-                                "cond": {"$gte": ["$$this.created_at", week_ago]}
-                            }
-                        },
-                        "usage_count": {
-                            "$ifNull": [{"$arrayElemAt": ["$usage.usage_count", 0]}, 0]
-                        }
-                    }
-                },
-                {
-                    "$match": {
-                        "$or": [
-                            {"recent_topics": {"$ne": []}},  # יש נושאים מהשבוע
-                            {"created_at": {"$gte": week_ago}},  # נרשם השבוע
-                            {"usage_count": {"$gt": 0}}  # השתמש החודש
-                        ]
-                    }
-                },
-                {
-                    "$project": {
-                        "user_id": 1,
-                        "username": 1,
-                        "created_at": 1,
-                        "topics_added": {"$size": "$recent_topics"},
-                        "usage_count": 1,
-                        "activity_dates": {
-                            "$map": {
-                                "input": "$recent_topics",
-                                "as": "topic",
-                                "in": {
-                                    "$dateToString": {
-                                        "format": "%d/%m/%Y",
-                                        "date": "$$topic.created_at"
-                                    }
-                                }
-                            }
-                        }
-                    }
-                },
-                {
-                    "$addFields": {
-                        "activity_dates": {
-                            "$cond": {
-                                "if": {"$gte": ["$created_at", week_ago]},
-                                "then": {
-                                    "$setUnion": [
-                                        "$activity_dates",
-                                        [{
-                                            "$dateToString": {
-                                                "format": "%d/%m/%Y",
-                                                "date": "$created_at"
-                                            }
-                                        }]
-                                    ]
-                                },
-                                "else": "$activity_dates"
-                            }
-                        }
-                    }
-                },
-                {
-                    "$sort": {"created_at": -1}
-                }
+                {"$match": {"created_at": {"$gte": week_ago}}},
+                {"$group": {
+                    "_id": "$user_id",
+                    "topics_added": {"$sum": 1},
+                    "activity_dates": {"$addToSet": date_key("$created_at")}
+                }},
+                # משתמשים שנרשמו השבוע
+                {"$unionWith": {"coll": "users", "pipeline": [
+                    {"$match": {"created_at": {"$gte": week_ago}}},
+                    {"$project": {"_id": "$user_id", "activity_dates": [date_key("$created_at")]}}
+                ]}},
+                # משתמשים שהשתמשו החודש
+                {"$unionWith": {"coll": "usage_stats", "pipeline": [
+                    {"$match": {"month": current_month, "usage_count": {"$gt": 0}}},
+                    {"$project": {"_id": "$user_id", "usage_count": 1}}
+                ]}},
+                {"$group": {
+                    "_id": "$_id",
+                    "topics_added": {"$sum": "$topics_added"},
+                    "usage_count": {"$max": "$usage_count"},
+                    "activity_dates": {"$push": {"$ifNull": ["$activity_dates", []]}}
+                }},
+                {"$lookup": {
+                    "from": "users",
+                    "localField": "_id",
+                    "foreignField": "user_id",
+                    "as": "user"
+                }},
+                {"$unwind": "$user"},
+                {"$project": {
+                    "_id": 0,
+                    "user_id": "$_id",
+                    "username": "$user.username",
+                    "created_at": "$user.created_at",
+                    "topics_added": 1,
+                    "usage_count": {"$ifNull": ["$usage_count", 0]},
+                    "activity_dates": {"$reduce": {
+                        "input": "$activity_dates",
+                        "initialValue": [],
+                        "in": {"$setUnion": ["$$value", "$$this"]}
+                    }}
+                }},
+                {"$sort": {"created_at": -1}}
             ]
             
-            results = list(self.users_collection.aggregate(pipeline))
+            results = list(self.watch_topics_collection.aggregate(pipeline))
             
             # עיבוד התוצאות לפורמט הנדרש
             users_activity = []
             for user in results:
                 users_activity.append({
                     'user_id': user['user_id'],
-                    'username': user.get('username', f"User_{user['user_id']}"),
+                    'username': user.get('username') or f"User_{user['user_id']}",
                     'topics_added': user.get('topics_added', 0),
                     'usage_count': user.get('usage_count', 0),
-                    'activity_dates': list(set(user.get('activity_dates', [])))  # הסרת כפילויות
+                    'activity_dates': user.get('activity_dates', [])
                 })
             
             logger.info(f"Found {len(users_activity)} recent users")
+            self._admin_cache.set('recent_users_activity', users_activity)
             return users_activity
             
         except Exception as e:
@@ -1532,20 +2424,22 @@ class WatchBotMongoDB:
             return []
     
     def add_user(self, user_id: int, username: str = None):
-        """הוספת משתמש חדש"""
+        """הוספת משתמש חדש או עדכון שם המשתמש (בלי לגעת ב-is_active וב-created_at)"""
+        if self._known_users.get(user_id, _UNKNOWN_USER) == username:
+            return
+        
         try:
-            user_doc = {
-                "user_id": user_id,
-                "username": username,
-                "is_active": True,
-                "created_at": datetime.now()
-            }
-            
-            self.users_collection.update_one(
+            result = self.users_collection.update_one(
                 {"user_id": user_id},
-                {"$setOnInsert": user_doc},
+                {
+                    "$set": {"username": username},
+                    "$setOnInsert": {"is_active": True, "created_at": datetime.now()}
+                },
                 upsert=True
             )
+            if result.upserted_id is not None:
+                self._bump_stats({'total_users': 1, 'active_users': 1})
+            self._known_users.set(user_id, username)
             logger.info(f"User {user_id} added/updated in MongoDB")
             
         except Exception as e:
@@ -1565,6 +2459,8 @@ class WatchBotMongoDB:
             }
             
             result = self.watch_topics_collection.insert_one(topic_doc)
+            self._bump_stats({'active_topics': 1})
+            invalidate_topic_views(user_id)
             logger.info(f"Topic added to MongoDB with ID: {result.inserted_id}")
             return str(result.inserted_id)
             
@@ -1572,7 +2468,108 @@ class WatchBotMongoDB:
             logger.error(f"Error adding watch topic to MongoDB: {e}")
             return None
     
-    def get_user_usage(self, user_id: int) -> Dict[str, int]:
+    def get_user_topics(self, user_id: int) -> List[Topic]:
+        """קבלת רשימת נושאים של משתמש - גרסת MongoDB"""
+        try:
+            docs = self.watch_topics_collection.find(
+                {"user_id": user_id, "is_active": True}
+            ).sort("created_at", -1)
+            
+            topics = []
+            for doc in docs:
+                last_checked = doc.get('last_checked')
+                topics.append(Topic(
+                    id=str(doc['_id']),
+                    user_id=user_id,
+                    topic=doc['topic'],
+                    check_interval=doc['check_interval'],
+                    is_active=doc.get('is_active', True),
+                    created_at=doc.get('created_at'),
+                    last_checked=last_checked.isoformat() if last_checked else None,
+                    checks_remaining=doc.get('checks_remaining')
+                ))
+            return topics
+            
+        except Exception as e:
+            logger.error(f"Error getting user topics from MongoDB: {e}")
+            return []
+    
+    def remove_topic(self, user_id: int, topic_identifier: str) -> bool:
+        """הסרת נושא (לפי ID או שם) - גרסת MongoDB"""
+        from bson import ObjectId
+        
+        try:
+            if ObjectId.is_valid(topic_identifier):
+                topic_filter = {"user_id": user_id, "_id": ObjectId(topic_identifier), "is_active": True}
+            else:
+                topic_filter = {
+                    "user_id": user_id,
+                    "topic": {"$regex": re.escape(topic_identifier), "$options": "i"},
+                    "is_active": True
+                }
+            
+            removed_ids = self.watch_topics_collection.distinct("_id", topic_filter)
+            if not removed_ids:
+                return False
+            result = self.watch_topics_collection.update_many(
+                {"_id": {"$in": removed_ids}, "is_active": True}, {"$set": {"is_active": False}}
+            )
+            self._bump_stats({'active_topics': -result.modified_count})
+            if result.modified_count > 0:
+                invalidate_topic_views(user_id)
+                discard_seen_filters([str(topic_id) for topic_id in removed_ids])
+            return result.modified_count > 0
+            
+        except Exception as e:
+            logger.error(f"Error removing topic from MongoDB: {e}")
+            return False
+    
+    def update_topic_text(self, user_id: int, topic_id: str, new_text: str) -> bool:
+        """עדכון טקסט הנושא - גרסת MongoDB"""
+        from bson import ObjectId
+        
+        try:
+            result = self.watch_topics_collection.update_one(
+                {"user_id": user_id, "_id": ObjectId(topic_id), "is_active": True},
+                {"$set": {"topic": new_text}}
+            )
+            if result.modified_count > 0:
+                invalidate_topic_views(user_id)
+            return result.modified_count > 0
+        except Exception as e:
+            logger.error(f"Error updating topic text: {e}")
+            return False
+    
+    def update_topic_frequency(self, user_id: int, topic_id: str, new_frequency: int) -> bool:
+        """עדכון תדירות בדיקת הנושא - גרסת MongoDB"""
+        from bson import ObjectId
+        
+        try:
+            result = self.watch_topics_collection.update_one(
+                {"user_id": user_id, "_id": ObjectId(topic_id), "is_active": True},
+                {"$set": {"check_interval": new_frequency}}
+            )
+            if result.modified_count > 0:
+                invalidate_topic_views(user_id)
+            return result.modified_count > 0
+        except Exception as e:
+            logger.error(f"Error updating topic frequency: {e}")
+            return False
+    
+    def toggle_user_status(self, user_id: int, is_active: bool):
+        """הפעלה/השבתה של משתמש - גרסת MongoDB"""
+        try:
+            previous = self.users_collection.find_one_and_update(
+                {"user_id": user_id},
+                {"$set": {"is_active": bool(is_active)}},
+                projection={"is_active": 1}
+            )
+            if previous is not None and bool(previous.get('is_active', True)) != bool(is_active):
+                self._bump_stats({'active_users': 1 if is_active else -1})
+        except Exception as e:
+            logger.error(f"Error toggling user status in MongoDB: {e}")
+    
+    def get_user_usage(self, user_id: int) -> UsageInfo:
         """קבלת נתוני שימוש של משתמש - גרסת MongoDB"""
         try:
             current_month = datetime.now().strftime("%Y-%m")
@@ -1584,20 +2581,12 @@ class WatchBotMongoDB:
             
             current_usage = usage_doc['usage_count'] if usage_doc else 0
             
-            return {
-                'current_usage': current_usage,
-                'monthly_limit': MONTHLY_LIMIT,
-                'remaining': MONTHLY_LIMIT - current_usage
-            }
+            return UsageInfo(current_usage, MONTHLY_LIMIT, MONTHLY_LIMIT - current_usage)
             
         except Exception as e:
             logger.error(f"Error getting user usage from MongoDB: {e}")
             # Fallback to default values
-            return {
-                'current_usage': 0,
-                'monthly_limit': MONTHLY_LIMIT,
-                'remaining': MONTHLY_LIMIT
-            }
+            return UsageInfo(0, MONTHLY_LIMIT, MONTHLY_LIMIT)
     
     def check_user_usage(self, user_id: int) -> bool:
         """בדיקה אם המשתמש יכול לבצע חיפוש נוסף - גרסת MongoDB"""
@@ -1623,113 +2612,357 @@ class WatchBotMongoDB:
                 },
                 upsert=True
             )
+            self._bump_stats(usage_stats_deltas(current_month, current_usage, current_usage + 1))
             
             return True
             
         except Exception as e:
             logger.error(f"Error checking user usage in MongoDB: {e}")
             return False
-
-
-class SmartWatcher:
-    """מחלקה לניהול המעקב החכם עם Perplexity API"""
     
-    def __init__(self, db: WatchBotDB):
-        self.db = db
+    def get_active_topics_for_check(self) -> List[Topic]:
+        """קבלת נושאים פעילים לבדיקה לפי תדירות - גרסת MongoDB"""
+        try:
+            current_time = datetime.now()
+            paused_users = set(self.users_collection.distinct("user_id", {"is_active": False}))
+            
+            topics = []
+            for doc in self.watch_topics_collection.find({"is_active": True}):
+                if doc['user_id'] in paused_users:
+                    continue
+                if is_topic_due(doc.get('last_checked'), doc['check_interval'], doc.get('checks_remaining'), current_time):
+                    topics.append(Topic(
+                        id=str(doc['_id']),
+                        user_id=doc['user_id'],
+                        topic=doc['topic'],
+                        check_interval=doc['check_interval'],
+                        last_checked=doc.get('last_checked'),
+                        checks_remaining=doc.get('checks_remaining')
+                    ))
+            return topics
+            
+        except Exception as e:
+            logger.error(f"Error getting active topics from MongoDB: {e}")
+            return []
     
-    def search_and_analyze_topic(self, topic: str, user_id: int = None) -> List[Dict[str, str]]:
-        """חיפוש ואנליזה של נושא עם Perplexity API בלבד"""
-        # בדיקת מגבלת שימוש אם סופק user_id
-        if user_id:
-            usage_info = self.db.get_user_usage(user_id)
-            if usage_info['remaining'] <= 0:
-                return []  # חריגה ממגבלת השימוש
+    def get_topic_by_id(self, topic_id: str) -> Topic:
+        """קבלת פרטי נושא לפי מזהה - גרסת MongoDB"""
+        from bson import ObjectId
+        
+        try:
+            doc = self.watch_topics_collection.find_one({"_id": ObjectId(topic_id)})
+        except Exception as e:
+            logger.error(f"Error getting topic {topic_id} from MongoDB: {e}")
+            return None
+        
+        if doc:
+            return Topic(
+                id=str(doc['_id']),
+                user_id=doc['user_id'],
+                topic=doc['topic'],
+                check_interval=doc['check_interval'],
+                is_active=doc.get('is_active', True),
+                created_at=doc.get('created_at'),
+                last_checked=doc.get('last_checked'),
+                checks_remaining=doc.get('checks_remaining')
+            )
+        return None
+    
+    def _insert_result(self, topic_id: str, title: str, url: str, content_summary: str, session=None) -> str:
+        """הוספת תוצאה אם היא חדשה לנושא - מחזיר את המזהה או None לכפילות"""
+        if not title:
+            title = 'ללא כותרת'
+        if not url:
+            url = ''
+        if not content_summary:
+            content_summary = 'ללא סיכום'
+        
+        # יצירת hash ייחודי לתוכן למניעת כפילויות
+        content_hash = content_fingerprint(title, url, content_summary)
+        url_hash = url_fingerprint(url)
+        
+        existing = self.found_results_collection.find_one(
+            {"topic_id": topic_id, "$or": [{"url_hash": url_hash}, {"content_hash": content_hash}]},
+            {"_id": 1}, session=session
+        ) or self.result_fingerprints_collection.find_one(
+            {"topic_id": topic_id, "$or": [{"url_hash": url_hash}, {"content_hash": content_hash}]},
+            {"_id": 1}, session=session
+        )
+        if existing:
+            return None
+        
+        # טביעת האצבע נשמרת כבר עכשיו - התוצאה המלאה תימחק ע"י אינדקס ה-TTL
+        self.result_fingerprints_collection.insert_one({
+            "topic_id": topic_id,
+            "url_hash": url_hash,
+            "content_hash": content_hash,
+            "found_at": datetime.now()
+        }, session=session)
+        result = self.found_results_collection.insert_one({
+            "topic_id": topic_id,
+            "title": title,
+            "url": url,
+            "content_summary": content_summary,
+            "content_hash": content_hash,
+            "url_hash": url_hash,
+            "found_at": datetime.now(),
+            "is_sent": False
+        }, session=session)
+        # found_at במונגו נשמר בזמן מקומי - גם הדליים
+        self.stats_hourly_collection.update_one(
+            {"_id": stats_hour_key(datetime.now())}, {"$inc": {"results": 1}}, upsert=True, session=session
+        )
+        return str(result.inserted_id)
+    
+    def save_result(self, topic_id: str, title: str, url: str, content_summary: str) -> str:
+        """שמירת תוצאה שנמצאה - גרסת MongoDB"""
+        try:
+            return self._insert_result(topic_id, title, url, content_summary)
+            
+        except Exception as e:
+            logger.error(f"Error saving result for topic {topic_id}: {e}")
+            return None
+    
+    def get_result_fingerprints(self, topic_id: str) -> List[str]:
+        """כל טביעות האצבע (קישור ותוכן) של תוצאות שנשמרו לנושא - גרסת MongoDB"""
+        fingerprints = []
+        # תוצאות ישנות נשמרו לפני שנוספו טביעות האצבע - לכן קוראים גם אותן
+        for doc in self.found_results_collection.find(
+            {"topic_id": topic_id}, {"_id": 0, "url_hash": 1, "content_hash": 1}
+        ):
+            fingerprints.extend(fp for fp in (doc.get("url_hash"), doc.get("content_hash")) if fp)
+        
+        for doc in self.result_fingerprints_collection.find(
+            {"topic_id": topic_id}, {"_id": 0, "url_hash": 1, "content_hash": 1}
+        ):
+            fingerprints.extend(fp for fp in (doc.get("url_hash"), doc.get("content_hash")) if fp)
+        return fingerprints
 
-        # Create a simple topic object for compatibility
-        class TopicObj:
-            def __init__(self, query, user_id, topic_id):
-                self.query = query
-                self.user_id = user_id
-                self.id = topic_id or user_id  # Use user_id as fallback for topic_id
+    def get_topic_watermark(self, topic_id: str, max_urls: int = 20) -> Dict:
+        """סימן המים של נושא - גרסת MongoDB"""
+        from bson import ObjectId
+        
+        doc = self.watch_topics_collection.find_one({"_id": ObjectId(topic_id)}, {"last_checked": 1})
+        urls = [
+            canonicalize_url(result["url"])
+            for result in self.found_results_collection.find(
+                {"topic_id": topic_id}, {"_id": 0, "url": 1}
+            ).sort("found_at", -1).limit(max_urls)
+            if result.get("url")
+        ]
+        
+        # last_checked במונגו נשמר בזמן מקומי - ממירים ל-UTC כמו ב-SQLite
+        since = doc.get("last_checked") if doc else None
+        if since is not None:
+            since = since + (datetime.utcnow() - datetime.now())
+        return {'since': since, 'recent_urls': urls}
+    
+    def _mark_topic_checked(self, topic_id: str, session=None):
+        """עדכון זמן הבדיקה וספירת הבדיקות הנותרות - מחזיר את המשתמש של הנושא"""
+        from bson import ObjectId
+        
+        topic_filter = {"_id": ObjectId(topic_id)}
+        doc = self.watch_topics_collection.find_one(
+            topic_filter, {"checks_remaining": 1, "is_active": 1, "user_id": 1}, session=session
+        )
+        update = {"$set": {"last_checked": datetime.now()}}
+        
+        checks_remaining = doc.get('checks_remaining') if doc else None
+        if checks_remaining is not None:
+            if checks_remaining <= 1 and doc.get('is_active', True):
+                # הנושא הופך ללא פעיל בבדיקה הזו
+                self._bump_stats({'active_topics': -1}, session=session)
+            if checks_remaining > 1:
+                update["$inc"] = {"checks_remaining": -1}
+            elif checks_remaining == 1:
+                # זו הבדיקה האחרונה - הפוך את הנושא ללא פעיל
+                update["$set"].update({"checks_remaining": 0, "is_active": False})
+            else:
+                update["$set"]["is_active"] = False
         
-        topic_obj = TopicObj(topic, user_id, user_id)
-        return run_topic_search(topic_obj)
+        self.watch_topics_collection.update_one(topic_filter, update, session=session)
+        return doc.get('user_id') if doc else None
     
-    def update_topic_text(self, user_id: int, topic_id: str, new_text: str) -> bool:
-        """עדכון טקסט הנושא"""
+    @traced("update_topic_checked")
+    def update_topic_checked(self, topic_id: str):
+        """עדכון זמן הבדיקה האחרון וספירת בדיקות נותרות - גרסת MongoDB"""
+        invalidate_topic_views(self._mark_topic_checked(topic_id))
+    
+    def _debit_usage(self, user_id: int, used: int, session=None) -> int:
+        """חיוב המכסה החודשית - מחזיר כמה נשאר"""
+        current_month = datetime.now().strftime("%Y-%m")
+        result = self.usage_stats_collection.find_one_and_update(
+            {"user_id": user_id, "month": current_month},
+            {
+                "$inc": {"usage_count": used},
+                "$setOnInsert": {"created_at": datetime.now()}
+            },
+            upsert=True,
+            return_document=True,  # Return updated document
+            session=session
+        )
+        
+        new_usage_count = result.get('usage_count', used)
+        self._bump_stats(usage_stats_deltas(current_month, new_usage_count - used, new_usage_count), session=session)
+        return max(MONTHLY_LIMIT - new_usage_count, 0)
+    
+    def debit_usage(self, user_id: int, used: int = 1) -> int:
+        """חיוב המכסה החודשית של משתמש - גרסת MongoDB"""
         try:
-            result = self.watch_topics_collection.update_one(
-                {"user_id": user_id, "_id": ObjectId(topic_id), "is_active": True},
-                {"$set": {"topic": new_text}}
+            return self._debit_usage(user_id, used)
+        except Exception as e:
+            logger.error(f"Error updating credits in MongoDB: {e}")
+            return max(self.get_user_usage(user_id).remaining - used, 0)
+    
+    def is_check_applied(self, check_id: str) -> bool:
+        """האם בדיקת הנושא עם המזהה הזה כבר נכתבה - גרסת MongoDB"""
+        return self.completed_checks_collection.find_one({"_id": check_id}, {"_id": 1}) is not None
+    
+    @traced("commit_check")
+    def commit_check(self, check_id: str, topic_id: str, user_id: int, debit: int,
+                     results: List[tuple], mark_checked: bool = True) -> List[str]:
+        """
+        כל הכתיבות של בדיקת נושא אחת - בטרנזקציה כשהשרת תומך (replica set),
+        ואחרת לפי הסדר כשסימון הבדיקה נכתב ראשון, כך שניסיון חוזר לא מחייב ולא שומר פעמיים.
+        מחזיר את מזהי התוצאות לפי הסדר (None לכפילות), או None אם הבדיקה הזו כבר נכתבה
+        """
+        from pymongo.errors import DuplicateKeyError
+        
+        if not self._supports_transactions():
+            result_ids = self._commit_check_in_order(check_id, topic_id, user_id, debit, results, mark_checked)
+            if result_ids is not None and mark_checked:
+                invalidate_topic_views(user_id)
+            return result_ids
+        
+        try:
+            # שגיאה בתוך הבלוק (כולל סימון כפול) מבטלת את הטרנזקציה כולה
+            with self._transaction() as session:
+                self.completed_checks_collection.insert_one(
+                    {"_id": check_id, "topic_id": topic_id, "completed_at": datetime.now()}, session=session
+                )
+                if debit:
+                    self._debit_usage(user_id, debit, session=session)
+                result_ids = [self._insert_result(topic_id, *result, session=session) for result in results]
+                if mark_checked:
+                    self._mark_topic_checked(topic_id, session=session)
+        except DuplicateKeyError:
+            return None
+        
+        if mark_checked:
+            invalidate_topic_views(user_id)
+        return result_ids
+    
+    def _commit_check_in_order(self, check_id: str, topic_id: str, user_id: int, debit: int,
+                               results: List[tuple], mark_checked: bool) -> List[str]:
+        """
+        commit_check בלי טרנזקציה. כשלון באמצע מוחק את סימון הבדיקה ואת התוצאות שכבר נשמרו,
+        כדי שניסיון חוזר יכתוב אותן מחדש; חיוב שכבר נכתב נשאר ומדווח ב-CheckWriteError
+        """
+        from pymongo.errors import DuplicateKeyError
+        
+        try:
+            self.completed_checks_collection.insert_one(
+                {"_id": check_id, "topic_id": topic_id, "completed_at": datetime.now()}
             )
-            return result.modified_count > 0
+        except DuplicateKeyError:
+            return None
+        
+        debited = 0
+        result_ids = []
+        try:
+            if debit:
+                self._debit_usage(user_id, debit)
+                debited = debit
+            for result in results:
+                result_ids.append(self._insert_result(topic_id, *result))
+            if mark_checked:
+                self._mark_topic_checked(topic_id)
         except Exception as e:
-            logger.error(f"Error updating topic text: {e}")
-            return False
+            self._undo_check(check_id, topic_id, [result_id for result_id in result_ids if result_id])
+            raise CheckWriteError(f"Check {check_id} failed after a partial write: {e}", debited) from e
+        return result_ids
     
-    def update_topic_frequency(self, user_id: int, topic_id: str, new_frequency: int) -> bool:
-        """עדכון תדירות בדיקת הנושא"""
+    def _undo_check(self, check_id: str, topic_id: str, result_ids: List[str]):
+        """מחיקת הסימון והתוצאות של בדיקה שנכתבה חלקית"""
+        from bson import ObjectId
+        
         try:
-            result = self.watch_topics_collection.update_one(
-                {"user_id": user_id, "_id": ObjectId(topic_id), "is_active": True},
-                {"$set": {"check_interval": new_frequency}}
+            self.completed_checks_collection.delete_one({"_id": check_id})
+        except Exception as e:
+            logger.error(f"Error removing completed check {check_id} from MongoDB: {e}")
+        if not result_ids:
+            return
+        try:
+            object_ids = [ObjectId(result_id) for result_id in result_ids]
+            # טביעות האצבע של התוצאות החדשות - לנושא לא הייתה קודם אף אחת עם אותו hash
+            content_hashes = self.found_results_collection.distinct("content_hash", {"_id": {"$in": object_ids}})
+            self.result_fingerprints_collection.delete_many(
+                {"topic_id": topic_id, "content_hash": {"$in": content_hashes}}
             )
-            return result.modified_count > 0
+            self.found_results_collection.delete_many({"_id": {"$in": object_ids}})
         except Exception as e:
-            logger.error(f"Error updating topic frequency: {e}")
-            return False
+            logger.error(f"Error removing partial results of check {check_id} from MongoDB: {e}")
+    
+    def apply_retention(self, retention_days: int) -> Dict[str, int]:
+        """מחיקת תוצאות של נושאים לא פעילים (תוצאות ישנות נמחקות ע"י אינדקס ה-TTL)"""
+        inactive_ids = [str(topic_id) for topic_id in self.watch_topics_collection.distinct("_id", {"is_active": False})]
+        pruned_topic_ids = set(self.found_results_collection.distinct("topic_id", {"topic_id": {"$in": inactive_ids}}))
+        pruned_topic_ids.update(
+            self.result_fingerprints_collection.distinct("topic_id", {"topic_id": {"$in": inactive_ids}})
+        )
+        pruned = self.found_results_collection.delete_many({"topic_id": {"$in": inactive_ids}}).deleted_count
+        pruned_fingerprints = self.result_fingerprints_collection.delete_many(
+            {"topic_id": {"$in": inactive_ids}}
+        ).deleted_count
+        self.stats_hourly_collection.delete_many(
+            {"_id": {"$lt": stats_hour_key(datetime.now() - timedelta(hours=48))}}
+        )
+        discard_seen_filters(list(pruned_topic_ids))
+        return {
+            'compacted': 0,
+            'pruned': pruned,
+            'pruned_fingerprints': pruned_fingerprints,
+            'vacuumed_pages': 0
+        }
+    
+    def get_storage_usage(self) -> Dict[str, int]:
+        """נתוני שימוש באחסון - לאדמין"""
+        db_stats = self.db.command("dbStats")
+        return {
+            'database_bytes': int(db_stats.get('storageSize', 0)),
+            'data_bytes': int(db_stats.get('dataSize', 0)),
+            'index_bytes': int(db_stats.get('indexSize', 0)),
+            'results_count': self.found_results_collection.estimated_document_count(),
+            'fingerprints_count': self.result_fingerprints_collection.estimated_document_count()
+        }
     
     def get_stats(self) -> Dict[str, int]:
-        """קבלת סטטיסטיקות כלליות - גרסת MongoDB"""
+        """קבלת סטטיסטיקות כלליות - גרסת MongoDB (מהמונים המתוחזקים)"""
         try:
             current_month = datetime.now().strftime("%Y-%m")
+            names = ['total_users', 'active_users', 'active_topics',
+                     f'usage_total:{current_month}', f'users_with_usage:{current_month}',
+                     f'users_at_limit:{current_month}']
+            counters = {
+                doc["_id"]: doc.get("value", 0)
+                for doc in self.stats_counters_collection.find({"_id": {"$in": names}})
+            }
             
-            # ספירת משתמשים
-            total_users = self.users_collection.count_documents({})
-            active_users = self.users_collection.count_documents({"is_active": True})
-            
-            # ספירת נושאים
-            active_topics = self.watch_topics_collection.count_documents({"is_active": True})
-            
-            # ספירת תוצאות
-            total_results = self.found_results_collection.count_documents({})
-            
-            # תוצאות מהיום האחרון
-            yesterday = datetime.now() - timedelta(hours=24)
-            results_today = self.found_results_collection.count_documents({
-                "found_at": {"$gte": yesterday}
-            })
-            
-            # סטטיסטיקות שימוש חודשיות
-            usage_pipeline = [
-                {"$match": {"month": current_month}},
-                {"$group": {
-                    "_id": None,
-                    "users_with_usage": {"$sum": 1},
-                    "total_usage_this_month": {"$sum": "$usage_count"},
-                    "users_at_limit": {
-                        "$sum": {"$cond": [{"$gte": ["$usage_count", MONTHLY_LIMIT]}, 1, 0]}
-                    }
-                }}
-            ]
-            
-            usage_stats = list(self.usage_stats_collection.aggregate(usage_pipeline))
-            if usage_stats:
-                users_with_usage = usage_stats[0].get("users_with_usage", 0)
-                total_usage_this_month = usage_stats[0].get("total_usage_this_month", 0)
-                users_at_limit = usage_stats[0].get("users_at_limit", 0)
-            else:
-                users_with_usage = total_usage_this_month = users_at_limit = 0
+            since = stats_hour_key(datetime.now() - timedelta(hours=24))
+            results_today = sum(
+                doc.get("results", 0) for doc in self.stats_hourly_collection.find({"_id": {"$gt": since}})
+            )
             
             return {
-                "total_users": total_users,
-                "active_users": active_users,
-                "users_with_usage": users_with_usage,
-                "users_at_limit": users_at_limit,
-                "active_topics": active_topics,
-                "total_results": total_results,
+                "total_users": counters.get('total_users', 0),
+                "active_users": counters.get('active_users', 0),
+                "users_with_usage": counters.get(f'users_with_usage:{current_month}', 0),
+                "users_at_limit": counters.get(f'users_at_limit:{current_month}', 0),
+                "active_topics": counters.get('active_topics', 0),
+                # אינדקס ה-TTL מוחק תוצאות ברקע, ולכן סופרים לפי המטא-דאטה של הקולקשן
+                "total_results": self.found_results_collection.estimated_document_count(),
                 "results_today": results_today,
-                "total_usage_this_month": total_usage_this_month
+                "total_usage_this_month": counters.get(f'usage_total:{current_month}', 0)
             }
             
         except Exception as e:
@@ -1745,6 +2978,24 @@ class SmartWatcher:
                 "total_usage_this_month": 0
             }
 
+
+class SmartWatcher:
+    """מחלקה לניהול המעקב החכם עם Perplexity API"""
+    
+    def __init__(self, db: WatchBotDB):
+        self.db = db
+    
+    def search_and_analyze_topic(self, topic: str, user_id: int = None) -> List[SearchResult]:
+        """חיפוש ואנליזה של נושא עם Perplexity API בלבד"""
+        # בדיקת מגבלת שימוש אם סופק user_id
+        if user_id:
+            usage_info = self.db.get_user_usage(user_id)
+            if usage_info.remaining <= 0:
+                return []  # חריגה ממגבלת השימוש
+
+        # אין כאן נושא שמור אמיתי - לא מסננים לפי תוצאות שנראו
+        return run_topic_search(Topic(id=user_id, user_id=user_id, topic=topic), skip_seen=False)
+
 # יצירת אובייקטי המערכת
 if USE_MONGODB:
     logger.info("Using MongoDB database")
@@ -1755,46 +3006,153 @@ else:
 
 smart_watcher = SmartWatcher(db)
 
-# שרת Flask ל-Keep-Alive
-app = Flask(__name__)
+# תור בדיקות משותף למתזמן ולתהליכי ה-worker
+work_queue = create_work_queue(
+    WORK_QUEUE_MAX_ATTEMPTS,
+    db_path=DB_PATH,
+    mongo_db=db.db if USE_MONGODB else None
+)
 
-@app.route('/')
-def health_check():
-    return jsonify({"status": "Bot is running", "timestamp": datetime.now().isoformat()})
+# חכירת המנהיג של מתזמן הבדיקות
+leader_lease = create_leader_lease(
+    "topic_scheduler",
+    LEADER_LEASE_TTL_SECONDS,
+    db_path=DB_PATH,
+    mongo_db=db.db if USE_MONGODB else None
+)
 
-@app.route('/health')
-def health():
-    return jsonify({"status": "healthy"})
+# בדיקות חד-פעמיות ממתינות - שמורות בבסיס הנתונים כדי לשרוד הפעלה מחדש
+pending_checks = create_pending_checks(
+    db_path=DB_PATH,
+    mongo_db=db.db if USE_MONGODB else None
+)
 
-def run_flask():
-    """הרצת שרת Flask ברקע"""
-    app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
+# מסנני התוצאות שכבר נראו - נבנים בעצלות מבסיס הנתונים לכל נושא
+seen_results = SeenResultsFilter(
+    loader=db.get_result_fingerprints,
+    snapshot_dir=SEEN_FILTER_DIR,
+    capacity=SEEN_FILTER_CAPACITY,
+    error_rate=SEEN_FILTER_ERROR_RATE
+)
 
-def get_main_menu_keyboard(user_id=None):
-    """יצירת תפריט הכפתורים הראשי"""
-    keyboard = []
+class CheckUnitOfWork:
+    """
+    כל הכתיבות של בדיקת נושא אחת - חיוב המכסה, התוצאות החדשות ועדכון זמן הבדיקה.
+    נאספות בזיכרון במהלך הבדיקה ונכתבות יחד ב-commit אחד. מזהה הבדיקה מונע כתיבה כפולה
+    כשאותה בדיקה רצה שוב (ניסיון חוזר מהתור, או שתי בדיקות שהתחילו מאותו last_checked).
+    """
+    
+    def __init__(self, topic: Topic, check_id: str = None):
+        self.topic = topic
+        self.check_id = check_id or f"{topic.id}:{topic.last_checked or 'new'}"
+        self.debit = 0
+        self.results = []
+        self.mark_topic = False
+        self.committed = False
+    
+    def already_applied(self) -> bool:
+        """האם הבדיקה הזו כבר נכתבה (ואז אין טעם לחפש שוב)"""
+        return db.is_check_applied(self.check_id)
+    
+    def charge(self, cost: int):
+        """חיוב המכסה - נכתב עם שאר הבדיקה"""
+        self.debit += cost
+    
+    def add_result(self, result: SearchResult, content_summary: str = None):
+        """
+        תוצאה לשמירה אם היא חדשה לנושא. תוצאה שהמסנן מכיר נדחית כבר כאן;
+        השאר עוברות את בדיקת הכפילויות הרגילה בזמן ה-commit.
+        """
+        title = result.title or 'ללא כותרת'
+        summary = content_summary if content_summary is not None else result.summary
+        if seen_results.might_contain(self.topic.id, *result_fingerprints(title, result.url, summary)):
+            return
+        self.results.append((result, (title, result.url, summary)))
     
+    def mark_checked(self):
+        """עדכון זמן הבדיקה וספירת הבדיקות הנותרות"""
+        self.mark_topic = True
+    
+    def commit(self) -> List[SearchResult]:
+        """כתיבת הבדיקה - מחזיר את התוצאות שנשמרו כחדשות, או None אם הבדיקה כבר נכתבה קודם"""
+        try:
+            result_ids = db.commit_check(
+                self.check_id, self.topic.id, self.topic.user_id, self.debit,
+                [fields for _, fields in self.results], mark_checked=self.mark_topic
+            )
+        except CheckWriteError as e:
+            # החלק מהחיוב שכבר נכתב לא יחויב שוב ב-abandon
+            self.debit -= e.debited
+            raise
+        self.committed = True
+        if result_ids is None:
+            logger.info("Check %s for topic %s was already applied, skipping its writes", self.check_id, self.topic.id)
+            return None
+        
+        new_results = []
+        for (result, fields), result_id in zip(self.results, result_ids):
+            if result_id:
+                seen_results.add(self.topic.id, *result_fingerprints(*fields))
+                new_results.append(result)
+        
+        # זו הייתה הבדיקה האחרונה של הנושא - המסנן שלו כבר לא נחוץ
+        checks_remaining = self.topic.checks_remaining
+        if self.mark_topic and checks_remaining is not None and checks_remaining <= 1:
+            discard_seen_filters([self.topic.id])
+        return new_results
+    
+    def abandon(self):
+        """
+        הבדיקה נכשלה לפני ה-commit - חיפושים שכבר בוצעו עדיין מחויבים (בלי לצרוך את מזהה הבדיקה).
+        מחויב רק מה שה-commit לא הספיק לכתוב
+        """
+        if self.committed or not self.debit:
+            return
+        try:
+            db.debit_usage(self.topic.user_id, self.debit)
+            self.debit = 0
+        except Exception as cred_err:
+            logger.error("[CREDITS] failed to decrement: %s", cred_err)
 
+# שרת Flask ל-Keep-Alive - נבנה רק בהפעלת הבוט
+def create_health_app():
+    """אפליקציית Flask עם נקודות הבדיקה"""
+    from flask import Flask, jsonify
     
-    keyboard.extend([
-        [InlineKeyboardButton("📌 הוסף נושא חדש", callback_data="add_topic")],
-        [InlineKeyboardButton("📋 הצג רשימת נושאים", callback_data="list_topics")],
-        [InlineKeyboardButton("⏸️ השבת מעקב", callback_data="pause_tracking"),
-         InlineKeyboardButton("▶️ הפעל מחדש", callback_data="resume_tracking")],
-        [InlineKeyboardButton("📊 שימוש נוכחי", callback_data="usage_stats"),
-         InlineKeyboardButton("❓ עזרה", callback_data="help")]
-    ])
+    app = Flask(__name__)
     
-    # הוספת כפתור אדמין אם המשתמש הוא אדמין
-    logger.info(f"Checking admin access: user_id={user_id}, ADMIN_ID={ADMIN_ID}, match={user_id == ADMIN_ID}")
-    if user_id == ADMIN_ID:
-        logger.info("Adding admin button for recent users")
-        keyboard.append([InlineKeyboardButton("👥 משתמשים אחרונים", callback_data="recent_users")])
-    else:
-        # לוג זמני לדיבוג - הסר אחרי שהבעיה תיפתר
-        logger.info(f"User {user_id} is not admin (ADMIN_ID={ADMIN_ID})")
+    @app.route('/')
+    def health_check():
+        return jsonify({"status": "Bot is running", "timestamp": datetime.now().isoformat()})
     
-    return InlineKeyboardMarkup(keyboard)
+    @app.route('/health')
+    def health():
+        return jsonify({"status": "healthy"})
+    
+    return app
+
+def run_flask():
+    """הרצת שרת Flask ברקע"""
+    create_health_app().run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
+
+_MAIN_MENU_ROWS = [
+    [InlineKeyboardButton("📌 הוסף נושא חדש", callback_data="add_topic")],
+    [InlineKeyboardButton("📋 הצג רשימת נושאים", callback_data="list_topics")],
+    [InlineKeyboardButton("⏸️ השבת מעקב", callback_data="pause_tracking"),
+     InlineKeyboardButton("▶️ הפעל מחדש", callback_data="resume_tracking")],
+    [InlineKeyboardButton("📊 שימוש נוכחי", callback_data="usage_stats"),
+     InlineKeyboardButton("❓ עזרה", callback_data="help")]
+]
+
+# התפריט הראשי קבוע - נבנה פעם אחת (עם כפתור האדמין ובלעדיו)
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup(_MAIN_MENU_ROWS)
+ADMIN_MAIN_MENU_KEYBOARD = InlineKeyboardMarkup(
+    _MAIN_MENU_ROWS + [[InlineKeyboardButton("👥 משתמשים אחרונים", callback_data="recent_users")]]
+)
+
+def get_main_menu_keyboard(user_id=None):
+    """תפריט הכפתורים הראשי (עם כפתור משתמשים אחרונים לאדמין)"""
+    return ADMIN_MAIN_MENU_KEYBOARD if user_id == ADMIN_ID else MAIN_MENU_KEYBOARD
 
 def get_quick_commands_keyboard(user_id=None):
     """יצירת תפריט פקודות מהירות (רק לאדמין)"""
@@ -1822,7 +3180,7 @@ async def show_frequency_selection(query, user_id, topic_id, is_edit=False):
     """הצגת תפריט בחירת תדירות לעריכה"""
     # קבלת פרטי הנושא
     topics = db.get_user_topics(user_id)
-    topic = next((t for t in topics if str(t['id']) == str(topic_id)), None)
+    topic = next((t for t in topics if str(t.id) == str(topic_id)), None)
     
     if not topic:
         await query.edit_message_text(
@@ -1831,17 +3189,11 @@ async def show_frequency_selection(query, user_id, topic_id, is_edit=False):
         )
         return
     
-    current_freq = {
-        6: "כל 6 שעות",
-        12: "כל 12 שעות", 
-        24: "כל 24 שעות",
-        48: "כל 48 שעות",
-        168: "אחת לשבוע"
-    }.get(topic['check_interval'], f"כל {topic['check_interval']} שעות")
+    current_freq = frequency_label(topic.check_interval)
     
     message = f"""⏰ עריכת תדירות עדכון
 
-📝 נושא: {topic['topic']}
+📝 נושא: {topic.topic}
 🕐 תדירות נוכחית: {current_freq}
 
 בחרו תדירות חדשה:"""
@@ -1876,8 +3228,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🧠 אני משתמש ב-Perplexity בינה מלאכותית עם יכולות גלישה באינטרנט לחיפוש מידע עדכני ורלוונטי.
 
 📊 **מגבלת השימוש החודשית:**
-🔍 השתמשת ב-{usage_info['current_usage']} מתוך {usage_info['monthly_limit']} בדיקות
-⏳ נותרו לך {usage_info['remaining']} בדיקות החודש
+🔍 השתמשת ב-{usage_info.current_usage} מתוך {usage_info.monthly_limit} בדיקות
+⏳ נותרו לך {usage_info.remaining} בדיקות החודש
 
 📞 לכל תקלה או ביקורת ניתן לפנות ל-@moominAmir בטלגרם
 
@@ -1904,12 +3256,7 @@ async def watch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     topic_id = db.add_watch_topic(user_id, topic)
     
     # תזמון בדיקה חד-פעמית דקה לאחר הוספת הנושא
-    context.application.job_queue.run_once(
-        check_single_topic_job,
-        when=timedelta(minutes=1),
-        data={'topic_id': topic_id, 'user_id': user_id},
-        name=f"one_time_check_{topic_id}"
-    )
+    schedule_one_time_check(context.application.job_queue, topic_id, user_id)
     
     await update.message.reply_text(
         f"✅ הנושא נוסף בהצלחה!\n"
@@ -1920,28 +3267,29 @@ async def watch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"אבדוק אותו כל 24 שעות ואתריע על תוכן חדש."
     )
 
-async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """פקודת רשימת נושאים"""
-    reporter.report_activity(update.effective_user.id)
-    user = update.effective_user
-    user_id = user.id
-    
-    # הוספת המשתמש למאגר הנתונים (אם לא קיים)
-    db.add_user(user_id, user.username)
+def render_topics_list(user_id: int) -> tuple:
+    """
+    הודעת רשימת הנושאים והמקלדת שלה - מהמטמון אם יש.
+    משותף ל-/list ולכפתור הרשימה; נבנה מחדש רק אחרי שינוי בנושאים של המשתמש או אחרי ה-TTL
+    """
+    cached = topic_views_cache.get(user_id)
+    if cached is not None:
+        return cached
     
     topics = db.get_user_topics(user_id)
     
     if not topics:
         message = "📭 אין לכם נושאים במעקב כרגע.\nהשתמשו בכפתור 'הוסף נושא חדש' כדי להתחיל."
-        await update.message.reply_text(message, reply_markup=get_main_menu_keyboard(user_id))
-        return
+        view = (message, get_main_menu_keyboard(user_id))
+        topic_views_cache.set(user_id, view)
+        return view
     
-    message = "📋 הנושאים שלכם במעקב:\n\n"
+    lines = ["📋 הנושאים שלכם במעקב:\n"]
     keyboard = []
     
     for i, topic in enumerate(topics, 1):
         status = "🟢"  # כל הנושאים פעילים (אחרת הם לא מוצגים)
-        last_check = topic['last_checked'] or "מעולם לא"
+        last_check = topic.last_checked or "מעולם לא"
         if last_check != "מעולם לא":
             # קיצור התאריך להצגה נוחה יותר
             try:
@@ -1950,32 +3298,38 @@ async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 pass
         
         # הוספת מידע על תדירות הבדיקה
-        if topic['check_interval'] == 0.0833:
-            freq_text = f"כל 5 דקות ({topic.get('checks_remaining', 0)} נותרו)" if topic.get('checks_remaining') else "כל 5 דקות (הושלם)"
+        if topic.check_interval == 0.0833:
+            freq_text = f"כל 5 דקות ({topic.checks_remaining} נותרו)" if topic.checks_remaining else "כל 5 דקות (הושלם)"
         else:
-            freq_text = {
-                6: "כל 6 שעות",
-                12: "כל 12 שעות", 
-                24: "כל 24 שעות",
-                48: "כל 48 שעות",
-                168: "אחת לשבוע"
-            }.get(topic['check_interval'], f"כל {topic['check_interval']} שעות")
-        
-        message += f"{i}. {status} {topic['topic']}\n"
-        message += f"   🆔 {topic['id']} | ⏰ {freq_text}\n"
-        message += f"   🕐 נבדק: {last_check}\n\n"
+            freq_text = frequency_label(topic.check_interval)
+        
+        lines.append(f"{i}. {status} {topic.topic}")
+        lines.append(f"   🆔 {topic.id} | ⏰ {freq_text}")
+        lines.append(f"   🕐 נבדק: {last_check}\n")
         
         # הוספת כפתורי עריכה ומחיקה לכל נושא
-        topic_name_short = topic['topic'][:15] + ('...' if len(topic['topic']) > 15 else '')
+        topic_name_short = topic.topic[:15] + ('...' if len(topic.topic) > 15 else '')
         keyboard.append([
-            InlineKeyboardButton(f"✏️ ערוך '{topic_name_short}'", callback_data=f"edit_topic_{topic['id']}"),
-            InlineKeyboardButton(f"🗑️ מחק '{topic_name_short}'", callback_data=f"delete_topic_{topic['id']}")
+            InlineKeyboardButton(f"✏️ ערוך '{topic_name_short}'", callback_data=f"edit_topic_{topic.id}"),
+            InlineKeyboardButton(f"🗑️ מחק '{topic_name_short}'", callback_data=f"delete_topic_{topic.id}")
         ])
     
     # הוספת כפתור חזרה לתפריט
     keyboard.append([InlineKeyboardButton("🔙 חזרה לתפריט", callback_data="main_menu")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    view = ("\n".join(lines) + "\n", InlineKeyboardMarkup(keyboard))
+    topic_views_cache.set(user_id, view)
+    return view
+
+async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """פקודת רשימת נושאים"""
+    reporter.report_activity(update.effective_user.id)
+    user = update.effective_user
+    user_id = user.id
     
+    # הוספת המשתמש למאגר הנתונים (אם לא קיים)
+    db.add_user(user_id, user.username)
+    
+    message, reply_markup = render_topics_list(user_id)
     await update.message.reply_text(message, reply_markup=reply_markup)
 
 async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2100,10 +3454,65 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • ממוצע למשתמש: {total_usage_this_month/users_with_usage if users_with_usage > 0 else 0:.1f}
 
 🧠 משתמש ב-Perplexity בינה מלאכותית עם גלישה
+"""
+    
+    if len(search_router.providers) > 1:
+        stats_message += "\n🔀 **ספקי חיפוש:**\n"
+        for provider in search_router.snapshot():
+            latency = f"{provider['latency']:.1f}s" if provider['latency'] is not None else "-"
+            status = "✅" if provider['available'] else "⛔"
+            stats_message += f"• {status} {provider['name']}: {latency}, שגיאות {provider['error_rate']:.0%} ({provider['samples']} חיפושים)\n"
+    
+    if WORK_QUEUE_ENABLED:
+        queue_stats = work_queue.stats()
+        stats_message += f"""
+📥 **תור בדיקות:**
+• ממתינות: {queue_stats['pending']}
+• בעיבוד: {queue_stats['in_progress']}
 """
     
     await update.message.reply_text(stats_message, parse_mode='Markdown')
 
+async def storage_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """שימוש בדיסק ובאחסון (אדמין בלבד)"""
+    reporter.report_activity(update.effective_user.id)
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    try:
+        usage = db.get_storage_usage()
+    except Exception as e:
+        logger.error(f"Error getting storage usage: {e}")
+        await update.message.reply_text("❌ שגיאה בטעינת נתוני האחסון.")
+        return
+    
+    mb = 1024 * 1024
+    storage_message = f"""
+💾 **שימוש באחסון**
+
+🗄️ **בסיס נתונים:**
+• גודל: {usage['database_bytes'] / mb:.1f} MB
+"""
+    if 'wal_bytes' in usage:
+        storage_message += f"• קובץ WAL: {usage['wal_bytes'] / mb:.1f} MB\n"
+        storage_message += f"• מקום לשחרור: {usage['reclaimable_bytes'] / mb:.1f} MB\n"
+    if 'index_bytes' in usage:
+        storage_message += f"• נתונים: {usage['data_bytes'] / mb:.1f} MB\n"
+        storage_message += f"• אינדקסים: {usage['index_bytes'] / mb:.1f} MB\n"
+    
+    storage_message += f"""
+🔍 **תוצאות:**
+• תוצאות מלאות: {usage['results_count']}
+• טביעות אצבע (אחרי {RESULT_RETENTION_DAYS} ימים): {usage['fingerprints_count']}
+"""
+    if 'disk_total_bytes' in usage:
+        storage_message += f"""
+📀 **דיסק:**
+• פנוי: {usage['disk_free_bytes'] / mb:.0f} MB מתוך {usage['disk_total_bytes'] / mb:.0f} MB
+"""
+    
+    await update.message.reply_text(storage_message, parse_mode='Markdown')
+
 async def test_search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """פקודת בדיקה מהירה (אדמין בלבד)"""
     reporter.report_activity(update.effective_user.id)
@@ -2124,9 +3533,9 @@ async def test_search_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         if results:
             message = f"✅ נמצאו {len(results)} תוצאות עבור '{topic}':\n\n"
             for i, result in enumerate(results[:3], 1):
-                message += f"{i}. **{result.get('title', 'ללא כותרת')}**\n"
-                message += f"🔗 {result.get('url', 'ללא קישור')}\n"
-                message += f"📝 {result.get('summary', 'ללא סיכום')}\n\n"
+                message += f"{i}. **{result.title or 'ללא כותרת'}**\n"
+                message += f"🔗 {result.url or 'ללא קישור'}\n"
+                message += f"📝 {result.summary or 'ללא סיכום'}\n\n"
         else:
             message = f"❌ לא נמצאו תוצאות עבור '{topic}'"
         
@@ -2135,234 +3544,364 @@ async def test_search_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     except Exception as e:
         await update.message.reply_text(f"❌ שגיאה בבדיקה: {str(e)}")
 
-# פונקציית בדיקה חד-פעמית לנושא חדש
+# בדיקות חד-פעמיות לנושא חדש - נשמרות ב-pending_checks ומופעלות בטיימר של ה-JobQueue
+def start_one_time_check_timer(job_queue, pending: dict):
+    """טיימר לבדיקה ממתינה - מחליף טיימר קודם של אותו נושא"""
+    name = f"one_time_check_{pending['topic_id']}"
+    for job in job_queue.get_jobs_by_name(name):
+        job.schedule_removal()
+    job_queue.run_once(
+        check_single_topic_job,
+        when=max(pending['due_at'] - time.time(), 0),
+        data={'topic_id': pending['topic_id'], 'user_id': pending['user_id']},
+        name=name
+    )
+
+def schedule_one_time_check(job_queue, topic_id, user_id: int):
+    """תזמון בדיקה חד-פעמית לנושא - אם כבר ממתינה לו בדיקה, היא נדחית ולא נוספת שנייה"""
+    pending = pending_checks.schedule(topic_id, user_id, ONE_TIME_CHECK_DELAY_SECONDS)
+    start_one_time_check_timer(job_queue, pending)
+
+async def reload_pending_checks(application: Application):
+    """בעלייה - טיימרים מחדש לבדיקות שהמתינו לפני ההפעלה מחדש (בדיקות שזמנן עבר רצות מיד)"""
+    try:
+        pending = await asyncio.to_thread(pending_checks.list_pending)
+    except Exception as e:
+        logger.error(f"Error loading pending one-time checks: {e}")
+        return
+    for item in pending:
+        start_one_time_check_timer(application.job_queue, item)
+    if pending:
+        logger.info(f"Rescheduled {len(pending)} pending one-time checks")
+
 async def check_single_topic_job(context: ContextTypes.DEFAULT_TYPE):
-    """בדיקה חד-פעמית של נושא חדש שנוסף"""
-    job_data = context.job.data
-    topic_id = job_data['topic_id']
-    user_id = job_data['user_id']
-    
-    logger.info(f"Starting one-time check for topic ID: {topic_id}")
-    
-    # קבלת פרטי הנושא
-    topic = db.get_topic_by_id(topic_id)
-    if not topic:
-        logger.error(f"Topic {topic_id} not found for one-time check")
+    """
+    הפעלת בדיקה חד-פעמית ממתינה - רק אם היא עדיין שמורה וזמנה הגיע.
+    הבדיקה נתפסת (ונמחקת) לפני ההרצה, כך שגם כשכמה תהליכים טענו אותה רק אחד מריץ אותה
+    """
+    topic_id = context.job.data['topic_id']
+    
+    pending = pending_checks.claim(topic_id)
+    if pending is None:
+        later = pending_checks.get(topic_id)
+        if later is not None:
+            # הבדיקה נדחתה בינתיים - הטיימר החדש יריץ אותה
+            start_one_time_check_timer(context.job_queue, later)
+        else:
+            logger.info(f"One-time check for topic {topic_id} is no longer pending, skipping")
         return
     
     try:
-        logger.info(f"One-time checking topic: {topic['topic']} (ID: {topic_id})")
+        await run_one_time_check(context.bot, topic_id, pending['user_id'])
+    except Exception:
+        # הבדיקה לא רצה עד הסוף - נשמרת שוב ותרוץ אחרי ההפעלה מחדש הבאה
+        try:
+            pending_checks.restore(pending)
+        except Exception as e:
+            logger.error(f"Failed to restore pending one-time check for topic {topic_id}: {e}")
+        raise
+
+async def run_one_time_check(bot, topic_id, user_id: int):
+    """בדיקה חד-פעמית של נושא חדש שנוסף"""
+    with tracer.start_trace("one_time_check", topic_id=str(topic_id), user_id=user_id):
+        logger.info(f"Starting one-time check for topic ID: {topic_id}")
         
-        # בדיקת מגבלת שימוש לפני הבדיקה
-        usage_info = db.get_user_usage(user_id)
-        if usage_info['remaining'] <= 0:
-            logger.info(f"User {user_id} has reached monthly limit, skipping one-time check for topic {topic_id}")
-            
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"📊 הגעת למכסת {MONTHLY_LIMIT} הבדיקות החודשיות שלך.\n"
-                         f"הבדיקה החד-פעמית לנושא החדש לא בוצעה.\n\n"
-                         f"🔍 להצגת פרטי השימוש: /start ← 📊 שימוש נוכחי",
-                    reply_markup=get_main_menu_keyboard(user_id),
-                    **_LP_KW
-                )
-            except Exception as e:
-                logger.error(f"Failed to send limit notification to user {user_id}: {e}")
-            
+        # קבלת פרטי הנושא
+        topic = db.get_topic_by_id(topic_id)
+        if not topic:
+            logger.error(f"Topic {topic_id} not found for one-time check")
             return
         
-                    # חיפוש תוצאות עם Perplexity API
-        # Create topic object for the new run_topic_search function
-        class TopicObj:
-            def __init__(self, query, user_id, topic_id):
-                self.query = query
-                self.user_id = user_id
-                self.id = topic_id
-        
-        topic_obj = TopicObj(topic['topic'], user_id, topic_id)
-        results = run_topic_search(topic_obj)
-        
-        if results:
-            # עדכון זמן הבדיקה האחרונה
-            db.update_topic_checked(topic_id)
+        check = CheckUnitOfWork(topic)
+        try:
+            logger.info(f"One-time checking topic: {topic.topic} (ID: {topic_id})")
+            
+            # בדיקת מגבלת שימוש לפני הבדיקה
+            usage_info = db.get_user_usage(user_id)
+            if usage_info.remaining <= 0:
+                logger.info(f"User {user_id} has reached monthly limit, skipping one-time check for topic {topic_id}")
+                
+                try:
+                    await bot.send_message(
+                        chat_id=user_id,
+                        text=f"📊 הגעת למכסת {MONTHLY_LIMIT} הבדיקות החודשיות שלך.\n"
+                             f"הבדיקה החד-פעמית לנושא החדש לא בוצעה.\n\n"
+                             f"🔍 להצגת פרטי השימוש: /start ← 📊 שימוש נוכחי",
+                        reply_markup=get_main_menu_keyboard(user_id),
+                        **_LP_KW
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to send limit notification to user {user_id}: {e}")
+                
+                return
+            
+            # חיפוש תוצאות עם ספקי החיפוש
+            results = run_topic_search(topic, check=check)
             
             # שמירת התוצאות - עם בדיקת תקינות השדות
-            valid_results = []
             for result in results:
-                if isinstance(result, dict) and is_valid_result(result):
-                    try:
-                        db.save_result(topic_id, result['title'], result['url'], result.get('summary', ''))
-                        valid_results.append(result)
-                    except Exception as save_error:
-                        logger.warning(f"Failed to save result for topic {topic_id}: {save_error}")
-                        continue
+                if is_valid_result(result):
+                    check.add_result(result)
                 else:
                     logger.warning(f"Skipping invalid result for topic {topic_id}: missing required fields. Result: {result}")
-                    continue
             
-            # שליחת התוצאות למשתמש - רק תוצאות תקינות
-            if valid_results:
+            # חיוב, שמירת התוצאות ועדכון זמן הבדיקה (פעם אחת) - יחד
+            check.mark_checked()
+            new_results = check.commit()
+            if new_results is None:
+                return
+            
+            # שליחת התוצאות החדשות למשתמש
+            if new_results:
                 # שימוש בפונקציה המאוחדת לשליחת הודעה עברית אחת
-                await send_results_hebrew_only(context.bot, user_id, topic['topic'], valid_results)
-                logger.info(f"One-time check completed successfully for topic {topic_id}, found {len(valid_results)} valid results out of {len(results)} total results")
+                await send_results_hebrew_only(bot, user_id, topic.topic, new_results)
+                logger.info(f"One-time check completed successfully for topic {topic_id}, found {len(new_results)} new results out of {len(results)} total results")
             else:
-                # אם לא היו תוצאות תקינות, שלח הודעה על כך
-                await context.bot.send_message(
+                await bot.send_message(
                     chat_id=user_id,
-                    text=f"🔍 בדיקה חד-פעמית הושלמה עבור: {topic['topic']}\n\n"
+                    text=f"🔍 בדיקה חד-פעמית הושלמה עבור: {topic.topic}\n\n"
                          f"📭 לא נמצאו תוצאות חדשות כרגע\n"
                          f"🔄 הבדיקות הקבועות יתחילו בהתאם לתדירות שנבחרה",
                     **_LP_KW
                 )
-                logger.info(f"One-time check completed for topic {topic_id}, no valid results found (had {len(results)} invalid results)")
+                logger.info(f"One-time check completed for topic {topic_id}, no new results found (had {len(results)} results)")
+            
+        except Exception as e:
+            logger.error(f"Error in one-time topic check for topic {topic_id}: {e}")
+            check.abandon()
+            
+            # עדכון זמן הבדיקה גם במקרה של שגיאה כדי למנוע לולאת שגיאות (אם הבדיקה עוד לא נכתבה)
+            if not check.committed:
+                try:
+                    db.update_topic_checked(topic_id)
+                except Exception as db_error:
+                    logger.error(f"Failed to update topic check time after error for topic {topic_id}: {db_error}")
+            
+            try:
+                # נסה לקבל את שם הנושא בצורה בטוחה
+                topic_name = topic.topic if topic else 'נושא לא זמין'
+                
+                await bot.send_message(
+                    chat_id=user_id,
+                    text=f"❌ אירעה שגיאה בבדיקה החד-פעמית של הנושא: {topic_name}\n"
+                         f"הבדיקות הקבועות יפעלו כרגיל.",
+                    reply_markup=get_main_menu_keyboard(user_id),
+                    **_LP_KW
+                )
+            except Exception as send_error:
+                logger.error(f"Failed to send error notification to user {user_id}: {send_error}")
+
+# חידוש חכירת המנהיג
+async def renew_leader_lease_job(context: ContextTypes.DEFAULT_TYPE):
+    """לקיחה/חידוש של חכירת המתזמן - מופע שנפל מאבד אותה תוך LEADER_LEASE_TTL_SECONDS"""
+    leader_lease.try_acquire()
+
+async def release_leader_lease(application: Application):
+    """שחרור החכירה בכיבוי כדי שמופע אחר ימשיך מיד"""
+    leader_lease.release()
+
+# בדיקה של נושא בודד - משותפת למתזמן ולתהליכי ה-worker
+async def process_topic_check(bot, topic: Topic, results: List[SearchResult] = None, check_id: str = None):
+    """
+    חיפוש, שמירה ושליחת תוצאות עבור נושא אחד. חריגות עוברות למי שקרא לפונקציה.
+    results: תוצאות שכבר נמצאו בחיפוש מרוכז - במקרה כזה לא מחפשים שוב (החיוב נכתב כאן)
+    check_id: מזהה הבדיקה (למשל של עבודה בתור) - בדיקה שכבר נכתבה לא רצה שוב
+    """
+    check = CheckUnitOfWork(topic, check_id)
+    with tracer.start_trace("topic_check", topic_id=str(topic.id), user_id=topic.user_id,
+                            prefetched=results is not None, check_id=check.check_id):
+        logger.info(f"Checking topic: {topic.topic} (ID: {topic.id})")
+        
+        if check.already_applied():
+            logger.info("Check %s for topic %s was already applied, skipping", check.check_id, topic.id)
+            return
+        
+        if results is not None:
+            check.charge(PERPLEXITY_SEARCH_COST)
         else:
-            # אם לא נמצאו תוצאות כלל
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"🔍 בדיקה חד-פעמית הושלמה עבור: {topic['topic']}\n\n"
-                     f"📭 לא נמצאו תוצאות חדשות כרגע\n"
-                     f"🔄 הבדיקות הקבועות יתחילו בהתאם לתדירות שנבחרה",
-                **_LP_KW
-            )
-            logger.info(f"One-time check completed for topic {topic_id}, no new results found")
+            # בדיקת מגבלת שימוש לפני הבדיקה
+            usage_info = db.get_user_usage(topic.user_id)
+            if usage_info.remaining <= 0:
+                logger.info(f"User {topic.user_id} has reached monthly limit, skipping topic {topic.id}")
+                
+                # שליחת הודעה למשתמש שהגיע למגבלה (פעם אחת בחודש)
+                try:
+                    await bot.send_message(
+                        chat_id=topic.user_id,
+                        text=f"📊 הגעת למכסת {MONTHLY_LIMIT} הבדיקות החודשיות שלך.\n"
+                             f"המעקב יתחדש אוטומטיות בתחילת החודש הבא.\n\n"
+                             f"🔍 להצגת פרטי השימוש: /start ← 📊 שימוש נוכחי",
+                        reply_markup=get_main_menu_keyboard(topic.user_id),
+                        **_LP_KW
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to send limit notification to user {topic.user_id}: {e}")
+                
+                return
+            
+            # החיפוש חוסם (HTTP) - מריצים ב-thread כדי לא לעכב את שאר ה-handlers
+            try:
+                results = await asyncio.to_thread(run_topic_search, topic, check=check)
+            except Exception:
+                check.abandon()
+                raise
         
-        # עדכון זמן הבדיקה האחרונה תמיד
-        db.update_topic_checked(topic_id)
+        for result in (results or [])[:3]:  # מקסימום 3 תוצאות
+            # Use title as summary since we ignore English content
+            check.add_result(result, result.title or 'ללא סיכום')
         
-    except Exception as e:
-        logger.error(f"Error in one-time topic check for topic {topic_id}: {e}")
+        # בדיקה אם זו הבדיקה האחרונה לנושא עם מגבלת בדיקות
+        checks_remaining = topic.checks_remaining
+        is_last_check = checks_remaining is not None and checks_remaining == 1
         
-        # עדכון זמן הבדיקה גם במקרה של שגיאה כדי למנוע לולאת שגיאות
+        # חיוב, שמירת התוצאות ועדכון זמן הבדיקה - יחד
+        check.mark_checked()
         try:
-            db.update_topic_checked(topic_id)
-        except Exception as db_error:
-            logger.error(f"Failed to update topic check time after error for topic {topic_id}: {db_error}")
+            new_results = await asyncio.to_thread(check.commit)
+        except Exception:
+            check.abandon()
+            raise
+        if new_results is None:
+            return
         
-        try:
-            # נסה לקבל את שם הנושא בצורה בטוחה
-            topic_name = topic.get('topic', 'נושא לא זמין') if topic else 'נושא לא זמין'
-            
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"❌ אירעה שגיאה בבדיקה החד-פעמית של הנושא: {topic_name}\n"
-                     f"הבדיקות הקבועות יפעלו כרגיל.",
-                reply_markup=get_main_menu_keyboard(user_id),
-                **_LP_KW
-            )
-        except Exception as send_error:
-            logger.error(f"Failed to send error notification to user {user_id}: {send_error}")
+        if not results:
+            logger.info("No results found for topic %s", topic.id)
+        elif new_results:
+            # Send ONE consolidated Hebrew message for all new results
+            logger.info("Found %d results for topic %s", len(results), topic.id)
+            await send_results_hebrew_only(bot, topic.user_id, topic.topic, new_results)
+            logger.info("Sent %d new results for topic %s", len(new_results), topic.id)
+        else:
+            logger.info("No new results for topic %s (all were duplicates)", topic.id)
+        
+        # שליחת הודעה מיוחדת אם זו הבדיקה האחרונה
+        if is_last_check:
+            try:
+                await bot.send_message(
+                    chat_id=topic.user_id,
+                    text=f"✅ הושלמו 5 הבדיקות עבור הנושא: {topic.topic}\n\n"
+                         f"🔍 המעקב עבור נושא זה הסתיים\n"
+                         f"💡 תוכל להוסיף אותו שוב אם תרצה להמשיך במעקב",
+                    reply_markup=get_main_menu_keyboard(topic.user_id),
+                    **_LP_KW
+                )
+                logger.info(f"Sent completion notification for topic {topic.id}")
+            except Exception as e:
+                logger.error(f"Failed to send completion notification for topic {topic.id}: {e}")
+
+# ניקוי ודחיסת תוצאות ישנות
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    """דחיסת תוצאות ישנות ומחיקת תוצאות של נושאים לא פעילים (רק אצל המנהיג)"""
+    if not leader_lease.is_leader():
+        return
+    
+    try:
+        summary = await asyncio.to_thread(db.apply_retention, RESULT_RETENTION_DAYS)
+        logger.info(
+            "Retention finished: compacted=%d pruned=%d pruned_fingerprints=%d vacuumed_pages=%d",
+            summary['compacted'], summary['pruned'], summary['pruned_fingerprints'], summary['vacuumed_pages']
+        )
+    except Exception as e:
+        logger.error(f"Error applying results retention: {e}")
+
+# שמירת מסנני התוצאות שנראו לדיסק
+async def snapshot_seen_filters_job(context: ContextTypes.DEFAULT_TYPE):
+    """שמירת המסננים שהשתנו - כדי שאחרי הפעלה מחדש לא יהיה צורך לבנות אותם מבסיס הנתונים"""
+    saved = await asyncio.to_thread(seen_results.snapshot)
+    if saved:
+        logger.info(f"Saved {saved} seen-results filter snapshots")
+
+async def shutdown_cleanup(application: Application):
+    """ניקוי בכיבוי - שחרור החכירה, שמירת מסנני התוצאות וייצוא הבדיקות שבתור"""
+    await release_leader_lease(application)
+    seen_results.snapshot()
+    tracer.flush()
+
+def batched_search_available() -> bool:
+    """החיפוש המרוכז הולך ישר ל-Perplexity - רק כשהוא בין הספקים הזמינים בנתב החיפוש"""
+    return any(isinstance(provider, PerplexityProvider) for provider in search_router.ranked_providers())
+
+async def prefetch_batched_results(topics: List[Topic]) -> Dict:
+    """חיפוש מרוכז של נושאים שהגיע זמנם, בקבוצות של עד SEARCH_BATCH_SIZE לכל משתמש"""
+    topics_by_user = {}
+    for topic in topics:
+        topics_by_user.setdefault(topic.user_id, []).append(topic)
+    
+    prefetched = {}
+    for user_id, user_topics in topics_by_user.items():
+        # רק כמה שנשאר במכסה - השאר יגיעו להודעת המגבלה הרגילה
+        remaining = db.get_user_usage(user_id).remaining
+        user_topics = user_topics[:max(remaining, 0)]
+        for start in range(0, len(user_topics), SEARCH_BATCH_SIZE):
+            batch = user_topics[start:start + SEARCH_BATCH_SIZE]
+            if len(batch) < 2:
+                continue
+            with tracer.start_trace("batched_search", user_id=user_id, topics=len(batch)):
+                prefetched.update(await asyncio.to_thread(run_batched_topic_search, batch))
+    return prefetched
 
 # פונקציית המעקב האוטומטית
 async def check_topics_job(context: ContextTypes.DEFAULT_TYPE):
     """בדיקת נושאים אוטומטית"""
+    if not leader_lease.is_leader():
+        logger.info("Not the scheduler leader, skipping automatic topics check")
+        return
+    
     logger.info("Starting automatic topics check...")
     
     topics = db.get_active_topics_for_check()
     logger.info(f"Found {len(topics)} topics to check")
     
+    # במצב תור עבודה - רק מכניסים לתור, ותהליכי ה-worker מבצעים את הבדיקות
+    if WORK_QUEUE_ENABLED:
+        enqueued = sum(1 for topic in topics if work_queue.enqueue(topic.id, topic.user_id))
+        logger.info("Enqueued %d of %d due topics for workers", enqueued, len(topics))
+        return
+    
+    # חיפוש מרוכז לנושאים של אותו משתמש - נושאים שלא נענו נבדקים בנפרד
+    prefetched = {}
+    if SEARCH_BATCH_SIZE > 1 and not batched_search_available():
+        logger.info("Perplexity is not an available search provider, checking topics one by one through the router")
+    elif SEARCH_BATCH_SIZE > 1:
+        try:
+            prefetched = await prefetch_batched_results(topics)
+        except Exception as e:
+            logger.error(f"Batched search failed, checking topics one by one: {e}")
+    
     for topic in topics:
         try:
-            logger.info(f"Checking topic: {topic['topic']} (ID: {topic['id']})")
-            
-            # בדיקת מגבלת שימוש לפני הבדיקה
-            usage_info = db.get_user_usage(topic['user_id'])
-            if usage_info['remaining'] <= 0:
-                logger.info(f"User {topic['user_id']} has reached monthly limit, skipping topic {topic['id']}")
-                
-                # שליחת הודעה למשתמש שהגיע למגבלה (פעם אחת בחודש)
-                try:
-                    await context.bot.send_message(
-                        chat_id=topic['user_id'],
-                        text=f"📊 הגעת למכסת {MONTHLY_LIMIT} הבדיקות החודשיות שלך.\n"
-                             f"המעקב יתחדש אוטומטיות בתחילת החודש הבא.\n\n"
-                             f"🔍 להצגת פרטי השימוש: /start ← 📊 שימוש נוכחי",
-                        reply_markup=get_main_menu_keyboard(topic['user_id']),
-                        **_LP_KW
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to send limit notification to user {topic['user_id']}: {e}")
-                
-                continue
-            
-            # חיפוש תוצאות עם Perplexity API
-            # Create topic object for the new run_topic_search function
-            class TopicObj:
-                def __init__(self, query, user_id, topic_id):
-                    self.query = query
-                    self.user_id = user_id
-                    self.id = topic_id
-            
-            topic_obj = TopicObj(topic['topic'], topic['user_id'], topic['id'])
-            results = run_topic_search(topic_obj)
-            
-            if results:
-                logger.info("Found %d results for topic %d", len(results), topic['id'])
-                
-                # שמירת תוצאות חדשות ושליחה - Hebrew consolidated message
-                new_results = []
-                
-                for result in results[:3]:  # מקסימום 3 תוצאות
-                    result_id = db.save_result(
-                        topic['id'],
-                        result.get('title', 'ללא כותרת'),
-                        result.get('url', ''),
-                        result.get('title', 'ללא סיכום')  # Use title as summary since we ignore English content
-                    )
-                    
-                    if result_id:  # תוצאה חדשה
-                        new_results.append(result)
-                
-                # Send ONE consolidated Hebrew message for all new results
-                if new_results:
-                    await send_results_hebrew_only(context.bot, topic['user_id'], topic['topic'], new_results)
-                    logger.info("Sent %d new results for topic %d", len(new_results), topic['id'])
-                else:
-                    logger.info("No new results for topic %d (all were duplicates)", topic['id'])
-            else:
-                logger.info("No results found for topic %d", topic['id'])
-            
-            # בדיקה אם זו הבדיקה האחרונה לנושא עם מגבלת בדיקות
-            checks_remaining = topic.get('checks_remaining')
-            is_last_check = checks_remaining is not None and checks_remaining == 1
-            
-            # עדכון זמן הבדיקה
-            db.update_topic_checked(topic['id'])
-            
-            # שליחת הודעה מיוחדת אם זו הבדיקה האחרונה
-            if is_last_check:
-                try:
-                    await context.bot.send_message(
-                        chat_id=topic['user_id'],
-                        text=f"✅ הושלמו 5 הבדיקות עבור הנושא: {topic['topic']}\n\n"
-                             f"🔍 המעקב עבור נושא זה הסתיים\n"
-                             f"💡 תוכל להוסיף אותו שוב אם תרצה להמשיך במעקב",
-                        reply_markup=get_main_menu_keyboard(topic['user_id']),
-                        **_LP_KW
-                    )
-                    logger.info(f"Sent completion notification for topic {topic['id']}")
-                except Exception as e:
-                    logger.error(f"Failed to send completion notification for topic {topic['id']}: {e}")
+            await process_topic_check(context.bot, topic, prefetched.get(topic.id))
             
             # המתנה קצרה בין נושאים למניעת עומס על ה-API
-            await asyncio.sleep(2)
+            if topic.id not in prefetched and CHECK_TOPICS_DELAY_SECONDS > 0:
+                await asyncio.sleep(CHECK_TOPICS_DELAY_SECONDS)
             
+        except CircuitOpenError as e:
+            # החיפוש לא זמין - שאר הנושאים יבדקו בהרצה הבאה (זמן הבדיקה שלהם לא מתעדכן)
+            logger.warning("%s, postponing the remaining topics to the next run", e)
+            break
         except Exception as e:
-            logger.error("Error checking topic %d ('%s'): %s", topic['id'], topic.get('topic', 'unknown'), e)
+            logger.error("Error checking topic %s ('%s'): %s", topic.id, topic.topic, e)
             
             # עדכון זמן הבדיקה גם במקרה של שגיאה כדי למנוע לולאת שגיאות
             try:
-                db.update_topic_checked(topic['id'])
+                db.update_topic_checked(topic.id)
             except Exception as db_error:
-                logger.error("Failed to update topic check time after error for topic %d: %s", topic['id'], db_error)
+                logger.error("Failed to update topic check time after error for topic %s: %s", topic.id, db_error)
     
     logger.info("Finished checking %d topics", len(topics))
 
 # הפונקציה הזו הוסרה כי היא לא נחוצה ועלולה לגרום לשליחת הודעות כפולות
 # הבוט משתמש בפונקציה check_topics_job במקום
 
-# משתנים גלובליים לניהול מצבים
-user_states = {}
+# ניהול מצבי שיחה - עם תפוגה ומגבלת גודל, ואופציונלית שמור בבסיס הנתונים
+user_states = create_state_store(
+    STATE_STORE_BACKEND,
+    ttl_seconds=STATE_TTL_SECONDS,
+    max_entries=STATE_MAX_ENTRIES,
+    db_path=DB_PATH,
+    mongo_db=db.db if USE_MONGODB else None
+)
 
 # פונקציות callback
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2386,8 +3925,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🤖 תפריט ראשי - בוט המעקב החכם
 
 📊 **מגבלת השימוש החודשית:**
-🔍 השתמשת ב-{usage_info['current_usage']} מתוך {usage_info['monthly_limit']} בדיקות
-⏳ נותרו לך {usage_info['remaining']} בדיקות החודש
+🔍 השתמשת ב-{usage_info.current_usage} מתוך {usage_info.monthly_limit} בדיקות
+⏳ נותרו לך {usage_info.remaining} בדיקות החודש
 
 📞 לכל תקלה או ביקורת ניתן לפנות ל-@moominAmir בטלגרם
 
@@ -2471,12 +4010,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 frequency = int(data.split("_")[1])
                 checks_remaining = None
                 
-            if user_id in user_states and "pending_topic" in user_states[user_id]:
-                topic = user_states[user_id]["pending_topic"]
+            state = user_states.get(user_id) or {}
+            if "pending_topic" in state:
+                topic = state["pending_topic"]
                 
                 # בדיקת מגבלת שימוש
                 usage_info = db.get_user_usage(user_id)
-                if usage_info['remaining'] <= 0:
+                if usage_info.remaining <= 0:
                     await query.edit_message_text(
                         f"❌ הגעת למכסת {MONTHLY_LIMIT} הבדיקות החודשיות שלך.\nתוכל להמשיך בתחילת החודש הבא.",
                         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 חזרה לתפריט", callback_data="main_menu")]])
@@ -2486,12 +4026,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 topic_id = db.add_watch_topic(user_id, topic, frequency, checks_remaining)
                 
                 # תזמון בדיקה חד-פעמית דקה לאחר הוספת הנושא
-                context.application.job_queue.run_once(
-                    check_single_topic_job,
-                    when=timedelta(minutes=1),
-                    data={'topic_id': topic_id, 'user_id': user_id},
-                    name=f"one_time_check_{topic_id}"
-                )
+                schedule_one_time_check(context.application.job_queue, topic_id, user_id)
                 
                 if frequency == 0.0833:
                     freq_text = "כל 5 דקות (5 פעמים בלבד)"
@@ -2515,7 +4050,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 
                 # ניקוי מצב המשתמש
-                del user_states[user_id]
+                user_states.pop(user_id, None)
         
         elif data.startswith("delete_topic_"):
             # מחיקת נושא
@@ -2545,12 +4080,12 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             # קבלת פרטי הנושא הנוכחי
             topics = db.get_user_topics(user_id)
-            topic = next((t for t in topics if str(t['id']) == str(topic_id)), None)
+            topic = next((t for t in topics if str(t.id) == str(topic_id)), None)
             
             if topic:
                 await query.edit_message_text(
                     f"✏️ עריכת טקסט הנושא\n\n"
-                    f"הטקסט הנוכחי: {topic['topic']}\n\n"
+                    f"הטקסט הנוכחי: {topic.topic}\n\n"
                     f"אנא שלחו את הטקסט החדש:",
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ ביטול", callback_data="main_menu")]])
                 )
@@ -2574,13 +4109,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # עדכון התדירות בבסיס הנתונים
             success = db.update_topic_frequency(user_id, topic_id, new_frequency)
             
-            freq_text = {
-                6: "כל 6 שעות",
-                12: "כל 12 שעות", 
-                24: "כל 24 שעות",
-                48: "כל 48 שעות",
-                168: "אחת לשבוע"
-            }.get(new_frequency, f"כל {new_frequency} שעות")
+            freq_text = frequency_label(new_frequency)
             
             if success:
                 await query.edit_message_text(
@@ -2816,7 +4345,7 @@ async def show_edit_topic_menu(query, user_id, topic_id):
     """הצגת תפריט עריכת נושא"""
     # קבלת פרטי הנושא
     topics = db.get_user_topics(user_id)
-    topic = next((t for t in topics if str(t['id']) == str(topic_id)), None)
+    topic = next((t for t in topics if str(t.id) == str(topic_id)), None)
     
     if not topic:
         await query.edit_message_text(
@@ -2826,17 +4355,11 @@ async def show_edit_topic_menu(query, user_id, topic_id):
         return
     
     # הצגת פרטי הנושא הנוכחיים
-    freq_text = {
-        6: "כל 6 שעות",
-        12: "כל 12 שעות", 
-        24: "כל 24 שעות",
-        48: "כל 48 שעות",
-        168: "אחת לשבוע"
-    }.get(topic['check_interval'], f"כל {topic['check_interval']} שעות")
+    freq_text = frequency_label(topic.check_interval)
     
     message = f"""✏️ עריכת נושא מעקב
 
-📝 נושא נוכחי: {topic['topic']}
+📝 נושא נוכחי: {topic.topic}
 ⏰ תדירות נוכחית: {freq_text}
 
 מה תרצו לערוך?"""
@@ -2852,51 +4375,7 @@ async def show_edit_topic_menu(query, user_id, topic_id):
 
 async def show_topics_list(query, user_id):
     """הצגת רשימת נושאים"""
-    topics = db.get_user_topics(user_id)
-    
-    if not topics:
-        message = "📭 אין לכם נושאים במעקב כרגע.\nהשתמשו בכפתור 'הוסף נושא חדש' כדי להתחיל."
-        await query.edit_message_text(message, reply_markup=get_main_menu_keyboard(user_id))
-        return
-    
-    message = "📋 הנושאים שלכם במעקב:\n\n"
-    keyboard = []
-    
-    for i, topic in enumerate(topics, 1):
-        status = "🟢"
-        last_check = topic['last_checked'] or "מעולם לא"
-        if last_check != "מעולם לא":
-            try:
-                last_check = datetime.fromisoformat(last_check).strftime("%d/%m %H:%M")
-            except:
-                pass
-        
-        if topic['check_interval'] == 0.0833:
-            freq_text = f"כל 5 דקות ({topic.get('checks_remaining', 0)} נותרו)" if topic.get('checks_remaining') else "כל 5 דקות (הושלם)"
-        else:
-            freq_text = {
-                6: "כל 6 שעות",
-                12: "כל 12 שעות", 
-                24: "כל 24 שעות",
-                48: "כל 48 שעות",
-                168: "אחת לשבוע"
-            }.get(topic['check_interval'], f"כל {topic['check_interval']} שעות")
-        
-        message += f"{i}. {status} {topic['topic']}\n"
-        message += f"   🆔 {topic['id']} | ⏰ {freq_text}\n"
-        message += f"   🕐 נבדק: {last_check}\n\n"
-        
-        # הוספת כפתורי עריכה ומחיקה לכל נושא
-        topic_name_short = topic['topic'][:15] + ('...' if len(topic['topic']) > 15 else '')
-        keyboard.append([
-            InlineKeyboardButton(f"✏️ ערוך '{topic_name_short}'", callback_data=f"edit_topic_{topic['id']}"),
-            InlineKeyboardButton(f"🗑️ מחק '{topic_name_short}'", callback_data=f"delete_topic_{topic['id']}")
-        ])
-    
-    # הוספת כפתור חזרה לתפריט
-    keyboard.append([InlineKeyboardButton("🔙 חזרה לתפריט", callback_data="main_menu")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+    message, reply_markup = render_topics_list(user_id)
     await query.edit_message_text(message, reply_markup=reply_markup)
 
 async def show_usage_stats(query, user_id):
@@ -2904,7 +4383,7 @@ async def show_usage_stats(query, user_id):
     usage_info = db.get_user_usage(user_id)
     current_month = datetime.now().strftime("%B %Y")
     
-    percentage = (usage_info['current_usage'] / usage_info['monthly_limit']) * 100
+    percentage = (usage_info.current_usage / usage_info.monthly_limit) * 100
     
     # יצירת בר התקדמות
     filled_blocks = int(percentage / 10)
@@ -2918,8 +4397,8 @@ async def show_usage_stats(query, user_id):
 🔍 **שאילתות Perplexity:**
 {progress_bar} {percentage:.1f}%
 
-📈 השתמשת: {usage_info['current_usage']} / {usage_info['monthly_limit']}
-⏳ נותרו: {usage_info['remaining']} בדיקות
+📈 השתמשת: {usage_info.current_usage} / {usage_info.monthly_limit}
+⏳ נותרו: {usage_info.remaining} בדיקות
 
 💡 **טיפ:** כל בדיקה (אוטומטית או ידנית) נחשבת כשאילתה אחת.
 """
@@ -2971,8 +4450,10 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = update.effective_user.id
     text = update.message.text
     
+    state = user_states.get(user_id) or {}
+    
     # בדיקה אם המשתמש במצב המתנה להוספת נושא
-    if user_id in user_states and user_states[user_id].get("state") == "waiting_for_topic":
+    if state.get("state") == "waiting_for_topic":
         # שמירת הנושא ובקשה לבחירת תדירות
         user_states[user_id] = {"pending_topic": text}
         
@@ -2983,8 +4464,8 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     # בדיקה אם המשתמש במצב עריכת טקסט נושא
-    if user_id in user_states and user_states[user_id].get("action") == "edit_topic_text":
-        topic_id = user_states[user_id].get("topic_id")
+    if state.get("action") == "edit_topic_text":
+        topic_id = state.get("topic_id")
         
         # עדכון הטקסט בבסיס הנתונים
         success = db.update_topic_text(user_id, topic_id, text)
@@ -3004,7 +4485,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
         
         # ניקוי מצב המשתמש
-        del user_states[user_id]
+        user_states.pop(user_id, None)
         return
     
     # אם אין מצב מיוחד, הצגת התפריט הראשי
@@ -3013,17 +4494,10 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         reply_markup=get_main_menu_keyboard(user_id)
     )
 
-def main():
-    """פונקציה ראשית"""
-    # הפעלת שרת Flask ברקע
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    logger.info(f"Flask server started on port {PORT}")
-    
-    # יצירת אפליקציית הבוט
-    application = Application.builder().token(BOT_TOKEN).build()
+def register_handlers(application: Application):
+    """רישום ה-handlers של הבוט - משותף להפעלה הרגילה ולבדיקות העומס"""
+    from telegram.ext import CommandHandler, CallbackQueryHandler, MessageHandler, filters
     
-    # הוספת handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("watch", watch_command))
     application.add_handler(CommandHandler("list", list_command))
@@ -3032,15 +4506,43 @@ def main():
     application.add_handler(CommandHandler("resume", resume_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("storage", storage_command))
     application.add_handler(CommandHandler("test_search", test_search_command))
     application.add_handler(CommandHandler("recent_users", recent_users_command))
     application.add_handler(CommandHandler("whoami", whoami_command))
     application.add_handler(CallbackQueryHandler(button_callback))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+
+def main():
+    """פונקציה ראשית"""
+    # הפעלת שרת Flask ברקע
+    flask_thread = threading.Thread(target=run_flask, daemon=True)
+    flask_thread.start()
+    logger.info(f"Flask server started on port {PORT}")
+    
+    # יצירת אפליקציית הבוט
+    from telegram.ext import Application
+    
+    application = (
+        Application.builder().token(BOT_TOKEN)
+        .post_init(reload_pending_checks)
+        .post_shutdown(shutdown_cleanup)
+        .build()
+    )
+    
+    # הוספת handlers
+    register_handlers(application)
     
     # הוספת מתזמן למשימות אוטומטיות
     job_queue = application.job_queue
     
+    # חידוש חכירת המנהיג - רק המחזיק בה מריץ את check_topics_job
+    job_queue.run_repeating(
+        renew_leader_lease_job,
+        interval=timedelta(seconds=LEADER_LEASE_RENEW_SECONDS),
+        first=0
+    )
+    
     # הפעלת בדיקה אוטומטית כל 24 שעות
     job_queue.run_repeating(
         check_topics_job,
@@ -3055,11 +4557,88 @@ def main():
         first=timedelta(minutes=2)  # בדיקה ראשונה אחרי 2 דקות
     )
     
+    # ניקוי ודחיסת תוצאות ישנות פעם ביום
+    job_queue.run_repeating(
+        retention_job,
+        interval=timedelta(hours=24),
+        first=timedelta(minutes=10)
+    )
+    
+    # שמירת מסנני התוצאות שנראו לדיסק
+    job_queue.run_repeating(
+        snapshot_seen_filters_job,
+        interval=timedelta(minutes=SEEN_FILTER_SNAPSHOT_MINUTES),
+        first=timedelta(minutes=SEEN_FILTER_SNAPSHOT_MINUTES)
+    )
+    
     logger.info("Starting bot with polling...")
     
     # הפעלת הבוט
     application.run_polling(drop_pending_updates=True)
 
+async def worker_loop():
+    """לולאת worker - לוקחת בדיקות מהתור, מבצעת ומאשרת"""
+    from telegram import Bot
+    
+    worker_id = make_holder_id()
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        # סיום מסודר אחרי הבדיקה הנוכחית
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    logger.info(f"Worker {worker_id} started")
+    
+    next_snapshot = time.monotonic() + SEEN_FILTER_SNAPSHOT_MINUTES * 60
+    async with Bot(BOT_TOKEN) as bot:
+        while not stop_event.is_set():
+            if time.monotonic() >= next_snapshot:
+                await asyncio.to_thread(seen_results.snapshot)
+                next_snapshot = time.monotonic() + SEEN_FILTER_SNAPSHOT_MINUTES * 60
+            
+            job = work_queue.claim(worker_id, WORK_QUEUE_VISIBILITY_SECONDS)
+            if not job:
+                try:
+                    await asyncio.wait_for(stop_event.wait(), timeout=WORKER_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            topic = db.get_topic_by_id(job['topic_id'])
+            if not topic or not topic.is_active:
+                logger.info(f"Topic {job['topic_id']} no longer active, dropping queued check")
+                work_queue.ack(job, worker_id)
+                continue
+            
+            try:
+                # מזהה העבודה - ניסיון חוזר של עבודה שכבר נכתבה לא מחפש ולא שומר שוב
+                await process_topic_check(bot, topic, check_id=f"job:{job['id']}")
+                work_queue.ack(job, worker_id)
+            except CircuitOpenError as e:
+                # החיפוש לא זמין - חוזרים לתור אחרי זמן ההתאוששות של המפסק
+                logger.warning("%s, returning topic %s to the queue", e, topic.id)
+                work_queue.release(job, worker_id, error=str(e), delay=SEARCH_BREAKER_RECOVERY_SECONDS)
+            except Exception as e:
+                logger.error("Worker failed checking topic %s (attempt %d): %s", topic.id, job['attempts'], e)
+                if job['attempts'] >= WORK_QUEUE_MAX_ATTEMPTS:
+                    # ניסיון אחרון - עדכון זמן הבדיקה כדי למנוע לולאת שגיאות
+                    try:
+                        db.update_topic_checked(topic.id)
+                    except Exception as db_error:
+                        logger.error("Failed to update topic check time after error for topic %s: %s", topic.id, db_error)
+                    work_queue.ack(job, worker_id)
+                else:
+                    # חזרה לתור עם המתנה הולכת וגדלה
+                    work_queue.release(job, worker_id, error=str(e), delay=30 * 2 ** (job['attempts'] - 1))
+    
+    seen_results.snapshot()
+    tracer.flush()
+    logger.info(f"Worker {worker_id} stopped")
+
+def run_worker():
+    """הרצת תהליך worker לבדיקות נושאים מתור העבודה"""
+    asyncio.run(worker_loop())
+
 def run_smoke_test():
     """Run smoke test for Perplexity integration."""
     try:
@@ -3087,5 +4666,7 @@ if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "--test":
         success = run_smoke_test()
         sys.exit(0 if success else 1)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        run_worker()
     else:
         main()
@@ -0,0 +1,167 @@
+"""
+בדיקות חד-פעמיות ממתינות (אחרי הוספת נושא) - נשמרות בבסיס הנתונים הפעיל כדי לשרוד הפעלה מחדש.
+לכל נושא יש לכל היותר בדיקה ממתינה אחת: תזמון נוסף לאותו נושא רק דוחה אותה (debounce),
+והטיימרים בזיכרון של הבוט נבנים מחדש מהרשימה השמורה בעלייה.
+"""
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# טיימר שהופעל מעט לפני זמן היעד עדיין תופס את הבדיקה
+_EARLY_FIRE_SECONDS = 1
+
+
+class SQLitePendingChecks:
+    """בדיקות ממתינות בטבלת SQLite"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS pending_checks (
+                topic_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                due_at REAL NOT NULL,
+                scheduled_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def schedule(self, topic_id, user_id: int, delay_seconds: float) -> dict:
+        """תזמון בדיקה לנושא בעוד delay_seconds - בדיקה שכבר ממתינה לנושא נדחית לזמן החדש"""
+        now = time.time()
+        due_at = now + delay_seconds
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            INSERT INTO pending_checks (topic_id, user_id, due_at, scheduled_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(topic_id) DO UPDATE SET
+                user_id = excluded.user_id, due_at = excluded.due_at, scheduled_at = excluded.scheduled_at
+        ''', (topic_id, user_id, due_at, now))
+        conn.commit()
+        conn.close()
+        return {'topic_id': topic_id, 'user_id': user_id, 'due_at': due_at}
+
+    def get(self, topic_id) -> dict:
+        """הבדיקה הממתינה של נושא, או None"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id, due_at FROM pending_checks WHERE topic_id = ?', (topic_id,))
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        return {'topic_id': topic_id, 'user_id': row[0], 'due_at': row[1]}
+
+    def claim(self, topic_id) -> dict:
+        """
+        תפיסת הבדיקה הממתינה של נושא אם זמנה הגיע - היא נמחקת באותה פקודה, כך שרק תהליך אחד מריץ אותה.
+        מחזיר None אם אין בדיקה ממתינה או שהיא נדחתה לזמן מאוחר יותר
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(
+            'DELETE FROM pending_checks WHERE topic_id = ? AND due_at <= ? RETURNING user_id, due_at',
+            (topic_id, time.time() + _EARLY_FIRE_SECONDS)
+        )
+        row = cursor.fetchone()
+        conn.commit()
+        conn.close()
+        if not row:
+            return None
+        return {'topic_id': topic_id, 'user_id': row[0], 'due_at': row[1]}
+
+    def restore(self, pending: dict):
+        """החזרת בדיקה שנתפסה ונכשלה - אלא אם בינתיים תוזמנה לנושא בדיקה חדשה"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            INSERT INTO pending_checks (topic_id, user_id, due_at, scheduled_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(topic_id) DO NOTHING
+        ''', (pending['topic_id'], pending['user_id'], pending['due_at'], time.time()))
+        conn.commit()
+        conn.close()
+
+    def list_pending(self) -> list:
+        """כל הבדיקות הממתינות - לבניית הטיימרים מחדש בעלייה"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT topic_id, user_id, due_at FROM pending_checks')
+        rows = cursor.fetchall()
+        conn.close()
+        return [{'topic_id': topic_id, 'user_id': user_id, 'due_at': due_at} for topic_id, user_id, due_at in rows]
+
+
+class MongoPendingChecks:
+    """בדיקות ממתינות בקולקשן MongoDB (מזהה המסמך הוא מזהה הנושא)"""
+
+    def __init__(self, database):
+        self.collection = database.pending_checks
+
+    @staticmethod
+    def _to_epoch(value: datetime) -> float:
+        return (value - datetime(1970, 1, 1)).total_seconds()
+
+    @staticmethod
+    def _from_epoch(value: float) -> datetime:
+        return datetime(1970, 1, 1) + timedelta(seconds=value)
+
+    def _to_dict(self, doc: dict) -> dict:
+        return {'topic_id': doc["_id"], 'user_id': doc["user_id"], 'due_at': self._to_epoch(doc["due_at"])}
+
+    def schedule(self, topic_id, user_id: int, delay_seconds: float) -> dict:
+        """תזמון בדיקה לנושא בעוד delay_seconds - בדיקה שכבר ממתינה לנושא נדחית לזמן החדש"""
+        now = datetime.utcnow()
+        # מעגלים למילישניות כמו שמונגו שומר - כדי שזמן היעד שמוחזר יתאים לשמור
+        due_at = now + timedelta(seconds=delay_seconds)
+        due_at = due_at.replace(microsecond=due_at.microsecond // 1000 * 1000)
+        self.collection.update_one(
+            {"_id": topic_id},
+            {"$set": {"user_id": user_id, "due_at": due_at, "scheduled_at": now}},
+            upsert=True
+        )
+        return {'topic_id': topic_id, 'user_id': user_id, 'due_at': self._to_epoch(due_at)}
+
+    def get(self, topic_id) -> dict:
+        """הבדיקה הממתינה של נושא, או None"""
+        doc = self.collection.find_one({"_id": topic_id})
+        return self._to_dict(doc) if doc else None
+
+    def claim(self, topic_id) -> dict:
+        """
+        תפיסת הבדיקה הממתינה של נושא אם זמנה הגיע - היא נמחקת באותה פקודה, כך שרק תהליך אחד מריץ אותה.
+        מחזיר None אם אין בדיקה ממתינה או שהיא נדחתה לזמן מאוחר יותר
+        """
+        doc = self.collection.find_one_and_delete({
+            "_id": topic_id,
+            "due_at": {"$lte": datetime.utcnow() + timedelta(seconds=_EARLY_FIRE_SECONDS)}
+        })
+        return self._to_dict(doc) if doc else None
+
+    def restore(self, pending: dict):
+        """החזרת בדיקה שנתפסה ונכשלה - אלא אם בינתיים תוזמנה לנושא בדיקה חדשה"""
+        self.collection.update_one(
+            {"_id": pending['topic_id']},
+            {"$setOnInsert": {
+                "user_id": pending['user_id'],
+                "due_at": self._from_epoch(pending['due_at']),
+                "scheduled_at": datetime.utcnow()
+            }},
+            upsert=True
+        )
+
+    def list_pending(self) -> list:
+        """כל הבדיקות הממתינות - לבניית הטיימרים מחדש בעלייה"""
+        return [self._to_dict(doc) for doc in self.collection.find({})]
+
+
+def create_pending_checks(db_path: str = None, mongo_db=None):
+    """יצירת מאגר הבדיקות הממתינות על בסיס הנתונים הפעיל"""
+    if mongo_db is not None:
+        return MongoPendingChecks(mongo_db)
+    return SQLitePendingChecks(db_path)
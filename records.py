@@ -0,0 +1,37 @@
+"""
+רשומות קומפקטיות (dataclass עם __slots__) לנושאים, לתוצאות חיפוש ולנתוני שימוש.
+שני בסיסי הנתונים מחזירים אותן, וכל שלבי הבדיקה עובדים איתן במקום מילונים.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Union
+
+
+@dataclass(slots=True)
+class Topic:
+    """נושא במעקב. last_checked נשמר כמו שבסיס הנתונים מחזיר אותו (מחרוזת ISO ב-SQLite, datetime במונגו)"""
+    id: Union[int, str]
+    user_id: int
+    topic: str
+    check_interval: float = 24
+    is_active: bool = True
+    created_at: Union[str, datetime, None] = None
+    last_checked: Union[str, datetime, None] = None
+    checks_remaining: Optional[int] = None
+
+
+@dataclass(slots=True)
+class SearchResult:
+    """תוצאת חיפוש שעברה את בדיקות הקישור והרלוונטיות"""
+    title: str
+    url: str
+    summary: str = ''
+    relevance_score: float = 0.0
+
+
+@dataclass(slots=True)
+class UsageInfo:
+    """שימוש חודשי של משתמש מול המכסה"""
+    current_usage: int
+    monthly_limit: int
+    remaining: int
@@ -0,0 +1,54 @@
+"""
+היסטוריית הצורך בחיפוש מעודן - לפי נושא ולפי סוג שאילתה.
+משמשת להחלטה אם להריץ את החיפוש המעודן במקביל לחיפוש הראשי (ספקולטיבית)
+במקום לחכות שהחיפוש הראשי יסתיים עם מעט מדי תוצאות.
+"""
+import logging
+import threading
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class RefinementHistory:
+    """ממוצע נע של "האם היה צורך בחיפוש מעודן" לכל מפתח (נושא / סוג שאילתה)"""
+
+    def __init__(self, threshold: float = 0.5, min_samples: int = 3,
+                 alpha: float = 0.3, max_keys: int = 5000, ttl: float = 7 * 24 * 3600):
+        """
+        threshold: מעל איזה שיעור מריצים את החיפוש המעודן מראש
+        min_samples: כמה חיפושים צריך לפני שסומכים על ההיסטוריה של מפתח
+        alpha: משקל החיפוש האחרון בממוצע הנע
+        """
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self._rates = TTLCache(maxsize=max_keys, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def record(self, keys, needed: bool):
+        """עדכון ההיסטוריה אחרי חיפוש - needed: האם החיפוש הראשי החזיר מעט מדי תוצאות"""
+        sample = 1.0 if needed else 0.0
+        with self._lock:
+            for key in keys:
+                if key is None:
+                    continue
+                rate, samples = self._rates.get(key, (sample, 0))
+                rate = sample if samples == 0 else rate + self.alpha * (sample - rate)
+                self._rates.set(key, (rate, samples + 1))
+
+    def rate(self, key):
+        """שיעור הצורך בחיפוש מעודן, או None אם אין מספיק היסטוריה"""
+        rate, samples = self._rates.get(key, (0.0, 0))
+        return rate if samples >= self.min_samples else None
+
+    def should_prefetch(self, keys) -> bool:
+        """האם להריץ את החיפוש המעודן מראש - המפתח הספציפי ביותר שיש לו היסטוריה קובע"""
+        for key in keys:
+            if key is None:
+                continue
+            rate = self.rate(key)
+            if rate is not None:
+                return rate >= self.threshold
+        return False
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end benchmark: runs check_topics_job and check_single_topic_job
+over a synthetic workload without network access or API keys.
+
+- a local OpenAI-compatible stub serves recorded sonar-pro answers
+  (scripts/fixtures/sonar_pro_responses.json), streamed or blocking
+- a local site server answers the URL probes of validate_url
+- a fake Telegram bot records the messages instead of sending them
+
+Reports throughput, per-stage latency and peak memory. With --baseline the run
+fails when throughput or a stage's p95 latency regresses past --max-regression.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import itertools
+import resource
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import from main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "sonar_pro_responses.json")
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+logger = logging.getLogger(__name__)
+
+_PRIMARY_QUERY_RE = re.compile(r"הנושא הספציפי הזה: (.*?)\. חשוב מאוד")
+_REFINED_QUERY_RE = re.compile(r'מצא מידע נוסף על: "(.*?)"')
+_BATCH_LINE_RE = re.compile(r"^(\S+): (.+?)(?: חפש רק תוכן| אל תחזיר|$)")
+
+
+class StubState:
+    """הגדרות ומונים משותפים לשרתים המקומיים"""
+
+    def __init__(self, fixtures: dict, api_latency: float, site_latency: float):
+        self.api_latency = api_latency
+        self.site_latency = site_latency
+        self.site_url = None
+        self.requests = 0
+        self.probes = 0
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        # בחירה דטרמיניסטית לפי המשקלים - כדי שהרצות יהיו ברות השוואה
+        self._cycles = {
+            kind: itertools.cycle([entry for entry in entries for _ in range(entry.get("weight", 1))])
+            for kind, entries in fixtures.items() if not kind.startswith("_")
+        }
+
+    def next_answer(self, kind: str, query: str) -> str:
+        with self._lock:
+            n = next(self._counter)
+            entry = next(self._cycles[kind])
+        return (entry["content"]
+                .replace("{site}", self.site_url)
+                .replace("{query}", json.dumps(query, ensure_ascii=False)[1:-1])
+                .replace("{n}", str(n)))
+
+
+def make_api_handler(state: StubState):
+    class ChatCompletionsHandler(BaseHTTPRequestHandler):
+        """שרת תואם OpenAI - POST /chat/completions"""
+
+        def log_message(self, *args):
+            pass
+
+        def _answer(self, user_content: str) -> str:
+            if "על כל אחד מהנושאים הבאים" in user_content:
+                answer = {}
+                for line in user_content.splitlines()[1:]:
+                    match = _BATCH_LINE_RE.match(line)
+                    if match:
+                        text = state.next_answer("primary", match.group(2))
+                        try:
+                            items = json.loads(text[text.index("["):text.rindex("]") + 1])
+                        except ValueError:
+                            items = []  # תשובת markdown - בלי תוצאות לנושא הזה
+                        answer[match.group(1)] = items
+                return json.dumps(answer, ensure_ascii=False)
+            refined = _REFINED_QUERY_RE.search(user_content)
+            if refined:
+                return state.next_answer("refined", refined.group(1))
+            primary = _PRIMARY_QUERY_RE.search(user_content)
+            return state.next_answer("primary", primary.group(1) if primary else user_content[:50])
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with state._lock:
+                state.requests += 1
+            content = self._answer(body["messages"][-1]["content"])
+            base = {"id": "bench", "created": int(time.time()), "model": body.get("model", "sonar-pro")}
+
+            if not body.get("stream"):
+                time.sleep(state.api_latency)
+                payload = json.dumps({
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            # streaming - זמן התגובה מתחלק בין החלקים, כמו מודל שכותב בהדרגה
+            pieces = [content[i:i + 40] for i in range(0, len(content), 40)] or [""]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            try:
+                for piece in pieces:
+                    time.sleep(state.api_latency / len(pieces))
+                    chunk = {**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # הלקוח סגר את ה-stream (למשל חיפוש ספקולטיבי שבוטל)
+
+    return ChatCompletionsHandler
+
+
+def make_site_handler(state: StubState):
+    class SiteHandler(BaseHTTPRequestHandler):
+        """אתר מקומי לבדיקות הקישורים - /gone/... מחזיר 404, כל השאר 200"""
+
+        def log_message(self, *args):
+            pass
+
+        def _respond(self, with_body: bool):
+            with state._lock:
+                state.probes += 1
+            time.sleep(state.site_latency)
+            status = 404 if self.path.startswith("/gone/") else 200
+            body = b"<html><body>benchmark page</body></html>"
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if with_body:
+                self.wfile.write(body)
+
+        def do_HEAD(self):
+            self._respond(False)
+
+        def do_GET(self):
+            self._respond(True)
+
+    return SiteHandler
+
+
+def start_server(handler) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeBot:
+    """בוט טלגרם מזויף - שומר את ההודעות במקום לשלוח"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id=None, text=None, **kwargs):
+        self.messages.append((chat_id, text))
+        return SimpleNamespace(message_id=len(self.messages), chat_id=chat_id, text=text)
+
+
+class StageTimer:
+    """מדידת זמנים לפי שלב - עוטף פונקציות קיימות בלי לשנות את ההתנהגות שלהן"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, stage: str, seconds: float):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage: str, func):
+        timer = self
+        if asyncio.iscoroutinefunction(func):
+            async def timed_async(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    timer.record(stage, time.perf_counter() - started)
+            return timed_async
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer.record(stage, time.perf_counter() - started)
+        return timed
+
+    def summary(self) -> dict:
+        summary = {}
+        for stage, values in sorted(self.samples.items()):
+            ordered = sorted(values)
+            summary[stage] = {
+                "count": len(ordered),
+                "mean_ms": sum(ordered) / len(ordered) * 1000,
+                "p50_ms": ordered[len(ordered) // 2] * 1000,
+                "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            }
+        return summary
+
+
+def instrument(main, timer: StageTimer, bot: FakeBot):
+    """עטיפת השלבים המעניינים במדידת זמן"""
+    main.process_topic_check = timer.wrap("topic_check", main.process_topic_check)
+    main.search_router.search = timer.wrap("search", main.search_router.search)
+    main.request_search_results = timer.wrap("api_request", main.request_search_results)
+    main.validate_url = timer.wrap("validate_url", main.validate_url)
+    main.db.commit_check = timer.wrap("commit_check", main.db.commit_check)
+    bot.send_message = timer.wrap("send_message", bot.send_message)
+
+
+SUBJECTS = [
+    "python release", "rust compiler", "kubernetes security", "iphone update", "tesla recall",
+    "openai models", "linux kernel", "postgres performance", "android beta", "chrome extensions",
+]
+
+
+async def run_workload(main, args, bot: FakeBot, timer: StageTimer) -> dict:
+    db = main.db
+    topic_count = 0
+    for user_index in range(args.users):
+        user_id = 100000 + user_index
+        db.add_user(user_id, f"bench_user_{user_index}")
+        for topic_index in range(args.topics_per_user):
+            subject = SUBJECTS[(user_index + topic_index) % len(SUBJECTS)]
+            db.add_watch_topic(user_id, f"{subject} {user_index}-{topic_index}")
+            topic_count += 1
+
+    if not main.leader_lease.try_acquire():
+        raise RuntimeError("benchmark could not take the scheduler lease")
+
+    context = SimpleNamespace(bot=bot, job=None)
+    started = time.perf_counter()
+    for round_index in range(args.rounds):
+        if round_index:
+            # כל הנושאים שוב בזמן בדיקה (בסיס הנתונים הוא זמני של הבנצ'מרק)
+            conn = main.sqlite3.connect(db.db_path)
+            conn.execute("UPDATE watch_topics SET last_checked = NULL")
+            # אותו last_checked = אותו מזהה בדיקה - בלי זה הסבב הבא נראה כמו בדיקה חוזרת
+            conn.execute("DELETE FROM completed_checks")
+            conn.commit()
+            conn.close()
+        await timer.wrap("check_topics_job", main.check_topics_job)(context)
+    scheduled_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for index in range(args.single_checks):
+        user_id = 100000 + index % max(args.users, 1)
+        topic_id = db.add_watch_topic(user_id, f"{SUBJECTS[index % len(SUBJECTS)]} one-time {index}")
+        # הבדיקה החד-פעמית רצה רק אם היא שמורה כממתינה - מתזמנים אותה לעכשיו
+        main.pending_checks.schedule(topic_id, user_id, 0)
+        single_context = SimpleNamespace(bot=bot, job=SimpleNamespace(data={"topic_id": topic_id, "user_id": user_id}))
+        await timer.wrap("check_single_topic_job", main.check_single_topic_job)(single_context)
+    single_seconds = time.perf_counter() - started
+
+    checked = topic_count * args.rounds
+    return {
+        "topics": topic_count,
+        "scheduled_checks": checked,
+        "scheduled_seconds": scheduled_seconds,
+        "throughput_topics_per_s": checked / scheduled_seconds if scheduled_seconds else 0.0,
+        "single_checks": args.single_checks,
+        "single_seconds": single_seconds,
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    """השוואה לבסיס - מחזיר רשימת רגרסיות"""
+    regressions = []
+    base_throughput = baseline.get("throughput_topics_per_s") or 0
+    if base_throughput and report["throughput_topics_per_s"] < base_throughput * (1 - max_regression):
+        regressions.append(
+            f"throughput {report['throughput_topics_per_s']:.2f}/s vs baseline {base_throughput:.2f}/s"
+        )
+    for stage, stats in report["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        # שלבים של פחות ממילישנייה רועשים מדי להשוואה
+        if base and base["p95_ms"] >= 1 and stats["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{stage} p95 {stats['p95_ms']:.1f}ms vs baseline {base['p95_ms']:.1f}ms")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"\n📊 {report['scheduled_checks']} scheduled checks in {report['scheduled_seconds']:.2f}s "
+          f"→ {report['throughput_topics_per_s']:.2f} topics/s")
+    print(f"📊 {report['single_checks']} one-time checks in {report['single_seconds']:.2f}s")
+    print(f"📊 {report['api_requests']} API requests, {report['url_probes']} URL probes, "
+          f"{report['messages_sent']} messages sent")
+    print(f"💾 peak traced memory {report['peak_memory_mb']:.1f} MB, max RSS {report['max_rss_mb']:.1f} MB\n")
+    print(f"{'stage':<24}{'count':>8}{'mean ms':>12}{'p50 ms':>12}{'p95 ms':>12}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<24}{stats['count']:>8}{stats['mean_ms']:>12.1f}{stats['p50_ms']:>12.1f}{stats['p95_ms']:>12.1f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--topics-per-user", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=2, help="scheduled check_topics_job runs")
+    parser.add_argument("--single-checks", type=int, default=5, help="check_single_topic_job runs")
+    parser.add_argument("--api-latency-ms", type=float, default=300, help="stub sonar-pro answer time")
+    parser.add_argument("--site-latency-ms", type=float, default=20, help="site server time per URL probe")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--save", help="write the report as JSON (e.g. to use as a baseline)")
+    parser.add_argument("--baseline", help="JSON report of a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed slowdown vs baseline (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+def main():
+    # בסיס הנתונים הזמני (ומסנני התוצאות שלצידו) נמחק בסוף ההרצה
+    with tempfile.TemporaryDirectory(prefix="watchbot-bench-") as scratch_dir:
+        return run(scratch_dir)
+
+
+def run(scratch_dir: str) -> bool:
+    args = parse_args()
+    with open(args.fixtures, encoding="utf-8") as f:
+        fixtures = json.load(f)
+
+    state = StubState(fixtures, args.api_latency_ms / 1000, args.site_latency_ms / 1000)
+    api_server = start_server(make_api_handler(state))
+    site_server = start_server(make_site_handler(state))
+    state.site_url = f"http://127.0.0.1:{site_server.server_address[1]}"
+
+    # main.py קורא את ההגדרות בזמן ה-import - מפנים אותו לשרתים המקומיים ולבסיס נתונים זמני
+    os.environ.update({
+        "PERPLEXITY_BASE_URL": f"http://127.0.0.1:{api_server.server_address[1]}",
+        "PERPLEXITY_API_KEY": "benchmark",
+        "DB_PATH": os.path.join(scratch_dir, "watchbot.db"),
+        "USE_MONGODB": "false",
+        "RUN_SMOKE_TEST": "false",
+        "WORK_QUEUE_ENABLED": "false",
+        "CHECK_TOPICS_DELAY_SECONDS": "0",
+        "SEARCH_PROVIDERS": "perplexity",
+    })
+    os.environ["NO_PROXY"] = ",".join(filter(None, [os.environ.get("NO_PROXY"), "127.0.0.1", "localhost"]))
+
+    print("🔍 Running offline benchmark...")
+    tracemalloc.start()
+    import main as watchbot
+
+    # הלקוח של openai נטען בעצלות בחיפוש הראשון - טוענים אותו לפני המדידה
+    watchbot.get_search_client()
+    bot = FakeBot()
+    timer = StageTimer()
+    instrument(watchbot, timer, bot)
+    try:
+        report = asyncio.run(run_workload(watchbot, args, bot, timer))
+    finally:
+        api_server.shutdown()
+        site_server.shutdown()
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report.update({
+        "api_requests": state.requests,
+        "url_probes": state.probes,
+        "messages_sent": len(bot.messages),
+        "peak_memory_mb": peak / 1024 / 1024,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": timer.summary(),
+    })
+    print_report(report)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report saved to {args.save}")
+
+    if not report["messages_sent"]:
+        print("❌ No messages were sent - the workload did not run end to end")
+        return False
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            return False
+        print("✅ No regressions against the baseline")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Import-time and memory check for the bot and worker entry points.
+
+Each entry point is started in a fresh interpreter under `python -X importtime`
+(SQLite, no network) and brought up to the point where it would start serving:
+
+- bot:    import main, build the PTB Application with its handlers and the Flask app
+- worker: import main and create the telegram Bot the worker loop uses
+
+Reports the total import time, the heaviest top-level imports and the max RSS,
+and fails when a heavy dependency that the entry point does not use at startup
+(openai, pymongo, motor, bson; for the worker also flask, apscheduler and
+telegram.ext) gets loaded. With --baseline the run also fails when import time
+or RSS regress past --max-regression.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOT_TOKEN = "123456:IMPORTCHECK"
+
+ENTRY_POINTS = {
+    "bot": (
+        "import main\n"
+        "from telegram.ext import Application\n"
+        f"application = Application.builder().token({BOT_TOKEN!r}).build()\n"
+        "main.register_handlers(application)\n"
+        "main.create_health_app()\n"
+    ),
+    "worker": (
+        "import main\n"
+        "from telegram import Bot\n"
+        f"Bot({BOT_TOKEN!r})\n"
+    ),
+}
+
+# תלויות כבדות שלא אמורות להיטען בעלייה (עם SQLite) - נטענות רק כשהחלק שלהן מופעל
+COMMON_LAZY = ["openai", "pymongo", "motor", "bson"]
+LAZY_MODULES = {
+    "bot": COMMON_LAZY,
+    "worker": COMMON_LAZY + ["flask", "apscheduler", "telegram.ext"],
+}
+WATCHED_MODULES = sorted(set(COMMON_LAZY + ["flask", "apscheduler", "telegram.ext", "telegram", "requests"]))
+
+REPORT_SNIPPET = (
+    "\nimport sys, json, resource\n"
+    "print(json.dumps({\n"
+    "    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,\n"
+    f"    'loaded': [name for name in {WATCHED_MODULES!r} if name in sys.modules],\n"
+    "}))\n"
+)
+
+
+def parse_importtime(stderr: str) -> dict:
+    """סיכום הפלט של -X importtime: זמן כולל וזמן מצטבר לכל import ברמה העליונה"""
+    top_level = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # רמה עליונה = בלי הזחה נוספת לפני שם המודול
+        if name.startswith("  "):
+            continue
+        top_level[name.strip()] = int(cumulative_us)
+    return top_level
+
+
+def measure(entry_point: str) -> dict:
+    """הרצת נקודת כניסה אחת בתהליך נקי"""
+    with tempfile.TemporaryDirectory(prefix="watchbot-import-") as scratch_dir:
+        env = dict(os.environ)
+        env.update({
+            "BOT_TOKEN": BOT_TOKEN,
+            "PERPLEXITY_API_KEY": "import-check",
+            "DB_PATH": os.path.join(scratch_dir, "watchbot.db"),
+            "USE_MONGODB": "false",
+            "RUN_SMOKE_TEST": "false",
+            "LOG_LEVEL": "WARNING",
+            "PYTHONPATH": REPO_DIR,
+        })
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", ENTRY_POINTS[entry_point] + REPORT_SNIPPET],
+            cwd=scratch_dir, env=env, capture_output=True, text=True, timeout=120
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{entry_point} entry point failed:\n{completed.stderr[-2000:]}")
+
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    top_level = parse_importtime(completed.stderr)
+    report["import_ms"] = sum(top_level.values()) / 1000
+    report["heaviest"] = sorted(
+        ((name, us / 1000) for name, us in top_level.items()), key=lambda item: item[1], reverse=True
+    )[:8]
+    return report
+
+
+def best_of(entry_point: str, repeat: int) -> dict:
+    """כמה הרצות ולקיחת המהירה - זמן import רועש"""
+    runs = [measure(entry_point) for _ in range(repeat)]
+    return min(runs, key=lambda run: run["import_ms"])
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    for entry_point, current in report.items():
+        previous = baseline.get(entry_point)
+        if not previous:
+            continue
+        for metric in ("import_ms", "max_rss_mb"):
+            if current[metric] > previous[metric] * (1 + max_regression):
+                regressions.append(
+                    f"{entry_point} {metric} {current[metric]:.1f} vs baseline {previous[metric]:.1f}"
+                )
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entry-points", default="bot,worker")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per entry point (the fastest is reported)")
+    parser.add_argument("--save", help="write the report as JSON (e.g. to use as a baseline)")
+    parser.add_argument("--baseline", help="JSON report of a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed growth vs baseline (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    success = True
+    report = {}
+
+    for entry_point in args.entry_points.split(","):
+        print(f"🔍 Measuring the {entry_point} entry point...")
+        try:
+            result = best_of(entry_point, args.repeat)
+        except Exception as e:
+            print(f"❌ {e}")
+            success = False
+            continue
+        report[entry_point] = result
+
+        print(f"⏱️ import {result['import_ms']:.0f} ms, 💾 max RSS {result['max_rss_mb']:.1f} MB")
+        for name, ms in result["heaviest"]:
+            print(f"   {name:<32}{ms:>10.1f} ms")
+
+        unexpected = [name for name in LAZY_MODULES[entry_point] if name in result["loaded"]]
+        if unexpected:
+            print(f"❌ {entry_point} loads {', '.join(unexpected)} at startup - these should load on first use")
+            success = False
+        else:
+            print(f"✅ No deferred dependency loaded at startup ({', '.join(result['loaded'])} loaded)")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            success = False
+        else:
+            print("✅ No regressions against the baseline")
+
+    return success
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
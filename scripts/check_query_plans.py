@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check: every storage query must be served by an index.
+
+SQLite: runs the WatchBotDB methods (and the helper stores) on a scratch database,
+captures each executed statement with a trace callback and asserts that
+EXPLAIN QUERY PLAN never reports a full table scan.
+
+MongoDB: when CHECK_MONGODB_URI is set, runs explain() on the filters the
+WatchBotMongoDB methods use and asserts the winning plan has no COLLSCAN.
+
+On both backends it also forces a topic check to fail halfway through its
+commit and asserts the user was charged exactly once and no completed-check
+marker was left behind.
+"""
+import os
+import re
+import sys
+import shutil
+import sqlite3
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+# Add the parent directory to the path so we can import from main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py needs these at import time - point it at a scratch database
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="watchbot-plans-")
+os.environ["DB_PATH"] = os.path.join(_SCRATCH_DIR, "watchbot.db")
+os.environ["USE_MONGODB"] = "false"
+os.environ["RUN_SMOKE_TEST"] = "false"
+os.environ.setdefault("PERPLEXITY_API_KEY", "plan-check")
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+logger = logging.getLogger(__name__)
+
+# סריקות מלאות מכוונות - עם הסיבה
+ALLOWED_FULL_SCANS = {
+    "_seed_stats": "one-time full count when counters are first created",
+    "get_storage_usage": "admin-only row counts",
+    "queue.stats": "queue holds at most one row per active topic",
+    "pending.list": "startup reload reads every pending one-time check (at most one per topic)",
+}
+
+_SCAN_RE = re.compile(r"^SCAN (\w+)$")
+_FROM_RE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_KEYWORDS = {"WHERE", "JOIN", "LEFT", "INNER", "ON", "GROUP", "ORDER", "LIMIT", "UNION", "SET", "AND", "OR"}
+_EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "WITH", "INSERT")
+
+
+class StatementRecorder:
+    """עוטף את sqlite3.connect ואוסף את כל השאילתות שבוצעו, לפי השלב שהריץ אותן"""
+
+    def __init__(self):
+        self.statements = []
+        self.label = None
+        self._connect = sqlite3.connect
+
+    def __enter__(self):
+        recorder = self
+
+        def connect(*args, **kwargs):
+            conn = recorder._connect(*args, **kwargs)
+            conn.set_trace_callback(lambda sql: recorder.statements.append((recorder.label, sql)))
+            return conn
+
+        sqlite3.connect = connect
+        return self
+
+    def __exit__(self, *exc):
+        sqlite3.connect = self._connect
+
+
+def full_scans(conn, sql: str, tables: set) -> list:
+    """טבלאות שהשאילתה סורקת במלואן (בלי אינדקס)"""
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    except sqlite3.Error as e:
+        logger.debug(f"Cannot explain statement ({e}): {sql}")
+        return []
+    # EXPLAIN מציג את הכינוי (wt) ולא את שם הטבלה
+    aliases = {}
+    for table, alias in _FROM_RE.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in _KEYWORDS:
+            aliases[alias] = table
+
+    scans = []
+    for _, _, _, detail in plan:
+        match = _SCAN_RE.match(detail)
+        if match and aliases.get(match.group(1), match.group(1)) in tables:
+            scans.append(aliases.get(match.group(1), match.group(1)))
+    return scans
+
+
+def exercise_sqlite(recorder):
+    """הרצת כל מתודות האחסון על בסיס נתונים עם מעט נתונים"""
+    import main
+    from state_store import SQLiteStateStore
+    from leader_lease import SQLiteLeaderLease
+    from work_queue import SQLiteWorkQueue
+    from pending_checks import SQLitePendingChecks
+
+    db = main.db
+
+    def step(label, func, *args):
+        recorder.label = label
+        return func(*args)
+
+    step("init_db", db.init_db)
+    # המונים כבר אותחלו - מריצים את האתחול שוב במפורש כדי לכסות גם אותו
+    conn = sqlite3.connect(db.db_path)
+    recorder.label = "_seed_stats"
+    db._seed_stats(conn.cursor())
+    conn.rollback()
+    conn.close()
+
+    step("add_user", db.add_user, 1, "plan_user")
+    step("add_user", db.add_user, 2, "other_user")
+    topic_id = step("add_watch_topic", db.add_watch_topic, 1, "query plans", 24, 5)
+    step("add_watch_topic", db.add_watch_topic, 2, "other topic")
+    step("get_user_topics", db.get_user_topics, 1)
+    step("get_topic_by_id", db.get_topic_by_id, topic_id)
+    step("save_result", db.save_result, topic_id, "title", "https://example.com/a", "summary")
+    step("save_result", db.save_result, topic_id, "title", "https://example.com/a", "summary")
+    step("get_result_fingerprints", db.get_result_fingerprints, topic_id)
+    step("get_topic_watermark", db.get_topic_watermark, topic_id)
+    step("update_topic_text", db.update_topic_text, 1, str(topic_id), "query plans 2")
+    step("update_topic_frequency", db.update_topic_frequency, 1, str(topic_id), 12)
+    step("get_active_topics_for_check", db.get_active_topics_for_check)
+    step("update_topic_checked", db.update_topic_checked, topic_id)
+    step("get_user_usage", db.get_user_usage, 1)
+    step("increment_usage", db.increment_usage, 1)
+    step("decrement_credits", main.decrement_credits, 1, 1)
+    step("commit_check", db.commit_check, "plans:1", topic_id, 1, 1,
+         [("title", "https://example.com/b", "summary")])
+    step("commit_check", db.commit_check, "plans:1", topic_id, 1, 1, [])
+    step("is_check_applied", db.is_check_applied, "plans:1")
+    step("toggle_user_status", db.toggle_user_status, 2, False)
+    step("get_recent_users_activity", db.get_recent_users_activity)
+    step("get_stats", db.get_stats)
+    step("remove_topic", db.remove_topic, 2, "other")
+    step("remove_topic", db.remove_topic, 1, str(topic_id))
+    step("apply_retention", db.apply_retention, 90)
+    step("get_storage_usage", db.get_storage_usage)
+
+    states = step("state.init", SQLiteStateStore, db.db_path, 60, 100)
+    step("state.set", states.set, 1, {"step": "x"})
+    step("state.get", states.get, 1)
+    step("state.pop", states.pop, 1)
+
+    lease = step("lease.init", SQLiteLeaderLease, db.db_path, "plans", 30)
+    step("lease.acquire", lease.try_acquire)
+    step("lease.release", lease.release)
+
+    queue = step("queue.init", SQLiteWorkQueue, db.db_path, 3)
+    step("queue.enqueue", queue.enqueue, topic_id, 1)
+    job = step("queue.claim", queue.claim, "plans", 60)
+    step("queue.release", queue.release, job, "plans", "error", 0)
+    job = step("queue.claim", queue.claim, "plans", 60)
+    step("queue.ack", queue.ack, job, "plans")
+    step("queue.stats", queue.stats)
+
+    pending = step("pending.init", SQLitePendingChecks, db.db_path)
+    step("pending.schedule", pending.schedule, topic_id, 1, 60)
+    step("pending.schedule", pending.schedule, topic_id, 1, 0)
+    step("pending.get", pending.get, topic_id)
+    step("pending.list", pending.list_pending)
+    item = step("pending.claim", pending.claim, topic_id)
+    step("pending.restore", pending.restore, item)
+
+    return db.db_path
+
+
+def check_failed_commit(db, topic_id) -> bool:
+    """בדיקה שנכשלת באמצע ה-commit: חיוב אחד בדיוק, ובלי סימון בדיקה שחוסם ניסיון חוזר"""
+    import main
+
+    topic = db.get_topic_by_id(topic_id)
+    usage_before = db.get_user_usage(topic.user_id).current_usage
+    check = main.CheckUnitOfWork(topic, "plans:failed")
+    check.charge(1)
+    check.add_result(main.SearchResult("title", "https://example.com/failed", "summary"))
+    check.mark_checked()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("forced _insert_result failure")
+
+    active_db, main.db = main.db, db
+    db._insert_result = fail
+    try:
+        check.commit()
+        print("❌ failed commit: the forced _insert_result failure was swallowed")
+        return False
+    except Exception:
+        check.abandon()
+    finally:
+        del db._insert_result
+        main.db = active_db
+
+    debits = db.get_user_usage(topic.user_id).current_usage - usage_before
+    if debits != 1:
+        print(f"❌ failed commit: charged {debits} times instead of once")
+        return False
+    if db.is_check_applied(check.check_id):
+        print("❌ failed commit: the completed-check marker was left behind")
+        return False
+    print("✅ failed commit charged once and left no completed-check marker")
+    return True
+
+
+def check_sqlite() -> bool:
+    """בדיקת תוכניות השאילתות של SQLite"""
+    print("🔍 Checking SQLite query plans...")
+    # ה-init_db שרץ בזמן ה-import נבדק בנפרד בתוך exercise_sqlite
+    import main
+    with StatementRecorder() as recorder:
+        db_path = exercise_sqlite(recorder)
+
+    conn = sqlite3.connect(db_path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    failures = []
+    checked = set()
+    for label, sql in recorder.statements:
+        statement = sql.strip()
+        if not statement.upper().startswith(_EXPLAINABLE) or (label, statement) in checked:
+            continue
+        checked.add((label, statement))
+        scans = full_scans(conn, statement, tables)
+        if scans and label not in ALLOWED_FULL_SCANS:
+            failures.append((label, scans, " ".join(statement.split())))
+    conn.close()
+
+    for label, scans, statement in failures:
+        print(f"❌ {label}: full scan of {', '.join(scans)}\n   {statement}")
+    if not failures:
+        print(f"✅ {len(checked)} SQLite statements use indexes")
+
+    db = main.db
+    committed_ok = check_failed_commit(db, db.add_watch_topic(1, "failed commit"))
+    return not failures and committed_ok
+
+
+def _has_collscan(plan) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(item) for item in plan)
+    return False
+
+
+def check_mongo(uri: str) -> bool:
+    """בדיקת תוכניות השאילתות של MongoDB על בסיס נתונים זמני"""
+    from bson import ObjectId
+    from main import WatchBotMongoDB, stats_hour_key
+    from state_store import MongoStateStore
+    from work_queue import MongoWorkQueue
+
+    print("🔍 Checking MongoDB query plans...")
+    db_name = f"watchbot_plans_{os.getpid()}"
+    db = WatchBotMongoDB(uri, db_name)
+    MongoStateStore(db.db, 60, 100)
+    MongoWorkQueue(db.db, 3)
+    try:
+        db.add_user(1, "plan_user")
+        topic_id = db.add_watch_topic(1, "query plans")
+        db.save_result(topic_id, "title", "https://example.com/a", "summary")
+
+        now = datetime.now()
+        month = now.strftime("%Y-%m")
+        queries = {
+            "add_user": (db.users_collection, {"user_id": 1}),
+            "get_topic_by_id": (db.watch_topics_collection, {"_id": ObjectId(topic_id)}),
+            "get_user_topics": (db.watch_topics_collection, {"user_id": 1, "is_active": True}),
+            "remove_topic (by name)": (
+                db.watch_topics_collection,
+                {"user_id": 1, "topic": {"$regex": "plans", "$options": "i"}, "is_active": True}
+            ),
+            "get_active_topics_for_check": (db.watch_topics_collection, {"is_active": True}),
+            "get_active_topics_for_check (paused users)": (db.users_collection, {"is_active": False}),
+            "save_result (results)": (
+                db.found_results_collection,
+                {"topic_id": topic_id, "$or": [{"url_hash": "x"}, {"content_hash": "x"}]}
+            ),
+            "save_result (fingerprints)": (
+                db.result_fingerprints_collection,
+                {"topic_id": topic_id, "$or": [{"url_hash": "x"}, {"content_hash": "x"}]}
+            ),
+            "get_result_fingerprints": (db.found_results_collection, {"topic_id": topic_id}),
+            "get_topic_watermark": (db.found_results_collection, {"topic_id": topic_id}),
+            "apply_retention": (db.found_results_collection, {"topic_id": {"$in": [topic_id]}}),
+            "get_user_usage": (db.usage_stats_collection, {"user_id": 1, "month": month}),
+            "recent activity (topics)": (db.watch_topics_collection, {"created_at": {"$gte": now - timedelta(days=7)}}),
+            "recent activity (users)": (db.users_collection, {"created_at": {"$gte": now - timedelta(days=7)}}),
+            "recent activity (usage)": (db.usage_stats_collection, {"month": month, "usage_count": {"$gt": 0}}),
+            "get_stats (counters)": (db.stats_counters_collection, {"_id": {"$in": [f"usage_total:{month}"]}}),
+            "get_stats (hourly)": (db.stats_hourly_collection, {"_id": {"$gt": stats_hour_key(now)}}),
+            "state store": (db.db.conversation_states, {"_id": 1, "expires_at": {"$gt": now}}),
+            "work queue claim": (db.db.topic_check_queue, {"available_at": {"$lte": now}}),
+            "is_check_applied": (db.completed_checks_collection, {"_id": "plans:1"}),
+        }
+
+        failures = []
+        for label, (collection, query) in queries.items():
+            plan = collection.find(query).explain()
+            if _has_collscan(plan.get("queryPlanner", {}).get("winningPlan", {})):
+                failures.append(label)
+                print(f"❌ {label}: COLLSCAN on {collection.name} for {query}")
+        if not failures:
+            print(f"✅ {len(queries)} MongoDB queries use indexes")
+        committed_ok = check_failed_commit(db, db.add_watch_topic(1, "failed commit"))
+        return not failures and committed_ok
+    finally:
+        db.client.drop_database(db_name)
+
+
+def main():
+    ok = check_sqlite()
+    mongo_uri = os.getenv("CHECK_MONGODB_URI")
+    if mongo_uri:
+        ok = check_mongo(mongo_uri) and ok
+    else:
+        print("⚠️  CHECK_MONGODB_URI not set - skipping MongoDB query plans")
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+    finally:
+        shutil.rmtree(_SCRATCH_DIR, ignore_errors=True)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Load test for the Telegram handlers: many concurrent virtual users send synthetic
+updates to a real PTB Application (same handlers as the bot, via register_handlers)
+whose Bot talks to an in-process fake Telegram API instead of the network.
+
+Each virtual user walks a scenario (/start, menu buttons, topic list, adding a
+topic, usage stats, free text). Concurrency ramps through --levels and each level
+reports handler p50/p99 latency, event-loop lag and database contention (per
+method latency and "database is locked" errors). SQLite by default; pass
+--mongodb-uri (or LOAD_TEST_MONGODB_URI) to run against a local MongoDB, in a
+scratch database that is dropped at the end.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+
+# Add the parent directory to the path so we can import from main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+logger = logging.getLogger(__name__)
+
+BOT_ID = 123456
+BOT_TOKEN = f"{BOT_ID}:LOADTEST"
+FIRST_USER_ID = 500000
+BACKGROUND_PREFIX = "background:"
+
+# תרחיש של משתמש וירטואלי: (שם השלב, סוג, תוכן)
+SCENARIO = [
+    ("cmd_start", "command", "/start"),
+    ("cb_main_menu", "callback", "main_menu"),
+    ("cb_list_topics", "callback", "list_topics"),
+    ("cmd_list", "command", "/list"),
+    ("cb_add_topic", "callback", "add_topic"),
+    ("text_topic", "text", "load test topic {user}-{iteration}"),
+    ("cb_freq_24", "callback", "freq_24"),
+    ("cb_usage_stats", "callback", "usage_stats"),
+    ("text_menu", "text", "hello"),
+]
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class FakeTelegramRequest(BaseRequest):
+    """שכבת HTTP מזויפת לבוט - עונה על קריאות ה-API של טלגרם בלי רשת"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {}
+        self._message_ids = iter(range(1, 10 ** 9))
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        parameters = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "WatchBot", "username": "watchbot_load_test"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            chat_id = int(parameters.get("chat_id", 0))
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "WatchBot"},
+                "text": parameters.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class UpdateFactory:
+    """בניית עדכוני טלגרם סינתטיים (הודעות, פקודות ולחיצות כפתורים)"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = iter(range(1, 10 ** 9))
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load_user_{user_id}"}
+
+    def _message(self, user_id: int, text: str, from_bot: bool = False) -> dict:
+        message = {
+            "message_id": next(self._update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "WatchBot"} if from_bot else self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def build(self, kind: str, user_id: int, content: str) -> Update:
+        update_id = next(self._update_ids)
+        if kind == "callback":
+            data = {
+                "update_id": update_id,
+                "callback_query": {
+                    "id": str(update_id),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": content,
+                    "message": self._message(user_id, "menu", from_bot=True),
+                },
+            }
+        else:
+            data = {"update_id": update_id, "message": self._message(user_id, content)}
+        return Update.de_json(data, self.bot)
+
+
+class LatencyRecorder:
+    """דגימות זמנים לפי שם - בטוח לשימוש מכמה threads"""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def reset(self) -> dict:
+        with self._lock:
+            samples, self.samples = self.samples, {}
+        return samples
+
+
+class LockErrorCounter(logging.Handler):
+    """סופר שגיאות בסיס נתונים שנרשמו ללוג (הפונקציות של main תופסות אותן ורושמות)"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.locked = 0
+        self.errors = 0
+
+    def emit(self, record):
+        message = record.getMessage().lower()
+        self.errors += 1
+        if "locked" in message or "busy" in message:
+            self.locked += 1
+
+    def reset(self) -> tuple:
+        counts = (self.locked, self.errors)
+        self.locked = self.errors = 0
+        return counts
+
+
+class RecordingReporter:
+    """במקום דיווח הפעילות לאטלס - רק מונה, כדי שהבדיקה לא תצא לרשת"""
+
+    def __init__(self):
+        self.reports = 0
+
+    def report_activity(self, user_id):
+        self.reports += 1
+
+
+def instrument_db(db, recorder: LatencyRecorder):
+    """עטיפת כל המתודות הציבוריות של בסיס הנתונים במדידת זמן"""
+    for name in dir(db):
+        if name.startswith("_"):
+            continue
+        method = getattr(db, name)
+        if not callable(method) or not hasattr(method, "__self__"):
+            continue
+
+        def timed(*args, _method=method, _name=name, **kwargs):
+            started = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                recorder.record(_name, time.perf_counter() - started)
+        setattr(db, name, timed)
+
+
+async def monitor_loop_lag(recorder: LatencyRecorder, stop: asyncio.Event, interval: float = 0.01):
+    """מדידת עיכוב הלולאה - כמה מאוחר מתעוררת שינה קצרה"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        recorder.record("loop_lag", max(loop.time() - started - interval, 0.0))
+
+
+def background_writer(save_result, recorder: LatencyRecorder, topic_ids: list, stop: threading.Event, index: int):
+    """כותב ברקע ל-found_results - מדמה בדיקות נושאים שרצות במקביל למשתמשים"""
+    n = 0
+    while not stop.is_set():
+        topic_id = topic_ids[n % len(topic_ids)]
+        started = time.perf_counter()
+        save_result(topic_id, f"Background result {index}-{n}",
+                    f"https://example.com/load/{index}/{n}", "background write during the load test")
+        recorder.record(BACKGROUND_PREFIX + "save_result", time.perf_counter() - started)
+        n += 1
+        time.sleep(0.005)
+
+
+async def run_virtual_user(application, factory: UpdateFactory, handler_times: LatencyRecorder,
+                           user_id: int, iterations: int, think_time: float):
+    for iteration in range(iterations):
+        for step, kind, content in SCENARIO:
+            update = factory.build(kind, user_id, content.format(user=user_id, iteration=iteration))
+            started = time.perf_counter()
+            await application.process_update(update)
+            handler_times.record(step, time.perf_counter() - started)
+            if think_time:
+                await asyncio.sleep(think_time)
+
+
+async def run_level(application, factory, users: int, args, handler_times, loop_lag, db_times, lock_errors) -> dict:
+    for recorder in (handler_times, loop_lag, db_times):
+        recorder.reset()
+    lock_errors.reset()
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(loop_lag, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_virtual_user(application, factory, handler_times, FIRST_USER_ID + index, args.iterations, args.think_time_ms / 1000)
+        for index in range(users)
+    ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    handlers = handler_times.reset()
+    all_handler_times = [value for values in handlers.values() for value in values]
+    lag = loop_lag.reset().get("loop_lag", [])
+    db_samples = db_times.reset()
+    locked, errors = lock_errors.reset()
+    return {
+        "users": users,
+        "updates": len(all_handler_times),
+        "seconds": elapsed,
+        "updates_per_s": len(all_handler_times) / elapsed if elapsed else 0.0,
+        "handler_p50_ms": percentile(all_handler_times, 0.5) * 1000,
+        "handler_p99_ms": percentile(all_handler_times, 0.99) * 1000,
+        "steps": {
+            step: {"p50_ms": percentile(values, 0.5) * 1000, "p99_ms": percentile(values, 0.99) * 1000}
+            for step, values in handlers.items()
+        },
+        "loop_lag_p50_ms": percentile(lag, 0.5) * 1000,
+        "loop_lag_p99_ms": percentile(lag, 0.99) * 1000,
+        "loop_lag_max_ms": max(lag, default=0.0) * 1000,
+        "db_calls": sum(len(values) for name, values in db_samples.items() if not name.startswith(BACKGROUND_PREFIX)),
+        "db_seconds": sum(sum(values) for name, values in db_samples.items() if not name.startswith(BACKGROUND_PREFIX)),
+        "db_methods": {
+            name: {"count": len(values), "p50_ms": percentile(values, 0.5) * 1000, "p99_ms": percentile(values, 0.99) * 1000}
+            for name, values in db_samples.items()
+        },
+        "db_locked_errors": locked,
+        "errors_logged": errors,
+    }
+
+
+def print_level(report: dict, top_methods: int = 5):
+    print(f"\n👥 {report['users']} users: {report['updates']} updates in {report['seconds']:.2f}s "
+          f"→ {report['updates_per_s']:.1f} updates/s")
+    print(f"⏱️ handlers p50 {report['handler_p50_ms']:.1f} ms, p99 {report['handler_p99_ms']:.1f} ms")
+    print(f"🔁 event loop lag p50 {report['loop_lag_p50_ms']:.1f} ms, p99 {report['loop_lag_p99_ms']:.1f} ms, "
+          f"max {report['loop_lag_max_ms']:.1f} ms")
+    print(f"💾 {report['db_calls']} db calls ({report['db_seconds']:.2f}s blocking the loop), "
+          f"{report['db_locked_errors']} lock errors, {report['errors_logged']} errors logged")
+    print(f"   {'step':<18}{'p50 ms':>10}{'p99 ms':>10}")
+    for step, stats in report["steps"].items():
+        print(f"   {step:<18}{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    slowest = sorted(report["db_methods"].items(), key=lambda item: item[1]["p99_ms"], reverse=True)[:top_methods]
+    print(f"   {'db method':<28}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, stats in slowest:
+        print(f"   {name:<28}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+
+async def run_load_test(main, args) -> list:
+    from telegram.ext import Application
+
+    request = FakeTelegramRequest(args.telegram_latency_ms / 1000)
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(request)
+        .get_updates_request(FakeTelegramRequest())
+        .build()
+    )
+    main.register_handlers(application)
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+
+    handler_times = LatencyRecorder()
+    loop_lag = LatencyRecorder()
+    db_times = LatencyRecorder()
+    lock_errors = LockErrorCounter()
+    logging.getLogger().addHandler(lock_errors)
+
+    # נושא קיים לכל משתמש, כדי שהרשימות לא יהיו ריקות והכותבים ברקע יכתבו לנושאים אמיתיים
+    levels = [int(level) for level in args.levels.split(",")]
+    topic_ids = []
+    save_result = main.db.save_result
+    for index in range(max(levels)):
+        user_id = FIRST_USER_ID + index
+        main.db.add_user(user_id, f"load_user_{user_id}")
+        topic_ids.append(main.db.add_watch_topic(user_id, f"seeded topic {index}"))
+    instrument_db(main.db, db_times)
+
+    stop_writers = threading.Event()
+    writers = [
+        threading.Thread(target=background_writer, args=(save_result, db_times, topic_ids, stop_writers, index), daemon=True)
+        for index in range(args.background_writers)
+    ]
+    for writer in writers:
+        writer.start()
+
+    reports = []
+    try:
+        for users in levels:
+            report = await run_level(application, factory, users, args, handler_times, loop_lag, db_times, lock_errors)
+            print_level(report)
+            reports.append(report)
+    finally:
+        stop_writers.set()
+        for writer in writers:
+            writer.join()
+        logging.getLogger().removeHandler(lock_errors)
+        await application.shutdown()
+
+    print(f"\n📡 Telegram API calls: {dict(sorted(request.calls.items()))}")
+    return reports
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="10,50,100,200", help="concurrent users per ramp step")
+    parser.add_argument("--iterations", type=int, default=2, help="scenario runs per virtual user")
+    parser.add_argument("--think-time-ms", type=float, default=0, help="pause between a user's updates")
+    parser.add_argument("--telegram-latency-ms", type=float, default=30, help="fake Telegram API response time")
+    parser.add_argument("--background-writers", type=int, default=0, help="threads writing results during the run")
+    parser.add_argument("--mongodb-uri", default=os.getenv("LOAD_TEST_MONGODB_URI"),
+                        help="run against this (local) MongoDB instead of SQLite")
+    parser.add_argument("--max-p99-ms", type=float, help="fail if any level's handler p99 exceeds this")
+    parser.add_argument("--save", help="write the per-level reports as JSON")
+    return parser.parse_args()
+
+
+def main():
+    # בסיס הנתונים הזמני (ומסנני התוצאות שלצידו) נמחק בסוף ההרצה
+    with tempfile.TemporaryDirectory(prefix="watchbot-load-") as scratch_dir:
+        return run(scratch_dir)
+
+
+def run(scratch_dir: str) -> bool:
+    args = parse_args()
+
+    # main.py קורא את ההגדרות בזמן ה-import - בסיס נתונים זמני ובלי בדיקת עשן
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "PERPLEXITY_API_KEY": os.getenv("PERPLEXITY_API_KEY", "load-test"),
+        "DB_PATH": os.path.join(scratch_dir, "watchbot.db"),
+        "RUN_SMOKE_TEST": "false",
+        "WORK_QUEUE_ENABLED": "false",
+    })
+    if args.mongodb_uri:
+        os.environ.update({
+            "USE_MONGODB": "true",
+            "MONGODB_URI": args.mongodb_uri,
+            "MONGODB_DB_NAME": f"watchbot_load_{uuid.uuid4().hex[:8]}",
+        })
+    else:
+        os.environ["USE_MONGODB"] = "false"
+
+    backend = "MongoDB" if args.mongodb_uri else "SQLite"
+    print(f"🔍 Running handler load test against {backend} (levels {args.levels})...")
+    import main as watchbot
+
+    # בדיקות חד-פעמיות שהתרחיש מתזמן לא רצות (ה-JobQueue לא מופעל) - בלי הודעה על כל אחת
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+    watchbot.reporter = RecordingReporter()
+    try:
+        reports = asyncio.run(run_load_test(watchbot, args))
+    finally:
+        if args.mongodb_uri:
+            watchbot.db.client.drop_database(os.environ["MONGODB_DB_NAME"])
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"backend": backend, "levels": reports}, f, indent=2)
+        print(f"💾 Report saved to {args.save}")
+
+    success = True
+    for report in reports:
+        if report["updates"] != report["users"] * args.iterations * len(SCENARIO):
+            print(f"❌ {report['users']} users: only {report['updates']} updates were processed")
+            success = False
+        if report["errors_logged"]:
+            print(f"❌ {report['users']} users: {report['errors_logged']} errors were logged by the handlers")
+            success = False
+        if args.max_p99_ms is not None and report["handler_p99_ms"] > args.max_p99_ms:
+            print(f"❌ {report['users']} users: handler p99 {report['handler_p99_ms']:.1f} ms > {args.max_p99_ms} ms")
+            success = False
+    if success:
+        print("✅ Load test completed")
+    return success
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Migrate all bot data from SQLite to MongoDB.
+
+Streams every table in fixed-size batches (keyset pagination on rowid) and writes
+them with bulk_write upserts, so re-running is safe. Progress is checkpointed in
+the `migration_checkpoints` collection after every batch - an interrupted run
+resumes where it stopped. After copying, row counts are verified per table.
+
+Usage:
+    python scripts/migrate_sqlite_to_mongo.py --sqlite-path /var/data/watchbot.db
+    python scripts/migrate_sqlite_to_mongo.py --verify-only
+    python scripts/migrate_sqlite_to_mongo.py --restart   # ignore checkpoints
+"""
+import os
+import sys
+import sqlite3
+import logging
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# Add the parent directory to the path so we can import from main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+SOURCE_DB_PATH = os.getenv("DB_PATH", "/var/data/watchbot.db")
+
+# main.py פותח בסיס נתונים בזמן ה-import - מפנים אותו לקובץ זמני כדי לא לגעת במקור
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="watchbot-migrate-")
+os.environ["DB_PATH"] = os.path.join(_SCRATCH_DIR, "watchbot.db")
+os.environ["USE_MONGODB"] = "false"
+os.environ["RUN_SMOKE_TEST"] = "false"
+os.environ.setdefault("PERPLEXITY_API_KEY", "migration")
+
+from pymongo import UpdateOne  # noqa: E402
+from main import (  # noqa: E402
+    WatchBotMongoDB, MONGODB_URI, MONGODB_DB_NAME, RESULT_RETENTION_DAYS,
+    url_fingerprint, content_fingerprint
+)
+
+
+def parse_timestamp(value):
+    """המרת TIMESTAMP של SQLite ל-datetime"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+class Migrator:
+    """העברת הטבלאות אחת אחרי השנייה, במנות, עם נקודות ביקורת"""
+
+    # סדר ההעברה חשוב: תוצאות צריכות את מיפוי הנושאים
+    TABLES = ["users", "watch_topics", "usage_stats", "found_results", "result_fingerprints"]
+
+    def __init__(self, sqlite_path: str, mongo: WatchBotMongoDB, batch_size: int):
+        self.sqlite_path = sqlite_path
+        self.mongo = mongo
+        self.batch_size = batch_size
+        self.checkpoints = mongo.db.migration_checkpoints
+        self.results_cutoff = datetime.utcnow() - timedelta(days=RESULT_RETENTION_DAYS)
+
+        # מיפוי מזהי נושאים מ-SQLite ל-ObjectId נשמר על הנושא עצמו
+        mongo.watch_topics_collection.create_index("sqlite_id", sparse=True)
+        mongo.found_results_collection.create_index("sqlite_id", sparse=True)
+
+    # --- קריאה מ-SQLite ---
+
+    def _connect(self):
+        # קריאה בלבד - המקור לא משתנה
+        return sqlite3.connect(f"file:{self.sqlite_path}?mode=ro", uri=True)
+
+    def _table_exists(self, conn, table: str) -> bool:
+        row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        return row is not None
+
+    def _batches(self, conn, table: str, columns: str, after_rowid: int):
+        """מעבר על הטבלה במנות לפי rowid - בלי fetchall על כל הטבלה"""
+        while True:
+            rows = conn.execute(
+                f"SELECT rowid, {columns} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (after_rowid, self.batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            yield rows
+            after_rowid = rows[-1][0]
+
+    # --- נקודות ביקורת ---
+
+    def _checkpoint(self, table: str) -> dict:
+        return self.checkpoints.find_one({"_id": table}) or {"_id": table, "last_rowid": 0, "migrated": 0, "done": False}
+
+    def _save_checkpoint(self, table: str, last_rowid: int, migrated: int, done: bool = False):
+        self.checkpoints.update_one(
+            {"_id": table},
+            {"$set": {"last_rowid": last_rowid, "migrated": migrated, "done": done, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    def reset(self):
+        self.checkpoints.delete_many({})
+        logger.info("Checkpoints cleared - migration will start from the beginning")
+
+    # --- המרת שורות לפעולות bulk ---
+
+    def _user_ops(self, rows):
+        users = self.mongo.users_collection
+        ops = [
+            UpdateOne(
+                {"user_id": user_id},
+                {
+                    "$set": {"username": username, "is_active": bool(is_active)},
+                    "$setOnInsert": {"created_at": parse_timestamp(created_at) or datetime.now(), "migrated_from_sqlite": True}
+                },
+                upsert=True
+            )
+            for _, user_id, username, is_active, created_at in rows
+        ]
+        return [(users, ops)]
+
+    def _topic_ops(self, rows):
+        topics = self.mongo.watch_topics_collection
+        ops = [
+            UpdateOne(
+                {"sqlite_id": topic_id},
+                {"$set": {
+                    "user_id": user_id,
+                    "topic": topic,
+                    "check_interval": check_interval,
+                    "is_active": bool(is_active),
+                    "created_at": parse_timestamp(created_at) or datetime.now(),
+                    "last_checked": parse_timestamp(last_checked),
+                    "checks_remaining": checks_remaining,
+                    "migrated_from_sqlite": True
+                }},
+                upsert=True
+            )
+            for _, topic_id, user_id, topic, check_interval, is_active, created_at, last_checked, checks_remaining in rows
+        ]
+        return [(topics, ops)]
+
+    def _usage_ops(self, rows):
+        usage = self.mongo.usage_stats_collection
+        ops = [
+            UpdateOne(
+                {"user_id": user_id, "month": month},
+                {
+                    # $max - לא מורידים שימוש שכבר נרשם במונגו
+                    "$max": {"usage_count": usage_count or 0},
+                    "$setOnInsert": {"created_at": datetime.now(), "migrated_from_sqlite": True}
+                },
+                upsert=True
+            )
+            for _, user_id, month, usage_count in rows
+        ]
+        return [(usage, ops)]
+
+    def _topic_id_map(self, sqlite_ids) -> dict:
+        cursor = self.mongo.watch_topics_collection.find(
+            {"sqlite_id": {"$in": list(set(sqlite_ids))}}, {"_id": 1, "sqlite_id": 1}
+        )
+        return {doc["sqlite_id"]: str(doc["_id"]) for doc in cursor}
+
+    def _fingerprint_op(self, topic_id: str, url_hash: str, content_hash: str, found_at):
+        return UpdateOne(
+            {"topic_id": topic_id, "url_hash": url_hash, "content_hash": content_hash},
+            {"$setOnInsert": {"found_at": found_at or datetime.now()}},
+            upsert=True
+        )
+
+    def _result_ops(self, rows):
+        topic_map = self._topic_id_map(row[2] for row in rows)
+        result_ops, fingerprint_ops = [], []
+        for _, result_id, topic_id, title, url, content_summary, content_hash, found_at, is_sent in rows:
+            mongo_topic_id = topic_map.get(topic_id)
+            if mongo_topic_id is None:
+                logger.warning(f"Skipping result {result_id}: topic {topic_id} was not migrated")
+                continue
+            title = title or 'ללא כותרת'
+            url = url or ''
+            content_summary = content_summary or 'ללא סיכום'
+            # hash() הישן לא יציב בין הפעלות - מחשבים מחדש כמו save_result
+            content_hash = content_fingerprint(title, url, content_summary)
+            url_hash = url_fingerprint(url)
+            found_at = parse_timestamp(found_at)
+
+            fingerprint_ops.append(self._fingerprint_op(mongo_topic_id, url_hash, content_hash, found_at))
+            # תוצאות ישנות היו נמחקות ע"י אינדקס ה-TTL - מעבירים רק את טביעת האצבע
+            if found_at and found_at < self.results_cutoff:
+                continue
+            result_ops.append(UpdateOne(
+                {"sqlite_id": result_id},
+                {"$set": {
+                    "topic_id": mongo_topic_id,
+                    "title": title,
+                    "url": url,
+                    "content_summary": content_summary,
+                    "content_hash": content_hash,
+                    "url_hash": url_hash,
+                    "found_at": found_at or datetime.now(),
+                    "is_sent": bool(is_sent)
+                }},
+                upsert=True
+            ))
+        return [
+            (self.mongo.result_fingerprints_collection, fingerprint_ops),
+            (self.mongo.found_results_collection, result_ops)
+        ]
+
+    def _fingerprint_ops(self, rows):
+        topic_map = self._topic_id_map(row[1] for row in rows)
+        ops = [
+            self._fingerprint_op(topic_map[topic_id], url_hash, content_hash, parse_timestamp(found_at))
+            for _, topic_id, url_hash, content_hash, found_at in rows
+            if topic_id in topic_map
+        ]
+        return [(self.mongo.result_fingerprints_collection, ops)]
+
+    def _spec(self, table: str):
+        """עמודות ופונקציית המרה לכל טבלה"""
+        return {
+            "users": ("user_id, username, is_active, created_at", self._user_ops),
+            "watch_topics": (
+                "id, user_id, topic, check_interval, is_active, created_at, last_checked, checks_remaining",
+                self._topic_ops
+            ),
+            "usage_stats": ("user_id, month, usage_count", self._usage_ops),
+            "found_results": (
+                "id, topic_id, title, url, content_summary, content_hash, found_at, is_sent",
+                self._result_ops
+            ),
+            "result_fingerprints": ("topic_id, url_hash, content_hash, found_at", self._fingerprint_ops),
+        }[table]
+
+    # --- הרצה ---
+
+    def migrate_table(self, conn, table: str):
+        checkpoint = self._checkpoint(table)
+        if checkpoint["done"]:
+            logger.info(f"{table}: already migrated ({checkpoint['migrated']} rows), skipping")
+            return
+        if not self._table_exists(conn, table):
+            logger.info(f"{table}: not in SQLite database, skipping")
+            self._save_checkpoint(table, 0, 0, done=True)
+            return
+
+        columns, to_ops = self._spec(table)
+        last_rowid, migrated = checkpoint["last_rowid"], checkpoint["migrated"]
+        if last_rowid:
+            logger.info(f"{table}: resuming after rowid {last_rowid} ({migrated} rows already migrated)")
+
+        for rows in self._batches(conn, table, columns, last_rowid):
+            for collection, ops in to_ops(rows):
+                if ops:
+                    collection.bulk_write(ops, ordered=False)
+            last_rowid = rows[-1][0]
+            migrated += len(rows)
+            self._save_checkpoint(table, last_rowid, migrated)
+            logger.info(f"{table}: {migrated} rows migrated")
+
+        self._save_checkpoint(table, last_rowid, migrated, done=True)
+        logger.info(f"✅ {table}: done ({migrated} rows)")
+
+    def migrate(self):
+        conn = self._connect()
+        try:
+            for table in self.TABLES:
+                self.migrate_table(conn, table)
+        finally:
+            conn.close()
+
+        # המונים של /stats נבנים מחדש מהנתונים שהועברו
+        self.mongo.stats_counters_collection.delete_many({})
+        self.mongo.stats_hourly_collection.delete_many({})
+        self.mongo._seed_stats_if_needed()
+
+    def verify(self) -> bool:
+        """השוואת מספר השורות בכל טבלה מול המסמכים שנמצאו במונגו (לפי המפתחות)"""
+        conn = self._connect()
+        ok = True
+        try:
+            checks = {
+                "users": (
+                    "user_id",
+                    lambda rows: self.mongo.users_collection.count_documents(
+                        {"user_id": {"$in": [row[1] for row in rows]}}
+                    ),
+                    None
+                ),
+                "watch_topics": (
+                    "id",
+                    lambda rows: self.mongo.watch_topics_collection.count_documents(
+                        {"sqlite_id": {"$in": [row[1] for row in rows]}}
+                    ),
+                    None
+                ),
+                "usage_stats": (
+                    "user_id, month",
+                    lambda rows: self.mongo.usage_stats_collection.count_documents(
+                        {"$or": [{"user_id": row[1], "month": row[2]} for row in rows]}
+                    ),
+                    None
+                ),
+                "found_results": (
+                    "id",
+                    lambda rows: self.mongo.found_results_collection.count_documents(
+                        {"sqlite_id": {"$in": [row[1] for row in rows]}}
+                    ),
+                    # רק תוצאות בתוך תקופת השמירה מועברות במלואן
+                    "found_at >= ?"
+                ),
+            }
+            for table, (columns, count_in_mongo, condition) in checks.items():
+                if not self._table_exists(conn, table):
+                    continue
+                expected = found = 0
+                after_rowid = 0
+                while True:
+                    where = "rowid > ?" + (f" AND {condition}" if condition else "")
+                    params = [after_rowid] + ([self.results_cutoff.strftime("%Y-%m-%d %H:%M:%S")] if condition else [])
+                    rows = conn.execute(
+                        f"SELECT rowid, {columns} FROM {table} WHERE {where} ORDER BY rowid LIMIT ?",
+                        (*params, self.batch_size)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    expected += len(rows)
+                    found += count_in_mongo(rows)
+                    after_rowid = rows[-1][0]
+
+                if found == expected:
+                    logger.info(f"✅ {table}: {found}/{expected} rows present in MongoDB")
+                else:
+                    logger.error(f"❌ {table}: only {found}/{expected} rows present in MongoDB")
+                    ok = False
+        finally:
+            conn.close()
+        return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate WatchBot data from SQLite to MongoDB")
+    parser.add_argument("--sqlite-path", default=SOURCE_DB_PATH, help="source SQLite database (default: $DB_PATH)")
+    parser.add_argument("--mongodb-uri", default=MONGODB_URI, help="target MongoDB URI (default: $MONGODB_URI)")
+    parser.add_argument("--db-name", default=MONGODB_DB_NAME, help="target database (default: $MONGODB_DB_NAME)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per batch (default: 1000)")
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints and migrate everything again")
+    parser.add_argument("--verify-only", action="store_true", help="only compare row counts")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.sqlite_path):
+        print(f"❌ SQLite database not found: {args.sqlite_path}")
+        return False
+
+    mongo = WatchBotMongoDB(args.mongodb_uri, args.db_name)
+    migrator = Migrator(args.sqlite_path, mongo, args.batch_size)
+
+    try:
+        if not args.verify_only:
+            if args.restart:
+                migrator.reset()
+            print(f"🔄 Migrating {args.sqlite_path} -> {args.db_name} (batch size {args.batch_size})")
+            migrator.migrate()
+
+        print("🔍 Verifying row counts...")
+        if migrator.verify():
+            print("🎉 Migration verified")
+            return True
+        print("❌ Verification failed - re-run the migration to resume")
+        return False
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e} - re-run to resume from the last checkpoint")
+        logger.exception("Migration failed")
+        return False
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+    finally:
+        shutil.rmtree(_SCRATCH_DIR, ignore_errors=True)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,260 @@
+"""
+שכבת ספקי חיפוש - Perplexity ו-Tavily מאחורי ממשק אחד.
+הנתב בוחר ספק לפי זמני התגובה ושיעור השגיאות האחרונים, או שולח לכמה ספקים במקביל
+(הראשון שעונה מנצח, או מיזוג התוצאות) ומחשב את עלות החיפוש בקרדיטים.
+"""
+import logging
+import threading
+from abc import ABC, abstractmethod
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed, wait
+
+from circuit_breaker import CircuitBreaker
+from tracing import propagate, span
+
+logger = logging.getLogger(__name__)
+
+ROUTE = "route"
+FASTEST = "fastest"
+MERGE = "merge"
+MODES = (ROUTE, FASTEST, MERGE)
+
+
+class SearchProvider(ABC):
+    """ממשק בסיס לספק חיפוש - search מחזיר תוצאות בפורמט title/url/summary, אחרי סינון"""
+
+    name = "base"
+
+    def __init__(self, cost: int = 1):
+        """cost: כמה קרדיטים עולה חיפוש אחד אצל הספק"""
+        self.cost = cost
+
+    def available(self) -> bool:
+        """האם הספק זמין כרגע (למשל המפסק שלו לא פתוח)"""
+        return True
+
+    @abstractmethod
+    def search(self, query: str, skip_url=None, history_key=None, watermark: dict = None, deadline=None) -> list:
+        """חיפוש - חריגה מסמנת כשלון של הספק"""
+
+
+class PerplexityProvider(SearchProvider):
+    """Perplexity (sonar-pro) - עוטף את perform_search"""
+
+    name = "perplexity"
+
+    def __init__(self, search_func, breaker: CircuitBreaker, cost: int = 1):
+        """
+        search_func: perform_search
+        breaker: מפסק הזרם שבתוך perform_search
+        """
+        super().__init__(cost)
+        self.search_func = search_func
+        self.breaker = breaker
+
+    def available(self) -> bool:
+        return self.breaker.available()
+
+    def search(self, query, skip_url=None, history_key=None, watermark=None, deadline=None) -> list:
+        return self.search_func(
+            query, skip_url=skip_url, history_key=history_key, watermark=watermark,
+            deadline=deadline, raise_errors=True
+        )
+
+
+class TavilyProvider(SearchProvider):
+    """Tavily - חיפוש רשת שמחזיר קישורים ותקצירים, שעוברים את אותו סינון כמו של Perplexity"""
+
+    name = "tavily"
+
+    # חלונות הזמן של Tavily (אין חלון של שעה)
+    _TIME_RANGES = {"hour": "day", "day": "day", "week": "week", "month": "month"}
+
+    def __init__(self, api_key: str, process_items, recency_filter=None, cost: int = 1,
+                 max_results: int = 7, timeout: float = 30,
+                 failure_threshold: int = 3, recovery_timeout: float = 120):
+        """
+        process_items: פונקציה (items, query, skip_url, deadline) -> תוצאות מסוננות ומדורגות
+        recency_filter: פונקציה שמחזירה את חלון הזמן (hour/day/week/month) לפי סימן המים
+        """
+        super().__init__(cost)
+        # tavily-python מותקן רק כשמשתמשים בספק
+        from tavily import TavilyClient
+
+        self.client = TavilyClient(api_key=api_key)
+        self.process_items = process_items
+        self.recency_filter = recency_filter
+        self.max_results = max_results
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(self.name, failure_threshold, recovery_timeout)
+
+    def available(self) -> bool:
+        return self.breaker.available()
+
+    def search(self, query, skip_url=None, history_key=None, watermark=None, deadline=None) -> list:
+        options = {}
+        window = self.recency_filter(watermark) if self.recency_filter and watermark else None
+        if window:
+            options["time_range"] = self._TIME_RANGES[window]
+
+        if deadline is not None:
+            deadline.check()
+        with self.breaker.guard():
+            response = self.client.search(
+                query=query,
+                search_depth="advanced",
+                max_results=self.max_results,
+                timeout=deadline.timeout(self.timeout) if deadline is not None else self.timeout,
+                **options
+            )
+
+        items = [
+            {
+                'title': item.get('title'),
+                'url': item.get('url'),
+                'summary': (item.get('content') or '')[:300],
+            }
+            for item in (response or {}).get('results', [])
+        ]
+        return self.process_items(items, query, skip_url, deadline)
+
+
+class ProviderStats:
+    """ממוצע נע של זמן התגובה ושיעור השגיאות של ספק"""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, failed: bool):
+        with self._lock:
+            self.samples += 1
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+            self.error_rate += self.alpha * ((1.0 if failed else 0.0) - self.error_rate)
+
+    def score(self, error_penalty: float) -> float:
+        """ציון לניתוב - נמוך יותר עדיף"""
+        return (self.latency or 0.0) * (1 + error_penalty * self.error_rate)
+
+
+class SearchRouter:
+    """ניתוב חיפושים בין ספקים וחישוב העלות"""
+
+    def __init__(self, providers: list, mode: str = ROUTE, min_samples: int = 3,
+                 error_penalty: float = 4.0, alpha: float = 0.2):
+        """
+        mode: route - ספק אחד לפי ביצועים (עם מעבר לבא אם נכשל),
+              fastest - כל הספקים במקביל והתשובה הראשונה עם תוצאות מנצחת,
+              merge - כל הספקים במקביל ומיזוג התוצאות
+        min_samples: ספק עם פחות חיפושים מזה מקבל עדיפות, כדי שיהיו עליו נתונים
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown search provider mode: {mode}")
+        self.providers = providers
+        self.mode = mode
+        self.min_samples = min_samples
+        self.error_penalty = error_penalty
+        self.stats = {provider.name: ProviderStats(alpha) for provider in providers}
+        self._executor = ThreadPoolExecutor(max_workers=max(len(providers), 1) * 4, thread_name_prefix="search-provider")
+
+    def available(self) -> bool:
+        """האם יש לפחות ספק אחד זמין"""
+        return any(provider.available() for provider in self.providers)
+
+    def ranked_providers(self) -> list:
+        """הספקים הזמינים, מהמועדף לפחות מועדף"""
+        available = [provider for provider in self.providers if provider.available()]
+        return sorted(available, key=lambda provider: (
+            self.stats[provider.name].samples >= self.min_samples,
+            self.stats[provider.name].score(self.error_penalty),
+        ))
+
+    def _run(self, provider: SearchProvider, query: str, options: dict):
+        """חיפוש אצל ספק אחד עם מדידה - מחזיר None אם נכשל"""
+        started = time.monotonic()
+        try:
+            with span("provider", provider=provider.name):
+                results = provider.search(query, **options)
+        except Exception as e:
+            self.stats[provider.name].record(time.monotonic() - started, failed=True)
+            logger.warning(f"Search provider {provider.name} failed: {e}")
+            return None
+        self.stats[provider.name].record(time.monotonic() - started, failed=False)
+        return results
+
+    def search(self, query: str, **options) -> dict:
+        """
+        חיפוש לפי מצב הניתוב.
+        options: skip_url, history_key, watermark, deadline - מועברים לספקים
+        מחזיר {'results', 'providers' (שנקראו), 'cost' (סכום העלויות שלהם)}
+        """
+        providers = self.ranked_providers()
+        if self.mode == ROUTE or len(providers) < 2:
+            return self._search_route(providers, query, options)
+        return self._search_fan_out(providers, query, options)
+
+    def _search_route(self, providers: list, query: str, options: dict) -> dict:
+        called = []
+        for provider in providers:
+            called.append(provider)
+            results = self._run(provider, query, options)
+            if results is not None:
+                return self._outcome(results, called)
+            deadline = options.get('deadline')
+            if deadline is not None and deadline.expired():
+                break
+        return self._outcome([], called)
+
+    def _search_fan_out(self, providers: list, query: str, options: dict) -> dict:
+        futures = {self._executor.submit(propagate(self._run), provider, query, options): provider for provider in providers}
+        deadline = options.get('deadline')
+        timeout = deadline.remaining() if deadline is not None else None
+
+        if self.mode == FASTEST:
+            try:
+                for future in as_completed(futures, timeout=timeout):
+                    results = future.result()
+                    if results:
+                        logger.info(f"Search provider {futures[future].name} answered first")
+                        return self._outcome(results, providers)
+            except FuturesTimeoutError:
+                logger.warning("Search providers did not answer before the check deadline")
+            return self._outcome([], providers)
+
+        done, _ = wait(futures, timeout=timeout)
+        merged = []
+        seen_urls = set()
+        for future in done:
+            for result in future.result() or []:
+                if result.url not in seen_urls:
+                    seen_urls.add(result.url)
+                    merged.append(result)
+        merged.sort(key=lambda result: result.relevance_score, reverse=True)
+        return self._outcome(merged, providers)
+
+    @staticmethod
+    def _outcome(results: list, called: list) -> dict:
+        return {
+            'results': results,
+            'providers': [provider.name for provider in called],
+            'cost': sum(provider.cost for provider in called),
+        }
+
+    def snapshot(self) -> list:
+        """מצב הספקים לתצוגה - שם, זמינות, זמן תגובה ממוצע ושיעור שגיאות"""
+        return [
+            {
+                'name': provider.name,
+                'available': provider.available(),
+                'latency': self.stats[provider.name].latency,
+                'error_rate': self.stats[provider.name].error_rate,
+                'samples': self.stats[provider.name].samples,
+            }
+            for provider in self.providers
+        ]
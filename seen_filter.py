@@ -0,0 +1,180 @@
+"""
+מסנני Bloom לפי נושא - בדיקה בזיכרון אם תוצאה כבר נראתה, לפני פנייה לבסיס הנתונים.
+תשובה "לא נראתה" ודאית; תשובה "נראתה" שגויה בהסתברות error_rate בלבד.
+"""
+import hashlib
+import logging
+import math
+import os
+import struct
+import threading
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<QIII")  # bits, hashes, count, capacity
+
+
+class BloomFilter:
+    """מסנן Bloom פשוט על bytearray עם double hashing"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.capacity = capacity
+        self.count = 0
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.sha256(key.encode('utf-8')).digest()
+        h1, h2 = struct.unpack_from("<QQ", digest)
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        """הוספת מפתח למסנן"""
+        new = False
+        for pos in self._positions(key):
+            mask = 1 << (pos & 7)
+            if not self.bits[pos >> 3] & mask:
+                self.bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def to_bytes(self) -> bytes:
+        """סריאליזציה לשמירה בדיסק"""
+        return _HEADER.pack(self.num_bits, self.num_hashes, self.count, self.capacity) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """טעינה מ-snapshot"""
+        num_bits, num_hashes, count, capacity = _HEADER.unpack_from(data)
+        bloom = cls.__new__(cls)
+        bloom.num_bits = num_bits
+        bloom.num_hashes = num_hashes
+        bloom.capacity = capacity
+        bloom.count = count
+        bloom.bits = bytearray(data[_HEADER.size:])
+        if len(bloom.bits) != (num_bits + 7) // 8:
+            raise ValueError("corrupted bloom filter snapshot")
+        return bloom
+
+
+class SeenResultsFilter:
+    """מסנן Bloom לכל נושא - נבנה בעצלות מטביעות האצבע בבסיס הנתונים ונשמר מדי פעם לדיסק"""
+
+    def __init__(self, loader, snapshot_dir: str, capacity: int = 1000,
+                 error_rate: float = 0.001, max_topics: int = 5000):
+        """
+        loader: פונקציה שמקבלת topic_id ומחזירה את כל טביעות האצבע השמורות לנושא
+        snapshot_dir: תיקייה לשמירת המסננים בין הפעלות
+        """
+        self.loader = loader
+        self.snapshot_dir = snapshot_dir
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._filters = TTLCache(maxsize=max_topics, ttl=24 * 3600)
+        self._dirty = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    def _snapshot_path(self, topic_id) -> str:
+        return os.path.join(self.snapshot_dir, f"{topic_id}.bloom")
+
+    def _build(self, topic_id) -> BloomFilter:
+        fingerprints = list(self.loader(topic_id))
+        bloom = BloomFilter(max(self.capacity, len(fingerprints) * 2), self.error_rate)
+        for fingerprint in fingerprints:
+            bloom.add(fingerprint)
+        logger.debug(f"Built seen-results filter for topic {topic_id} from {len(fingerprints)} fingerprints")
+        return bloom
+
+    def _get(self, topic_id) -> BloomFilter:
+        bloom = self._filters.get(topic_id)
+        if bloom is not None:
+            return bloom
+
+        with self._lock:
+            bloom = self._filters.get(topic_id)
+            if bloom is not None:
+                return bloom
+            path = self._snapshot_path(topic_id)
+            try:
+                with open(path, 'rb') as f:
+                    bloom = BloomFilter.from_bytes(f.read())
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable seen-results snapshot {path}: {e}")
+            if bloom is None:
+                bloom = self._build(topic_id)
+                self._dirty.add(topic_id)
+            self._filters.set(topic_id, bloom)
+            return bloom
+
+    def might_contain(self, topic_id, *fingerprints) -> bool:
+        """True אם אחת מטביעות האצבע כנראה כבר נראתה בנושא"""
+        try:
+            bloom = self._get(topic_id)
+        except Exception as e:
+            logger.error(f"Seen-results filter unavailable for topic {topic_id}: {e}")
+            return False
+        return any(fingerprint in bloom for fingerprint in fingerprints)
+
+    def add(self, topic_id, *fingerprints):
+        """עדכון המסנן אחרי שתוצאה נשמרה"""
+        try:
+            bloom = self._get(topic_id)
+        except Exception as e:
+            logger.error(f"Seen-results filter unavailable for topic {topic_id}: {e}")
+            return
+        with self._lock:
+            for fingerprint in fingerprints:
+                bloom.add(fingerprint)
+            self._dirty.add(topic_id)
+            if bloom.count > bloom.capacity:
+                # המסנן התמלא ושיעור השגיאה עולה - ייבנה מחדש בגודל כפול בגישה הבאה
+                self._filters.pop(topic_id)
+                self._dirty.discard(topic_id)
+                self._remove_snapshot(topic_id)
+
+    def discard(self, *topic_ids):
+        """הסרת המסננים (וה-snapshots) של נושאים שהוסרו או הסתיימו"""
+        with self._lock:
+            for topic_id in topic_ids:
+                self._filters.pop(topic_id)
+                self._dirty.discard(topic_id)
+                self._remove_snapshot(topic_id)
+
+    def _remove_snapshot(self, topic_id):
+        try:
+            os.remove(self._snapshot_path(topic_id))
+        except FileNotFoundError:
+            pass
+
+    def snapshot(self) -> int:
+        """שמירת המסננים שהשתנו לדיסק - מחזיר כמה נשמרו"""
+        with self._lock:
+            dirty = [(topic_id, self._filters.get(topic_id)) for topic_id in self._dirty]
+            self._dirty.clear()
+
+        saved = 0
+        for topic_id, bloom in dirty:
+            if bloom is None:
+                continue
+            path = self._snapshot_path(topic_id)
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(bloom.to_bytes())
+                os.replace(tmp_path, path)
+                saved += 1
+            except Exception as e:
+                logger.error(f"Failed to snapshot seen-results filter for topic {topic_id}: {e}")
+        return saved
@@ -0,0 +1,187 @@
+"""
+מאגר מצבי שיחה (user_states) עם תפוגה ומגבלת גודל.
+תומך בשלושה סוגי אחסון: זיכרון, SQLite ו-MongoDB.
+"""
+import json
+import logging
+from abc import ABC, abstractmethod
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class BaseStateStore(ABC):
+    """ממשק משותף - מתנהג כמו dict של user_id -> מצב"""
+
+    @abstractmethod
+    def get(self, user_id, default=None):
+        """המצב של המשתמש, או default אם אין (או שפג תוקפו)"""
+
+    @abstractmethod
+    def set(self, user_id, state: dict):
+        """שמירת מצב למשתמש (עם תפוגה)"""
+
+    @abstractmethod
+    def pop(self, user_id, default=None):
+        """הסרת המצב של המשתמש והחזרתו, או default אם אין"""
+
+    def __contains__(self, user_id) -> bool:
+        return self.get(user_id, _MISSING) is not _MISSING
+
+    def __getitem__(self, user_id):
+        state = self.get(user_id, _MISSING)
+        if state is _MISSING:
+            raise KeyError(user_id)
+        return state
+
+    def __setitem__(self, user_id, state: dict):
+        self.set(user_id, state)
+
+    def __delitem__(self, user_id):
+        if self.pop(user_id, _MISSING) is _MISSING:
+            raise KeyError(user_id)
+
+
+class MemoryStateStore(BaseStateStore):
+    """מצבי שיחה בזיכרון התהליך בלבד"""
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self._cache = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+
+    def get(self, user_id, default=None):
+        return self._cache.get(user_id, default)
+
+    def set(self, user_id, state: dict):
+        self._cache.set(user_id, state)
+
+    def pop(self, user_id, default=None):
+        return self._cache.pop(user_id, default)
+
+
+class SQLiteStateStore(BaseStateStore):
+    """מצבי שיחה בטבלת SQLite - שורדים הפעלה מחדש"""
+
+    def __init__(self, db_path: str, ttl_seconds: int, max_entries: int):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                user_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_conversation_states_expires ON conversation_states (expires_at)')
+        conn.commit()
+        conn.close()
+
+    def get(self, user_id, default=None):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT state FROM conversation_states
+            WHERE user_id = ? AND expires_at > ?
+        ''', (user_id, time.time()))
+        row = cursor.fetchone()
+        conn.close()
+        return json.loads(row[0]) if row else default
+
+    def set(self, user_id, state: dict):
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO conversation_states (user_id, state, expires_at)
+            VALUES (?, ?, ?)
+        ''', (user_id, json.dumps(state, ensure_ascii=False), now + self.ttl_seconds))
+
+        # ניקוי רשומות שפג תוקפן ושמירה על מגבלת הגודל
+        cursor.execute('DELETE FROM conversation_states WHERE expires_at <= ?', (now,))
+        cursor.execute('''
+            DELETE FROM conversation_states WHERE user_id IN (
+                SELECT user_id FROM conversation_states
+                ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+        conn.commit()
+        conn.close()
+
+    def pop(self, user_id, default=None):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT state, expires_at FROM conversation_states WHERE user_id = ?
+        ''', (user_id,))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute('DELETE FROM conversation_states WHERE user_id = ?', (user_id,))
+            conn.commit()
+        conn.close()
+        if not row or row[1] <= time.time():
+            return default
+        return json.loads(row[0])
+
+
+class MongoStateStore(BaseStateStore):
+    """מצבי שיחה בקולקשן MongoDB - משותפים בין כמה מופעים של הבוט"""
+
+    def __init__(self, database, ttl_seconds: int, max_entries: int):
+        self.collection = database.conversation_states
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        try:
+            # אינדקס TTL - מונגו מוחק רשומות שפג תוקפן בעצמו
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            logger.error(f"Error creating conversation_states TTL index: {e}")
+
+    def get(self, user_id, default=None):
+        doc = self.collection.find_one({"_id": user_id, "expires_at": {"$gt": datetime.utcnow()}})
+        return doc["state"] if doc else default
+
+    def set(self, user_id, state: dict):
+        self.collection.replace_one(
+            {"_id": user_id},
+            {"state": state, "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)},
+            upsert=True
+        )
+
+        # שמירה על מגבלת הגודל - מחיקת הרשומות הישנות ביותר
+        overflow = self.collection.estimated_document_count() - self.max_entries
+        if overflow > 0:
+            oldest = self.collection.find({}, {"_id": 1}).sort("expires_at", 1).limit(overflow)
+            self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in oldest]}})
+
+    def pop(self, user_id, default=None):
+        doc = self.collection.find_one_and_delete({"_id": user_id})
+        if not doc or doc["expires_at"] <= datetime.utcnow():
+            return default
+        return doc["state"]
+
+
+def create_state_store(backend: str, ttl_seconds: int, max_entries: int, db_path: str = None, mongo_db=None):
+    """
+    יצירת מאגר מצבי שיחה לפי סוג האחסון
+    backend: memory / sqlite / mongo
+    """
+    backend = (backend or "memory").lower()
+    try:
+        if backend == "sqlite":
+            return SQLiteStateStore(db_path, ttl_seconds, max_entries)
+        if backend == "mongo":
+            if mongo_db is None:
+                raise ValueError("MongoDB state store requires USE_MONGODB=true")
+            return MongoStateStore(mongo_db, ttl_seconds, max_entries)
+    except Exception as e:
+        logger.error(f"Failed to create '{backend}' state store, falling back to memory: {e}")
+    return MemoryStateStore(ttl_seconds, max_entries)
@@ -0,0 +1,352 @@
+"""
+מעקב (tracing) קל משקל לבדיקות נושאים.
+כל בדיקה מקבלת מזהה (correlation id) ועץ של מקטעים (spans) עם זמנים לכל שלב בדרך -
+ניתוח השאילתה, קריאות החיפוש, בדיקות הקישורים, התרגום, השמירה והשליחה.
+המזהה מתווסף לכל שורת לוג שנכתבת בזמן הבדיקה, והעץ המלא נשמר בסוף הבדיקה
+כשורת JSON לקובץ ו/או נשלח ל-collector מקומי ב-OTLP/HTTP.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """שלב אחד בבדיקה - שם, זמנים, מאפיינים והמקטע שמעליו"""
+
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace, parent_id: str = None, attributes: dict = None):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+
+class Trace:
+    """כל המקטעים של בדיקה אחת - נאספים מכל ה-threads שהשתתפו בה"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @property
+    def correlation_id(self) -> str:
+        """מזהה קצר לשורות הלוג"""
+        return self.trace_id[:12]
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self, root: Span) -> dict:
+        """עץ המקטעים (כל מקטע עם הילדים שלו) לשורת JSON אחת"""
+        with self._lock:
+            spans = list(self.spans)
+        children = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+
+        def build(span: Span) -> dict:
+            node = {
+                "name": span.name,
+                "span_id": span.span_id,
+                "start": span.start_ns / 1e9,
+                "duration_ms": round(span.duration_ms, 3),
+            }
+            if span.attributes:
+                node["attributes"] = span.attributes
+            if span.error:
+                node["error"] = span.error
+            kids = sorted(children.get(span.span_id, []), key=lambda child: child.start_ns)
+            if kids:
+                node["children"] = [build(child) for child in kids]
+            return node
+
+        return {"trace_id": self.trace_id, "correlation_id": self.correlation_id, **build(root)}
+
+
+class _NoopSpan:
+    """מקטע ריק - מחוץ לבדיקה לא נאסף כלום"""
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span():
+    """המקטע הפעיל כרגע (או מקטע ריק מחוץ לבדיקה)"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def correlation_id():
+    """מזהה הבדיקה הנוכחית, או None מחוץ לבדיקה"""
+    span = _current_span.get()
+    return span.trace.correlation_id if span is not None else None
+
+
+def set_attribute(key: str, value):
+    """הוספת מאפיין למקטע הפעיל"""
+    current_span().set_attribute(key, value)
+
+
+def propagate(func):
+    """
+    עטיפת פונקציה שתרוץ ב-thread אחר (ThreadPoolExecutor) כך שתמשיך את המקטע הנוכחי.
+    asyncio.to_thread מעביר את ההקשר בעצמו; executor.submit ו-map לא.
+    """
+    if _current_span.get() is None:
+        return func
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def run_in_context(*args, **kwargs):
+        # עותק לכל קריאה - אותו הקשר לא יכול לרוץ בכמה threads במקביל
+        return context.copy().run(func, *args, **kwargs)
+    return run_in_context
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """מקטע בתוך הבדיקה הנוכחית - מחוץ לבדיקה לא נאסף כלום"""
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+
+    child = Span(name, parent.trace, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _current_span.reset(token)
+        parent.trace.add(child)
+
+
+def traced(name: str = None):
+    """דקורטור - כל קריאה לפונקציה (רגילה או async) בזמן בדיקה היא מקטע"""
+    def decorator(func):
+        span_name = name or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class JsonLinesExporter:
+    """כתיבת כל בדיקה כשורת JSON לקובץ"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, trace: Trace, root: Span):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(trace.to_dict(root), ensure_ascii=False) + "\n")
+
+
+class OtlpHttpExporter:
+    """שליחה ל-collector של OpenTelemetry בפורמט OTLP/HTTP JSON (למשל http://localhost:4318)"""
+
+    def __init__(self, endpoint: str, service_name: str = "watchbot", timeout: float = 5):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.timeout = timeout
+
+    @staticmethod
+    def _value(value) -> dict:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _span(self, trace: Trace, span: Span) -> dict:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or time.time_ns()),
+            "attributes": [{"key": key, "value": self._value(value)} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        return otlp_span
+
+    def export(self, trace: Trace, root: Span):
+        import requests
+
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{
+                    "scope": {"name": "watchbot.tracing"},
+                    "spans": [self._span(trace, span) for span in list(trace.spans)],
+                }],
+            }]
+        }
+        response = requests.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class Tracer:
+    """פתיחת בדיקות (מקטעי שורש) והעברת בדיקות שהסתיימו לייצוא ב-thread ברקע"""
+
+    def __init__(self, exporters: list = None, slow_threshold: float = 0, max_queue: int = 1000):
+        """
+        exporters: יעדי הייצוא (JsonLinesExporter / OtlpHttpExporter) - בלי יעדים נשמרים רק מזהי הלוג
+        slow_threshold: בדיקה שנמשכה יותר מזה (בשניות) נרשמת ללוג עם השלבים האיטיים שלה (0 = כבוי)
+        """
+        self.exporters = exporters or []
+        self.slow_threshold = slow_threshold
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def start_trace(self, name: str, **attributes):
+        """תחילת בדיקה חדשה (מקטע שורש) - בתוך בדיקה קיימת נפתח מקטע רגיל"""
+        if _current_span.get() is not None:
+            with span(name, **attributes) as nested:
+                yield nested
+            return
+
+        trace = Trace(name)
+        root = Span(name, trace, attributes=attributes)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            root.end_ns = time.time_ns()
+            _current_span.reset(token)
+            trace.add(root)
+            self._finish(trace, root)
+
+    def _finish(self, trace: Trace, root: Span):
+        duration = root.duration_ms / 1000
+        if self.slow_threshold and duration >= self.slow_threshold:
+            logger.warning(
+                "Slow %s (%.1fs) [check %s]: %s", root.name, duration, trace.correlation_id,
+                self._slowest_stages(trace, root)
+            )
+
+        if not self.exporters:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((trace, root))
+        except queue.Full:
+            logger.warning(f"Trace export queue is full, dropping trace {trace.correlation_id}")
+
+    @staticmethod
+    def _slowest_stages(trace: Trace, root: Span, limit: int = 5) -> str:
+        """סיכום השלבים האיטיים - סך הזמן לפי שם מקטע"""
+        totals = {}
+        for span in trace.spans:
+            if span is not root:
+                totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        slowest = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return ", ".join(f"{name}={total:.0f}ms" for name, total in slowest)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+                    self._thread.start()
+
+    def _export_loop(self):
+        while True:
+            trace, root = self._queue.get()
+            for exporter in self.exporters:
+                try:
+                    exporter.export(trace, root)
+                except Exception as e:
+                    logger.warning(f"Failed to export trace {trace.correlation_id} with {type(exporter).__name__}: {e}")
+            self._queue.task_done()
+
+    def flush(self, timeout: float = 5):
+        """המתנה לייצוא הבדיקות שבתור (בכיבוי)"""
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+class CorrelationIdFilter(logging.Filter):
+    """מוסיף לכל רשומת לוג את check_tag - "[check <id>] " בזמן בדיקה, אחרת מחרוזת ריקה"""
+
+    def filter(self, record):
+        check_id = correlation_id()
+        record.check_tag = f"[check {check_id}] " if check_id else ""
+        return True
+
+
+def create_tracer(exporters: str = "", jsonl_path: str = None, otlp_endpoint: str = None,
+                  slow_threshold: float = 0) -> Tracer:
+    """
+    יצירת tracer לפי ההגדרות.
+    exporters: רשימה מופרדת בפסיק של jsonl / otlp (ריק = בלי ייצוא, רק מזהים בלוג)
+    """
+    targets = []
+    for name in [name.strip().lower() for name in (exporters or "").split(",") if name.strip()]:
+        if name == "jsonl":
+            targets.append(JsonLinesExporter(jsonl_path))
+        elif name == "otlp":
+            targets.append(OtlpHttpExporter(otlp_endpoint))
+        else:
+            logger.warning(f"Unknown trace exporter '{name}', ignoring")
+    return Tracer(targets, slow_threshold=slow_threshold)
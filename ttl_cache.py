@@ -0,0 +1,86 @@
+"""
+מטמון פשוט בזיכרון עם תפוגה (TTL) ומגבלת גודל
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """מטמון LRU עם תפוגת רשומות - בטוח לשימוש מכמה threads"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        """
+        maxsize: מספר הרשומות המקסימלי - הישנה ביותר נזרקת כשעוברים את המגבלה
+        ttl: זמן חיים של רשומה בשניות
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """קבלת ערך - מחזיר default אם לא קיים או שפג תוקפו"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """שמירת ערך (עם TTL אופציונלי לרשומה בודדת)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """הסרת ערך והחזרתו"""
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        if item is _MISSING or item[1] <= time.monotonic():
+            return default
+        return item[0]
+
+    def clear(self):
+        """ניקוי כל המטמון"""
+        with self._lock:
+            self._data.clear()
+
+    def purge_expired(self) -> int:
+        """מחיקת כל הרשומות שפג תוקפן - מחזיר כמה נמחקו"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._data.items() if expires_at <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,225 @@
+"""
+תור עבודה עמיד לבדיקות נושאים - המתזמן מכניס בדיקות לתור,
+ותהליכי worker לוקחים אותן (claim) עם זמן נראות מוגבל ומאשרים בסיום.
+בדיקה שה-worker שלה נפל חוזרת לתור אחרי שזמן הנראות פג.
+"""
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteWorkQueue:
+    """תור בדיקות בטבלת SQLite"""
+
+    def __init__(self, db_path: str, max_attempts: int = 5):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS topic_check_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic_id INTEGER NOT NULL UNIQUE,
+                user_id INTEGER NOT NULL,
+                attempts INTEGER DEFAULT 0,
+                available_at REAL NOT NULL,
+                claimed_by TEXT,
+                enqueued_at REAL NOT NULL,
+                last_error TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_topic_check_queue_available ON topic_check_queue (available_at)')
+        conn.commit()
+        conn.close()
+
+    def enqueue(self, topic_id, user_id: int) -> bool:
+        """הכנסת בדיקה לתור - מחזיר False אם כבר יש בדיקה ממתינה לנושא"""
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR IGNORE INTO topic_check_queue (topic_id, user_id, available_at, enqueued_at)
+            VALUES (?, ?, ?, ?)
+        ''', (topic_id, user_id, now, now))
+        added = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return added
+
+    def claim(self, worker_id: str, visibility_timeout: int) -> dict:
+        """לקיחת הבדיקה הבאה - היא מוסתרת מ-workers אחרים למשך visibility_timeout שניות"""
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        cursor = conn.cursor()
+        try:
+            while True:
+                now = time.time()
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('''
+                    SELECT id, topic_id, user_id, attempts FROM topic_check_queue
+                    WHERE available_at <= ?
+                    ORDER BY available_at LIMIT 1
+                ''', (now,))
+                row = cursor.fetchone()
+                if not row:
+                    cursor.execute('COMMIT')
+                    return None
+
+                job_id, topic_id, user_id, attempts = row
+                if attempts >= self.max_attempts:
+                    # בדיקה שנכשלה שוב ושוב - מוציאים מהתור
+                    cursor.execute('DELETE FROM topic_check_queue WHERE id = ?', (job_id,))
+                    cursor.execute('COMMIT')
+                    logger.error(f"Dropping topic check {topic_id} after {attempts} failed attempts")
+                    continue
+
+                cursor.execute('''
+                    UPDATE topic_check_queue
+                    SET claimed_by = ?, attempts = attempts + 1, available_at = ?
+                    WHERE id = ?
+                ''', (worker_id, now + visibility_timeout, job_id))
+                cursor.execute('COMMIT')
+                return {
+                    'id': job_id,
+                    'topic_id': topic_id,
+                    'user_id': user_id,
+                    'attempts': attempts + 1
+                }
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def ack(self, job: dict, worker_id: str) -> bool:
+        """אישור סיום הבדיקה - מוחק אותה מהתור"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM topic_check_queue WHERE id = ? AND claimed_by = ?', (job['id'], worker_id))
+        acked = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return acked
+
+    def release(self, job: dict, worker_id: str, error: str = None, delay: int = 0) -> bool:
+        """החזרת בדיקה שנכשלה לתור אחרי delay שניות"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE topic_check_queue
+            SET claimed_by = NULL, available_at = ?, last_error = ?
+            WHERE id = ? AND claimed_by = ?
+        ''', (time.time() + delay, error, job['id'], worker_id))
+        released = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return released
+
+    def stats(self) -> dict:
+        """מספר בדיקות ממתינות ובעיבוד"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT
+                SUM(CASE WHEN claimed_by IS NULL OR available_at <= ? THEN 1 ELSE 0 END),
+                SUM(CASE WHEN claimed_by IS NOT NULL AND available_at > ? THEN 1 ELSE 0 END)
+            FROM topic_check_queue
+        ''', (time.time(), time.time()))
+        pending, in_progress = cursor.fetchone()
+        conn.close()
+        return {'pending': pending or 0, 'in_progress': in_progress or 0}
+
+
+class MongoWorkQueue:
+    """תור בדיקות בקולקשן MongoDB"""
+
+    def __init__(self, database, max_attempts: int = 5):
+        self.collection = database.topic_check_queue
+        self.max_attempts = max_attempts
+
+        try:
+            self.collection.create_index("topic_id", unique=True)
+            self.collection.create_index("available_at")
+        except Exception as e:
+            logger.error(f"Error creating topic_check_queue indexes: {e}")
+
+    def enqueue(self, topic_id, user_id: int) -> bool:
+        """הכנסת בדיקה לתור - מחזיר False אם כבר יש בדיקה ממתינה לנושא"""
+        now = datetime.utcnow()
+        result = self.collection.update_one(
+            {"topic_id": topic_id},
+            {"$setOnInsert": {
+                "user_id": user_id,
+                "attempts": 0,
+                "available_at": now,
+                "claimed_by": None,
+                "enqueued_at": now
+            }},
+            upsert=True
+        )
+        return result.upserted_id is not None
+
+    def claim(self, worker_id: str, visibility_timeout: int) -> dict:
+        """לקיחת הבדיקה הבאה - היא מוסתרת מ-workers אחרים למשך visibility_timeout שניות"""
+        from pymongo import ReturnDocument
+
+        while True:
+            now = datetime.utcnow()
+            doc = self.collection.find_one_and_update(
+                {"available_at": {"$lte": now}},
+                {
+                    "$set": {"claimed_by": worker_id, "available_at": now + timedelta(seconds=visibility_timeout)},
+                    "$inc": {"attempts": 1}
+                },
+                sort=[("available_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if not doc:
+                return None
+
+            if doc["attempts"] > self.max_attempts:
+                # בדיקה שנכשלה שוב ושוב - מוציאים מהתור
+                self.collection.delete_one({"_id": doc["_id"], "claimed_by": worker_id})
+                logger.error(f"Dropping topic check {doc['topic_id']} after {doc['attempts'] - 1} failed attempts")
+                continue
+
+            return {
+                'id': doc["_id"],
+                'topic_id': doc["topic_id"],
+                'user_id': doc["user_id"],
+                'attempts': doc["attempts"]
+            }
+
+    def ack(self, job: dict, worker_id: str) -> bool:
+        """אישור סיום הבדיקה - מוחק אותה מהתור"""
+        result = self.collection.delete_one({"_id": job['id'], "claimed_by": worker_id})
+        return result.deleted_count > 0
+
+    def release(self, job: dict, worker_id: str, error: str = None, delay: int = 0) -> bool:
+        """החזרת בדיקה שנכשלה לתור אחרי delay שניות"""
+        result = self.collection.update_one(
+            {"_id": job['id'], "claimed_by": worker_id},
+            {"$set": {
+                "claimed_by": None,
+                "available_at": datetime.utcnow() + timedelta(seconds=delay),
+                "last_error": error
+            }}
+        )
+        return result.modified_count > 0
+
+    def stats(self) -> dict:
+        """מספר בדיקות ממתינות ובעיבוד"""
+        now = datetime.utcnow()
+        in_progress = self.collection.count_documents({"claimed_by": {"$ne": None}, "available_at": {"$gt": now}})
+        total = self.collection.estimated_document_count()
+        return {'pending': max(total - in_progress, 0), 'in_progress': in_progress}
+
+
+def create_work_queue(max_attempts: int, db_path: str = None, mongo_db=None):
+    """יצירת תור בדיקות על בסיס הנתונים הפעיל"""
+    if mongo_db is not None:
+        return MongoWorkQueue(mongo_db, max_attempts)
+    return SQLiteWorkQueue(db_path, max_attempts)